@@ -0,0 +1,191 @@
+import math
+import numpy as np
+
+# No-arbitrage scanner for the option chain and its future.
+# The touch (best bid / ask and their sizes) of every call, put and the
+# future is kept in arrays indexed by strike. A scan tests every relation
+# below on the whole chain at once, with prices that could actually be
+# traded (sell at the bid, buy at the ask) and a fee per share per leg:
+# - put-call parity: C - P = F - K*disc, via conversions and reversals
+#   against the future
+# - bounds: max(F - K*disc, 0) <= C <= F, max(K*disc - F, 0) <= P <= K*disc
+# - monotonicity in strike for every pair K1 < K2: calls fall, puts rise, and
+#   neither moves by more than (K2 - K1)*disc
+# - convexity over neighbouring strikes: butterflies cost at least nothing
+# Every violation left after fees comes back as a bundle: its legs as
+# (ticker, buy, ratio, price), the edge per bundle, and how many bundles the
+# touch sizes allow. Bundles are ranked by edge times that quantity. The
+# bounds use the live future, not the register-time intrinsic values (those
+# assume spot at 100). The strike pairs and butterfly ratios are built once
+# per chain, and a scan with no touch changed since the last one (same expiry
+# and rate) returns the last result.
+
+class ArbitrageScanner:
+    def __init__(self, tickers, calls, strikes, future='TMXFUT', fee=0.):
+        self.strikes = np.unique(np.asarray(strikes, dtype=float))
+        n = self.strikes.size
+        self.future = future
+        self.fee = fee
+        # row 0 calls, row 1 puts
+        self.names = np.full((2, n), None, dtype=object)
+        self.slot = {}
+        for ticker, call, strike in zip(tickers, calls, strikes):
+            slot = (0 if call else 1, int(np.searchsorted(self.strikes, strike)))
+            self.slot[ticker] = slot
+            self.names[slot] = ticker
+        self.listed = np.vectorize(lambda name: name is not None, otypes=[bool])(self.names)
+        self.bid = np.full((2, n), np.nan)
+        self.ask = np.full((2, n), np.nan)
+        self.bid_size = np.zeros((2, n))
+        self.ask_size = np.zeros((2, n))
+        self.future_quote = (math.nan, math.nan, 0., 0.)
+        self.scans = 0
+        # bumped whenever a touch changes; the last scan is reused while it stays the same
+        self.version = 0
+        self.last = None
+        self.found = []
+        # strike pairs i < j for monotonicity, neighbouring triples and their ratios for convexity
+        self.pairs = np.triu_indices(n, 1)
+        self.pair_strikes = (self.strikes[self.pairs[0]], self.strikes[self.pairs[1]])
+        self.flies = None
+        if n >= 3:
+            k1, k2, k3 = np.arange(n - 2), np.arange(1, n - 1), np.arange(2, n)
+            a, b = np.rint(self.strikes[k2] - self.strikes[k1]).astype(int), np.rint(self.strikes[k3] - self.strikes[k2]).astype(int)
+            g = np.maximum(np.gcd(a, b), 1)
+            self.flies = (k1, k2, k3, a // g, b // g)
+            self.fly_strikes = (self.strikes[k1], self.strikes[k2], self.strikes[k3])
+
+    # Records one ticker's touch (nan prices for an empty side)
+    def update(self, ticker, bid, bid_size, ask, ask_size):
+        if ticker == self.future:
+            quote = (bid, ask, bid_size, ask_size)
+            if not same_quote(quote, self.future_quote):
+                self.future_quote = quote
+                self.version += 1
+            return
+        slot = self.slot.get(ticker)
+        if slot is None:
+            return
+        if same_quote((bid, ask, bid_size, ask_size), (self.bid[slot], self.ask[slot], self.bid_size[slot], self.ask_size[slot])):
+            return
+        self.bid[slot], self.bid_size[slot] = bid, bid_size
+        self.ask[slot], self.ask_size[slot] = ask, ask_size
+        self.version += 1
+
+    # Records a ticker's touch from its order_book.OrderBook
+    def update_book(self, ticker, book):
+        bid, ask = book.best_bid, book.best_ask
+        self.update(ticker, bid, book.levels['bid'].get(bid, 0), ask, book.levels['ask'].get(ask, 0))
+
+    # Takes what `bundles` of a bundle trade off the touch sizes, so the next scan does not
+    # find the same opportunity again before the quotes update
+    def take(self, bundle, bundles):
+        self.version += 1
+        for ticker, buy, ratio, _ in bundle['legs']:
+            if ticker == self.future:
+                fb, fa, fbs, fas = self.future_quote
+                self.future_quote = (fb, fa, fbs, fas - ratio * bundles) if buy else (fb, fa, fbs - ratio * bundles, fas)
+                continue
+            sizes = self.ask_size if buy else self.bid_size
+            sizes[self.slot[ticker]] -= ratio * bundles
+
+    # Every violation worth more than min_edge after fees at this expiry and rate, best first (only
+    # the `limit` best if given)
+    def scan(self, T, r=0., min_edge=0., limit=None):
+        key = (self.version, T, r, min_edge, limit)
+        if key == self.last:
+            return self.found
+        self.last = key
+        self.scans += 1
+        disc = math.exp(-r * T)
+        K = self.strikes
+        Kd = K * disc
+        fb, fa, fbs, fas = self.future_quote
+        (cb, pb), (ca, pa) = self.bid, self.ask
+        (cbs, pbs), (cas, pas) = self.bid_size, self.ask_size
+        fee = self.fee
+        found = []
+        F = self.future
+
+        # parity: sell the synthetic future and buy the real one, or the reverse
+        self.collect(found, min_edge, limit, 'conversion', cb - pa - fa + Kd - 3 * fee, (K,),
+                     lambda: [(0, False, 1, cb, cbs), (1, True, 1, pa, pas), (F, True, 1, fa, fas)])
+        self.collect(found, min_edge, limit, 'reversal', fb - Kd - ca + pb - 3 * fee, (K,),
+                     lambda: [(0, True, 1, ca, cas), (1, False, 1, pb, pbs), (F, False, 1, fb, fbs)])
+
+        # bounds
+        self.collect(found, min_edge, limit, 'call below intrinsic', fb - Kd - ca - 2 * fee, (K,),
+                     lambda: [(0, True, 1, ca, cas), (F, False, 1, fb, fbs)])
+        self.collect(found, min_edge, limit, 'put below intrinsic', Kd - fa - pa - 2 * fee, (K,),
+                     lambda: [(1, True, 1, pa, pas), (F, True, 1, fa, fas)])
+        self.collect(found, min_edge, limit, 'call above future', cb - fa - 2 * fee, (K,),
+                     lambda: [(0, False, 1, cb, cbs), (F, True, 1, fa, fas)])
+        self.collect(found, min_edge, limit, 'put above strike', pb - Kd - fee, (K,), lambda: [(1, False, 1, pb, pbs)])
+
+        # monotonicity, for every pair of strikes i < j
+        i, j = self.pairs
+        pair = self.pair_strikes
+        width = (pair[1] - pair[0]) * disc
+        self.collect(found, min_edge, limit, 'call spread below zero', cb[j] - ca[i] - 2 * fee, pair,
+                     lambda: [((0, i), True, 1, ca[i], cas[i]), ((0, j), False, 1, cb[j], cbs[j])])
+        self.collect(found, min_edge, limit, 'put spread below zero', pb[i] - pa[j] - 2 * fee, pair,
+                     lambda: [((1, j), True, 1, pa[j], pas[j]), ((1, i), False, 1, pb[i], pbs[i])])
+        self.collect(found, min_edge, limit, 'call spread above width', cb[i] - ca[j] - width - 2 * fee, pair,
+                     lambda: [((0, i), False, 1, cb[i], cbs[i]), ((0, j), True, 1, ca[j], cas[j])])
+        self.collect(found, min_edge, limit, 'put spread above width', pb[j] - pa[i] - width - 2 * fee, pair,
+                     lambda: [((1, j), False, 1, pb[j], pbs[j]), ((1, i), True, 1, pa[i], pas[i])])
+
+        # convexity: buy b of K1 and a of K3, sell a + b of K2 (a = K2 - K1, b = K3 - K2, in lowest terms)
+        if self.flies is not None:
+            k1, k2, k3, a, b = self.flies
+            for row, name in ((0, 'call butterfly'), (1, 'put butterfly')):
+                bid, ask, bid_size, ask_size = self.bid[row], self.ask[row], self.bid_size[row], self.ask_size[row]
+                edge = (a + b) * bid[k2] - b * ask[k1] - a * ask[k3] - 2 * (a + b) * fee
+                self.collect(found, min_edge, limit, name, edge, self.fly_strikes,
+                             lambda: [((row, k1), True, b, ask[k1], ask_size[k1]),
+                                      ((row, k2), False, a + b, bid[k2], bid_size[k2]),
+                                      ((row, k3), True, a, ask[k3], ask_size[k3])])
+
+        found.sort(key=lambda bundle: (bundle['profit'], bundle['edge']), reverse=True)
+        self.found = found[:limit]
+        return self.found
+
+    # Turns the entries of an edge array above min_edge into bundles. legs() lists each leg as (where,
+    # buy, ratio, price, size), and is only called if there is a hit: where is 0 / 1 for the call / put
+    # at each strike, a (row, strike indices) pair, or the future's ticker; ratio, price and size are
+    # scalars or arrays aligned with edge. With a limit, only the `limit` best become bundles
+    def collect(self, found, min_edge, limit, kind, edge, strikes, legs):
+        hits = np.flatnonzero(edge > min_edge)
+        if not hits.size:
+            return
+        # only the hits are looked at from here on
+        def at(x):
+            return x[hits] if np.ndim(x) else np.full(hits.size, x)
+        columns = []
+        quantity = np.full(hits.size, np.inf)
+        keep = np.ones(hits.size, dtype=bool)
+        for where, buy, ratio, price, size in legs():
+            if isinstance(where, str):
+                names = [where] * hits.size
+            elif isinstance(where, tuple):
+                names = self.names[where[0], where[1]][hits]
+                keep &= self.listed[where[0], where[1]][hits]
+            else:
+                names = self.names[where][hits]
+                keep &= self.listed[where][hits]
+            ratio = at(ratio)
+            quantity = np.minimum(quantity, at(size) // ratio)
+            columns.append((names, buy, ratio, at(price)))
+        edge = edge[hits]
+        strikes = [at(k) for k in strikes]
+        best = np.flatnonzero(keep & (quantity >= 1))
+        if limit is not None and best.size > limit:
+            best = best[np.lexsort((-edge[best], -edge[best] * quantity[best]))[:limit]]
+        for h in best:
+            found.append({'kind': kind, 'strikes': tuple(float(k[h]) for k in strikes), 'edge': float(edge[h]),
+                          'quantity': int(quantity[h]), 'profit': float(edge[h] * quantity[h]),
+                          'legs': [(names[h], buy, int(ratio[h]), float(price[h])) for names, buy, ratio, price in columns]})
+
+# True if two (bid, ask, bid size, ask size) touches are the same (nan prices compare equal)
+def same_quote(a, b):
+    return all(x == y or (x != x and y != y) for x, y in zip(a, b))
@@ -0,0 +1,409 @@
+import sys
+import os
+import io
+import json
+import time
+import math
+import importlib.util
+import traceback
+import contextlib
+from collections import deque
+import numpy as np
+import latency
+import recorder
+from matching import MatchingEngine
+
+# Offline replay of a case file against a bot, as fast as the CPU allows.
+# The case's pricepaths, news and custom orders are turned into the same
+# message dicts TradersBot hands to the callbacks (ACK REGISTER, MARKET UPDATE,
+# TRADER UPDATE, TRADE, ACK MODIFY ORDERS, NEWS), one tick per second of case
+# time. Orders the bot places are filled by a fill model and the session's PnL
+# is reported at the end.
+#
+# Usage: python backtest.py <bot.py> <case.json> [<case.json> ...]
+# BOT_FILL_MODEL=matching replays against matching.MatchingEngine instead of
+# the synthetic book.
+
+BOOK_LEVELS = 5
+TICK_SIZE = 0.01
+# Cap on messages triggered by order acks/fills within one tick, so a bot that
+# answers every ack with a new order cannot loop forever (the rest are dropped
+# and counted in the result's 'dropped')
+MAX_MESSAGES_PER_TICK = 1000
+
+# Loads a case file
+def load_case(path):
+    with open(path) as f:
+        return json.load(f)
+
+# Loads a fresh copy of a bot module (its globals start from scratch on every call)
+def load_bot(path, params=None):
+    path = os.path.abspath(path)
+    bot_dir = os.path.dirname(path)
+    if bot_dir not in sys.path:
+        sys.path.insert(0, bot_dir)
+    name = '_backtest_%s_%d' % (os.path.splitext(os.path.basename(path))[0], id(params))
+    spec = importlib.util.spec_from_file_location(name, path)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    for key, value in (params or {}).items():
+        if not hasattr(bot, key):
+            raise AttributeError("Bot %s has no parameter %s" % (path, key))
+        setattr(bot, key, value)
+    return bot
+
+# Largest peak-to-trough fall of a PnL path
+def max_drawdown(pnl_path):
+    if len(pnl_path) == 0:
+        return 0.
+    return float(np.max(np.maximum.accumulate(pnl_path) - pnl_path))
+
+# Stand-in for tradersbot.TradersOrder: collects the orders and cancels a callback makes
+class SimOrder:
+    def __init__(self):
+        self.orders = []
+        self.cancels = []
+
+    def addBuy(self, ticker, quantity, price=None, token=None):
+        self.addTrade(ticker, True, quantity, price, token)
+
+    def addSell(self, ticker, quantity, price=None, token=None):
+        self.addTrade(ticker, False, quantity, price, token)
+
+    def addTrade(self, ticker, isBuy, quantity, price=None, token=None):
+        if quantity == 0:
+            return
+        if quantity < 0:
+            quantity *= -1
+            isBuy = not isBuy
+        self.orders.append({'ticker': ticker, 'buy': isBuy, 'quantity': quantity, 'price': price, 'token': token})
+
+    def addCancel(self, ticker, orderId):
+        self.cancels.append({'ticker': ticker, 'order_id': orderId})
+
+    def toJson(self, token=None):
+        pass
+
+# Stand-in for tradersbot.TradersBot: only holds the callbacks
+class SimBot:
+    def __init__(self):
+        for name in ('onAckRegister', 'onMarketUpdate', 'onTraderUpdate', 'onTrade',
+                     'onAckModifyOrders', 'onNews', 'onPing'):
+            setattr(self, name, None)
+
+# Fills against a synthetic book built from the pricepath: BOOK_LEVELS levels each
+# side of the path price, half the path spread away (rounded up to whole ticks, so
+# the levels are distinct ticks), each holding the path volume.
+# Orders crossing the book fill at the touch, the rest rest until a later tick
+# crosses them. Custom orders only trade against resting orders on dark securities.
+class SimpleFillModel:
+    def __init__(self, case):
+        self.case = case
+        self.securities = {ticker: sec for ticker, sec in case['securities'].items() if sec['tradeable']}
+        self.resting = {}
+        self.customs = []
+        self.elapsed = 0
+
+    def path_value(self, ticker, field, t):
+        path = self.securities[ticker]['pricepath'][field]
+        return path[min(t, len(path) - 1)]
+
+    def tick(self, t):
+        self.elapsed = t
+        self.customs = [c for c in self.customs if c['time'] + c['duration'] > t]
+        self.customs += [dict(c) for c in self.case.get('custom_orders', []) if c['time'] == t]
+
+    def last_price(self, ticker):
+        return self.path_value(ticker, 'price', self.elapsed)
+
+    # Synthetic book as {price string: quantity} dicts, like the server sends
+    def book(self, ticker):
+        sec = self.securities[ticker]
+        if sec.get('dark'):
+            return {}, {}
+        t = self.elapsed
+        volume = self.path_value(ticker, 'volume', t)
+        if volume <= 0:
+            return {}, {}
+        # in whole ticks: the price to the nearest tick, half the spread up to the next one
+        price = round(self.path_value(ticker, 'price', t) / TICK_SIZE)
+        half = max(math.ceil(self.path_value(ticker, 'spread', t) / 2 / TICK_SIZE - 1e-9), 1)
+        bids = {'%.2f' % ((price - half - i) * TICK_SIZE): volume for i in range(BOOK_LEVELS)}
+        asks = {'%.2f' % ((price + half + i) * TICK_SIZE): volume for i in range(BOOK_LEVELS)}
+        return bids, asks
+
+    # Fills an order against the synthetic book; returns the fills, rests any remainder
+    def submit(self, order):
+        fills = self.cross(order)
+        if order['quantity'] > 0 and order['price'] is not None:
+            self.resting[order['order_id']] = order
+        return fills
+
+    def cancel(self, order_id):
+        return self.resting.pop(order_id, None) is not None
+
+    # Fills for resting orders that the current tick's book or custom orders cross
+    def match_resting(self):
+        fills = []
+        for order_id in list(self.resting):
+            order = self.resting[order_id]
+            fills += self.cross(order)
+            if order['quantity'] <= 0:
+                del self.resting[order_id]
+        return fills
+
+    def cross(self, order):
+        ticker = order['ticker']
+        fills = []
+        if self.securities[ticker].get('dark'):
+            for custom in self.customs:
+                if order['quantity'] <= 0:
+                    break
+                if custom['ticker'] != ticker or custom['buy'] == order['buy'] or custom['quantity'] <= 0:
+                    continue
+                price = order['price']
+                if price is not None and (price > custom['price'] if not order['buy'] else price < custom['price']):
+                    continue
+                quant = min(order['quantity'], custom['quantity'])
+                custom['quantity'] -= quant
+                fills.append(self.fill(order, quant, custom['price'] if price is None else price))
+            return fills
+
+        bids, asks = self.book(ticker)
+        levels = asks if order['buy'] else bids
+        for key in sorted(levels, key=float, reverse=not order['buy']):
+            if order['quantity'] <= 0:
+                break
+            level = float(key)
+            if order['price'] is not None and (level > order['price'] if order['buy'] else level < order['price']):
+                break
+            fills.append(self.fill(order, min(order['quantity'], levels[key]), level))
+        return fills
+
+    def fill(self, order, quant, price):
+        order['quantity'] -= quant
+        return {'order_id': order['order_id'], 'ticker': order['ticker'], 'buy': order['buy'],
+                'quantity': quant, 'price': price}
+
+# Fill models by name, for BOT_FILL_MODEL (see matching.py for the full matching engine)
+FILL_MODELS = {'simple': SimpleFillModel, 'matching': MatchingEngine}
+
+# One replayed session of a case against a bot module
+class Backtest:
+    def __init__(self, case, bot, fill_model=None, quiet=True):
+        self.case = case
+        self.bot = bot
+        self.quiet = quiet
+        self.meta = case['meta']
+        self.case_length = self.meta['case_length']
+        self.fills = fill_model or SimpleFillModel(case)
+        self.securities = self.fills.securities
+
+        self.sim = SimBot()
+        # mock_server.py drives sessions without an in-process bot
+        if bot is not None:
+            bot.attach(self.sim)
+
+        self.elapsed = 0
+        self.cash = float(sum(self.meta.get('endowment', {}).values()))
+        self.start_cash = self.cash
+        self.positions = {ticker: 0 for ticker in self.securities}
+        self.open_orders = {}
+        self.next_id = 0
+        self.fees = 0.
+        self.fines = 0.
+        self.stats = {'orders': 0, 'cancels': 0, 'rejected': 0, 'fills': 0, 'volume': 0, 'errors': 0, 'dropped': 0}
+        self.first_error = None
+        self.pnl_path = np.zeros(self.case_length)
+        self.pending = deque()
+
+    # Current PnL: cash plus positions marked at the last price
+    def pnl(self):
+        value = sum(quant * self.fills.last_price(ticker) for ticker, quant in self.positions.items())
+        return self.cash + value - self.start_cash
+
+    def market_state(self, ticker):
+        bids, asks = self.fills.book(ticker)
+        return {'ticker': ticker, 'bids': bids, 'asks': asks,
+                'last_price': self.fills.last_price(ticker), 'time': self.elapsed}
+
+    def trader_state(self):
+        open_orders = {order_id: {'order_id': order_id, 'ticker': o['ticker'], 'buy': o['buy'],
+                                  'quantity': o['quantity'], 'price': o['price']}
+                       for order_id, o in self.open_orders.items()}
+        currency = self.meta.get('default_currency', 'USD')
+        return {'cash': {currency: self.cash}, 'positions': dict(self.positions),
+                'open_orders': open_orders, 'pnl': {currency: self.pnl()}, 'time': self.elapsed,
+                'total_fees': self.fees, 'total_fines': self.fines, 'total_rebates': 0}
+
+    # Runs one callback like TradersBot does: fresh order object, exceptions printed not raised
+    def dispatch(self, name, msg):
+        callback = getattr(self.sim, name)
+        if callback is None:
+            return
+        msg['elapsed_time'] = self.elapsed
+        order = SimOrder()
+        out = io.StringIO() if self.quiet else sys.stdout
+        try:
+            with contextlib.redirect_stdout(out):
+                callback(msg, order)
+        except Exception:
+            self.stats['errors'] += 1
+            if self.first_error is None:
+                self.first_error = traceback.format_exc()
+            if not self.quiet:
+                traceback.print_exc()
+        self.execute(order)
+
+    # Applies a callback's cancels and orders, then queues the acks and fills it caused
+    def execute(self, order):
+        if not order.orders and not order.cancels:
+            return
+        cancels = {}
+        for cancel in order.cancels:
+            self.stats['cancels'] += 1
+            order_id = cancel['order_id']
+            if self.fills.cancel(order_id):
+                self.open_orders.pop(order_id, None)
+                cancels[order_id] = None
+            else:
+                cancels[order_id] = 'order not found'
+
+        acked = []
+        fills = []
+        max_open = self.meta.get('max_open_orders', math.inf)
+        for o in order.orders:
+            self.stats['orders'] += 1
+            sec = self.securities.get(o['ticker'])
+            if (sec is None or o['quantity'] > sec.get('maximum_order_size', math.inf)
+                    or o['quantity'] < sec.get('minimum_order_size', 0) or len(self.open_orders) >= max_open):
+                self.stats['rejected'] += 1
+                continue
+            self.next_id += 1
+            o['order_id'] = '%s:%d' % (o['ticker'], self.next_id)
+            acked.append({k: o[k] for k in ('order_id', 'ticker', 'buy', 'quantity', 'price', 'token')})
+            o = dict(o)
+            fills += self.fills.submit(o)
+            if o['quantity'] > 0 and o['price'] is not None:
+                self.open_orders[o['order_id']] = o
+
+        self.pending.append(('onAckModifyOrders', {'message_type': 'ACK MODIFY ORDERS',
+                                                   'cancels': cancels, 'orders': acked}))
+        self.settle(fills)
+
+    # Books fills into cash/positions and queues the TRADE message for them
+    def settle(self, fills):
+        if not fills:
+            return
+        trades = []
+        for f in fills:
+            sign = 1 if f['buy'] else -1
+            fee = f.get('fee', self.securities[f['ticker']].get('fee_amount', 0.) * f['quantity'])
+            fine = f.get('fine', 0.)
+            self.positions[f['ticker']] += sign * f['quantity']
+            self.cash -= sign * f['quantity'] * f['price'] + fee + fine
+            self.fees += fee
+            self.fines += fine
+            self.stats['fills'] += 1
+            self.stats['volume'] += f['quantity']
+            # resting orders are shared with the fill model, which already reduced them
+            resting = self.open_orders.get(f['order_id'])
+            if resting is not None and resting['quantity'] <= 0:
+                del self.open_orders[f['order_id']]
+            trades.append({'trade_id': '%s:t%d' % (f['ticker'], self.stats['fills']), 'ticker': f['ticker'],
+                           'buy_order_id' if f['buy'] else 'sell_order_id': f['order_id'],
+                           'quantity': f['quantity'], 'price': f['price'], 'buy': f['buy'], 'time': self.elapsed})
+        self.pending.append(('onTrade', {'message_type': 'TRADE', 'trades': trades}))
+
+    def drain(self):
+        sent = 0
+        while self.pending and sent < MAX_MESSAGES_PER_TICK:
+            name, msg = self.pending.popleft()
+            self.dispatch(name, msg)
+            sent += 1
+        self.stats['dropped'] += len(self.pending)
+        self.pending.clear()
+
+    def register(self):
+        securities = {ticker: {k: v for k, v in sec.items() if k != 'pricepath'}
+                      for ticker, sec in self.case['securities'].items()}
+        case_meta = dict(self.meta)
+        case_meta.update({'securities': securities, 'underlyings': self.case.get('underlyings', {}),
+                          'news_sources': self.case.get('news_sources', {})})
+        self.fills.tick(0)
+        self.dispatch('onAckRegister', {'message_type': 'ACK REGISTER', 'case_meta': case_meta,
+                                        'market_states': {ticker: self.market_state(ticker) for ticker in self.securities},
+                                        'trader_state': self.trader_state()})
+        self.drain()
+
+    def step(self, t):
+        self.elapsed = t
+        self.fills.tick(t)
+        for news in self.case.get('news', []):
+            if news['time'] == t:
+                self.dispatch('onNews', {'message_type': 'NEWS', 'news': dict(news, price=0)})
+        self.settle(self.fills.match_resting())
+        self.drain()
+        for ticker in self.securities:
+            self.dispatch('onMarketUpdate', {'message_type': 'MARKET UPDATE', 'market_state': self.market_state(ticker)})
+        self.drain()
+        self.dispatch('onTraderUpdate', {'message_type': 'TRADER UPDATE', 'trader_state': self.trader_state()})
+        self.drain()
+        self.pnl_path[t] = self.pnl()
+
+    def run(self):
+        self.register()
+        for t in range(self.case_length):
+            self.step(t)
+        return self.result()
+
+    def result(self):
+        result = dict(self.stats)
+        result.update({'pnl': self.pnl(), 'cash': self.cash, 'fees': self.fees, 'fines': self.fines,
+                       'positions': dict(self.positions), 'pnl_path': self.pnl_path,
+                       'max_drawdown': max_drawdown(self.pnl_path)})
+        if self.first_error is not None:
+            result['first_error'] = self.first_error
+        return result
+
+# Replays one case file against a fresh copy of the bot; params override the bot's module globals
+# record is a directory to record the session's messages and orders into (see recorder.py)
+def run_session(bot_path, case_path, params=None, fill_model=None, quiet=True, profile=False, record=None):
+    case = load_case(case_path)
+    bot = load_bot(bot_path, params)
+    if fill_model is not None:
+        fill_model = fill_model(case)
+    session = Backtest(case, bot, fill_model, quiet)
+    if profile:
+        latency.PROFILER.wrap(session.sim)
+    if record is None:
+        return session.run()
+    rec = recorder.Recorder(record)
+    rec.wrap(session.sim)
+    try:
+        return session.run()
+    finally:
+        rec.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python backtest.py <bot.py> <case.json> [<case.json> ...]")
+        sys.exit(1)
+    enabled, path = latency.profile_setting(os.environ.get('BOT_PROFILE'))
+    if enabled:
+        latency.enable(path=path)
+    record_root = os.environ.get('BOT_RECORD')
+    fill_model = FILL_MODELS[os.environ.get('BOT_FILL_MODEL', 'simple')]
+    for case_path in sys.argv[2:]:
+        start = time.time()
+        record = None
+        if record_root:
+            record = recorder.session_path(record_root, os.path.splitext(os.path.basename(case_path))[0])
+        result = run_session(sys.argv[1], case_path, fill_model=fill_model, profile=enabled, record=record)
+        print("%s: PnL %.2f, %d fills (%d shares), %d orders, %d rejected, %d errors in %.2fs" % (
+            case_path, result['pnl'], result['fills'], result['volume'], result['orders'],
+            result['rejected'], result['errors'], time.time() - start))
+        if result['dropped']:
+            print("%d messages dropped past MAX_MESSAGES_PER_TICK" % result['dropped'])
+        if 'first_error' in result:
+            print(result['first_error'])
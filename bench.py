@@ -0,0 +1,389 @@
+import os
+import io
+import sys
+import json
+import time
+import timeit
+import fnmatch
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+import backtest
+from bs_chain import chain_greeks
+from implied_vol import implied_vol_chain
+from bs_grid import BSGrid
+from arbitrage import ArbitrageScanner
+
+# Microbenchmarks for the pricing and strategy hot paths.
+# Each benchmark times one call of a bot function (or a kernel) on state taken
+# from a warmed-up backtest session: a synthetic option chain of --strikes
+# strikes run for --ticks ticks, or an AlgoS&T sample case. Times are the
+# median per-call cost over REPEATS runs of timeit's autorange.
+#
+# Usage: python bench.py [--strikes 41] [--ticks 30] [--only 'options.*']
+#                        [--save baseline.json] [--compare baseline.json --threshold 0.2]
+#        python bench.py --startup
+# --compare exits with status 1 if any benchmark got slower than the baseline by
+# more than the threshold (a fraction of the baseline time). --startup times each
+# bot's import, register and first tick in fresh interpreters, and exits with
+# status 1 if any of them misses STARTUP_TARGETS (test_startup.py runs the same
+# check under pytest).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+OPTIONS_BOT = os.path.join(HERE, 'shen_wang_options.py')
+ALGOST_BOT = os.path.join(HERE, 'shen_wang_algost.py')
+ALGOST_CASE = os.path.join(HERE, 'AlgoS&T', 'sample_0.json')
+REPEATS = 7
+BENCHMARKS = []
+# seconds allowed for importing each bot, for its register (time until it can trade) and for its
+# first tick of market updates (time to first orders; the options bot reprices its whole chain)
+STARTUP_TARGETS = {'options': {'import': 0.8, 'register': 0.1, 'first_tick': 0.4},
+                   'algost': {'import': 0.4, 'register': 0.05, 'first_tick': 0.05}}
+STARTUP_RUNS = 3
+# run in a fresh interpreter: times the bot's import, then its register and first tick on a case
+STARTUP_SCRIPT = '''
+import sys, json, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+bot = __import__(sys.argv[2])
+imported = time.perf_counter()
+import io, contextlib, backtest
+session = backtest.Backtest(backtest.load_case(sys.argv[3]), bot)
+begin = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    session.register()
+    registered = time.perf_counter()
+    session.step(0)
+print(json.dumps({'import': imported - start, 'register': registered - begin,
+                  'first_tick': time.perf_counter() - registered}))
+'''
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+# Synthetic options case: TMXFUT on a random walk and a call and a put per strike, priced
+# off a quadratic smile with some noise, in the layout of the BarclaysOptions cases
+def options_case(strikes=41, ticks=450, seed=0):
+    rng = np.random.default_rng(seed)
+    spot = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, ticks)))
+    Ks = np.arange(strikes) - strikes // 2 + 100.
+    securities = {'TMXFUT': {'tradeable': True, 'starting_price': 100, 'fee_amount': 0.005,
+                             'maximum_order_size': 1000, 'minimum_order_size': 1, 'dark': False,
+                             'underlyings': {'TMX': 1},
+                             'pricepath': {'price': spot.tolist(), 'spread': [0.05] * ticks, 'volume': [100] * ticks}}}
+    T = (450 - np.arange(ticks)) / (450 * 12.)
+    for K in Ks:
+        x = np.log(K / spot)
+        vol = 0.25 + 0.1 * x + 0.8 * x * x + rng.normal(0, 0.005, ticks)
+        for call, kind in ((True, 'C'), (False, 'P')):
+            price = np.maximum(chain_greeks(np.full(ticks, call), spot, K, T, 0., vol)[0], 0.01).round(2)
+            securities['T%d%s' % (K, kind)] = {
+                'tradeable': True, 'starting_price': price[0], 'fee_amount': 0.005,
+                'maximum_order_size': 1000, 'minimum_order_size': 1, 'dark': False,
+                'pricepath': {'price': price.tolist(), 'spread': [0.1] * ticks, 'volume': [50] * ticks}}
+    return {'securities': securities, 'news': [], 'news_sources': {}, 'custom_orders': [],
+            'underlyings': {'TMX': {'limit': 5000, 'name': 'TMX'}},
+            'meta': {'case_length': ticks, 'max_open_orders': 100, 'loss_limit': -1000000,
+                     'endowment': {'USD': 1000000}, 'default_currency': 'USD', 'interest_rate': {'USD': 0.0}}}
+
+# A backtest session of bot on case, registered and run for ticks ticks
+def warm_session(bot_path, case, ticks):
+    session = backtest.Backtest(case, backtest.load_bot(bot_path))
+    session.register()
+    for t in range(min(ticks, session.case_length)):
+        session.step(t)
+    return session
+
+# Market update messages for every tradeable ticker over the ticks after the session's current one
+def market_messages(session, ticks):
+    msgs = []
+    start = session.elapsed
+    for t in range(start + 1, min(start + 1 + ticks, session.case_length)):
+        session.fills.tick(t)
+        for ticker in session.securities:
+            msgs.append({'message_type': 'MARKET UPDATE', 'market_state': session.market_state(ticker),
+                         'elapsed_time': t})
+    session.fills.tick(start)
+    return msgs
+
+def cycle(items):
+    state = {'i': 0}
+    def next_item():
+        item = items[state['i'] % len(items)]
+        state['i'] += 1
+        return item
+    return next_item
+
+# Clears whatever a benchmarked call queued so repeated calls see the same state
+def reset_orders(bot):
+    bot.ORDERS.batch = []
+    bot.ORDERS.pending = []
+    bot.ORDERS.cancels = {}
+    bot.ORDERS.recount()
+
+## KERNELS
+
+@benchmark('options.calc_price')
+def bench_calc_price(ctx):
+    bot = ctx.options()
+    return lambda: bot.calc_price(True, 100., 105., 0.04, 0., 0.3)
+
+@benchmark('options.calc_vol')
+def bench_calc_vol(ctx):
+    bot = ctx.options()
+    price = bot.calc_price(True, 100., 105., 0.04, 0., 0.3)
+    return lambda: bot.calc_vol(True, price, 100., 105., 0.04, 0.)
+
+@benchmark('py_vollib.implied_volatility')
+def bench_vollib_iv(ctx):
+    from py_vollib.black_scholes import black_scholes
+    from py_vollib.black_scholes.implied_volatility import implied_volatility
+    price = black_scholes('c', 100., 105., 0.04, 0., 0.3)
+    return lambda: implied_volatility(price, 100., 105., 0.04, 0., 'c')
+
+@benchmark('py_vollib.greeks')
+def bench_vollib_greeks(ctx):
+    from py_vollib.black_scholes.greeks.analytical import delta, gamma, vega
+    def greeks():
+        delta('c', 100., 105., 0.04, 0., 0.3)
+        gamma('c', 100., 105., 0.04, 0., 0.3)
+        vega('c', 100., 105., 0.04, 0., 0.3)
+    return greeks
+
+@benchmark('chain.chain_greeks')
+def bench_chain_greeks(ctx):
+    calls, K, sig = ctx.chain()
+    return lambda: chain_greeks(calls, 100., K, 0.04, 0., sig)
+
+@benchmark('chain.implied_vol_chain')
+def bench_implied_vol_chain(ctx):
+    calls, K, sig = ctx.chain()
+    price = chain_greeks(calls, 100., K, 0.04, 0., sig)[0]
+    return lambda: implied_vol_chain(price, calls, 100., K, 0.04, 0.)
+
+# one strike, as a market update solves it
+@benchmark('chain.implied_vol_one')
+def bench_implied_vol_one(ctx):
+    calls, K, sig = ctx.chain()
+    i = len(K) // 2
+    price = chain_greeks(calls[i:i + 1], 100., K[i:i + 1], 0.04, 0., sig[i:i + 1])[0]
+    guess = sig[i:i + 1] * 1.01
+    return lambda: implied_vol_chain(price, calls[i:i + 1], 100., K[i:i + 1], 0.04, 0., guess)
+
+@benchmark('grid.greeks')
+def bench_grid_greeks(ctx):
+    calls, K, sig = ctx.chain()
+    grid = ctx.grid()
+    return lambda: grid.greeks(calls, 100., K, 0.04, 0., sig)
+
+@benchmark('grid.implied_vol')
+def bench_grid_implied_vol(ctx):
+    calls, K, sig = ctx.chain()
+    grid = ctx.grid()
+    price = chain_greeks(calls, 100., K, 0.04, 0., sig)[0]
+    return lambda: grid.implied_vol(price, calls, 100., K, 0.04, 0.)
+
+@benchmark('chain.arbitrage_scan')
+def bench_arbitrage_scan(ctx):
+    calls, K, sig = ctx.chain()
+    tickers = ['T%d%s' % (k, 'C' if call else 'P') for k, call in zip(K, calls)]
+    scanner = ArbitrageScanner(tickers, calls, K, 'TMXFUT', 0.005)
+    for ticker, price in zip(tickers, chain_greeks(calls, 100., K, 0.04, 0., sig)[0]):
+        scanner.update(ticker, round(price - 0.05, 2), 50, round(price + 0.05, 2), 50)
+    scanner.update('TMXFUT', 99.98, 100, 100.02, 100)
+    def scan():
+        # a touch changed, so the last result cannot be reused
+        scanner.version += 1
+        return scanner.scan(0.04)
+    return scan
+
+## OPTIONS BOT
+
+@benchmark('options.make_order')
+def bench_make_order(ctx):
+    bot = ctx.options()
+    security = bot.CHAIN['tickers'][len(bot.CHAIN['tickers']) // 2]
+    def make_order():
+        bot.make_order(None, 'buy', security, 10, 1.)
+        reset_orders(bot)
+    return make_order
+
+# the IV solve of one market update (one option repriced)
+@benchmark('options.update_ivs')
+def bench_update_ivs(ctx):
+    bot = ctx.options()
+    next_security = cycle(bot.CHAIN['tickers'])
+    return lambda: bot.update_ivs((next_security(),), record=False)
+
+@benchmark('options.bb_strategy')
+def bench_bb_strategy(ctx):
+    bot = ctx.options()
+    def bb_strategy():
+        bot.bb_strategy(None)
+        reset_orders(bot)
+    return bb_strategy
+
+@benchmark('options.make_market')
+def bench_make_market(ctx):
+    bot = ctx.options()
+    def make_market():
+        bot.make_market(None)
+        reset_orders(bot)
+    return make_market
+
+@benchmark('options.market_update_method')
+def bench_options_market_update(ctx):
+    bot = ctx.options()
+    next_msg = cycle(market_messages(ctx.options_session, ctx.ticks))
+    def market_update():
+        bot.market_update_method(next_msg(), backtest.SimOrder())
+        reset_orders(bot)
+    return market_update
+
+## ALGOS&T BOT
+
+@benchmark('algost.update_market')
+def bench_algost_market(ctx):
+    bot = ctx.algost()
+    next_msg = cycle(market_messages(ctx.algost_session, ctx.ticks))
+    return lambda: bot.update_market(next_msg(), backtest.SimOrder())
+
+@benchmark('algost.update_news')
+def bench_algost_news(ctx):
+    bot = ctx.algost()
+    next_msg = cycle([{'message_type': 'NEWS', 'news': dict(news, price=0)} for news in ctx.algost_case['news']])
+    def update_news():
+        bot.update_news(next_msg(), backtest.SimOrder())
+        reset_orders(bot)
+    return update_news
+
+# Lazily built sessions shared by the benchmarks
+class Context:
+    def __init__(self, strikes, ticks):
+        self.strikes = strikes
+        self.ticks = ticks
+        self.options_session = None
+        self.algost_session = None
+        self.algost_case = None
+        self.bs_grid = None
+
+    def options(self):
+        if self.options_session is None:
+            case = options_case(self.strikes, max(2 * self.ticks + 2, 60))
+            self.options_session = warm_session(OPTIONS_BOT, case, self.ticks)
+        return self.options_session.bot
+
+    def algost(self):
+        if self.algost_session is None:
+            self.algost_case = backtest.load_case(ALGOST_CASE)
+            self.algost_session = warm_session(ALGOST_BOT, self.algost_case, self.ticks)
+        return self.algost_session.bot
+
+    def grid(self):
+        if self.bs_grid is None:
+            self.bs_grid = BSGrid()
+        return self.bs_grid
+
+    def chain(self):
+        K = np.repeat(np.arange(self.strikes) - self.strikes // 2 + 100., 2)
+        calls = np.tile([True, False], self.strikes)
+        return calls, K, 0.25 + 0.8 * np.log(K / 100.) ** 2
+
+# Median and best per-call time of fn in microseconds
+def measure(fn):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = timer.repeat(REPEATS, number)
+    return {'us': float(np.median(runs)) / number * 1e6, 'best_us': min(runs) / number * 1e6, 'calls': number}
+
+def run(strikes, ticks, only=None):
+    ctx = Context(strikes, ticks)
+    results = {}
+    for name, setup in BENCHMARKS:
+        if only and not fnmatch.fnmatch(name, only):
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                fn = setup(ctx)
+            except ImportError as e:
+                print("%-36s skipped (%s)" % (name, e), file=sys.stderr)
+                continue
+            result = measure(fn)
+        results[name] = result
+        print("%-36s %12.2f us  (best %.2f, %d calls/run)" % (name, result['us'], result['best_us'], result['calls']))
+    return {'meta': {'strikes': strikes, 'ticks': ticks, 'python': platform.python_version(),
+                     'numpy': np.__version__, 'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+# Median startup times of each bot over STARTUP_RUNS fresh interpreters
+def startup(strikes):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        options_path = os.path.join(tmp, 'options.json')
+        with open(options_path, 'w') as f:
+            json.dump(options_case(strikes, 60), f)
+        for name, bot_path, case_path in (('options', OPTIONS_BOT, options_path), ('algost', ALGOST_BOT, ALGOST_CASE)):
+            module = os.path.splitext(os.path.basename(bot_path))[0]
+            runs = [json.loads(subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, HERE, module, case_path],
+                                                       cwd=tmp).decode().strip().splitlines()[-1])
+                    for _ in range(STARTUP_RUNS)]
+            results[name] = {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+    return results
+
+# Startup phases over their targets: [(bot, phase, seconds, target)]
+def startup_misses(results):
+    missed = []
+    for name, phases in results.items():
+        for phase, seconds in phases.items():
+            target = STARTUP_TARGETS[name][phase]
+            flag = 'OVER TARGET' if seconds > target else ''
+            print("%-10s %-12s %8.3f s  (target %.3f s)  %s" % (name, phase, seconds, target, flag))
+            if flag:
+                missed.append((name, phase, seconds, target))
+    return missed
+
+# Benchmarks slower than the baseline by more than threshold: [(name, baseline us, new us)]
+def regressions(baseline, current, threshold):
+    slower = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['us'] / base['us']
+        flag = 'REGRESSION' if ratio > 1 + threshold else ''
+        print("%-36s %12.2f -> %12.2f us  %+7.1f%%  %s" % (name, base['us'], result['us'], 100 * (ratio - 1), flag))
+        if flag:
+            slower.append((name, base['us'], result['us']))
+    return slower
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the bots' hot paths")
+    parser.add_argument('--strikes', type=int, default=41, help="strikes in the synthetic chain (two options each)")
+    parser.add_argument('--ticks', type=int, default=30, help="ticks to warm sessions up for")
+    parser.add_argument('--only', help="glob of benchmark names to run")
+    parser.add_argument('--save', help="write the results to this JSON baseline")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown before flagging")
+    parser.add_argument('--startup', action='store_true', help="check the bots' startup times against their targets")
+    args = parser.parse_args()
+
+    if args.startup:
+        sys.exit(1 if startup_misses(startup(args.strikes)) else 0)
+    current = run(args.strikes, args.ticks, args.only)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('strikes') != args.strikes:
+            print("warning: baseline was run with %s strikes" % baseline['meta'].get('strikes'), file=sys.stderr)
+        print()
+        if regressions(baseline, current, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,47 @@
+import numpy as np
+from scipy.special import ndtr
+
+# Vectorized Black-Scholes engine for a whole option chain.
+# Every argument can be a scalar or an array (one entry per option); d1 and d2
+# are computed once and shared by the price and all the Greeks, so one call
+# replaces a price, delta, gamma and vega call per security.
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+# Standard normal density
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+# Calculates price, delta, gamma and vega for every option in the chain.
+# call is 1/True for calls and 0/False for puts. Vega is per unit of vol (same as calc_vega).
+# Options with no time or no vol left are valued at intrinsic with zero gamma/vega.
+def chain_greeks(call, S, K, T, r, sig):
+    call = np.asarray(call, dtype=bool)
+    K = np.asarray(K, dtype=float)
+    sig = np.asarray(sig, dtype=float)
+    T = np.maximum(np.asarray(T, dtype=float), 0.)
+
+    sqrt_t = np.sqrt(T)
+    sig_t = sig * sqrt_t
+    live = sig_t > 0
+    disc = np.exp(-r * T)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = (np.log(S / K) + (r + sig ** 2 / 2) * T) / sig_t
+        d2 = d1 - sig_t
+        pdf = norm_pdf(d1)
+        nd1 = ndtr(d1)
+        call_price = nd1 * S - ndtr(d2) * K * disc
+        gamma = pdf / (S * sig_t)
+
+    # expired (or zero vol) options collapse onto their intrinsic value
+    forward_itm = S > K * disc
+    nd1 = np.where(live, nd1, forward_itm * 1.)
+    call_price = np.where(live, call_price, np.maximum(S - K * disc, 0.))
+
+    # using put-call parity
+    price = np.where(call, call_price, call_price + K * disc - S)
+    delta = nd1 - 1 + call
+    gamma = np.where(live, gamma, 0.)
+    vega = np.where(live, S * pdf * sqrt_t, 0.)
+    return price, delta, gamma, vega
@@ -0,0 +1,173 @@
+import numpy as np
+from scipy.special import ndtr
+from bs_chain import chain_greeks, norm_pdf
+from implied_vol import implied_vol_chain
+
+# Precomputed Black-Scholes tables with a bounded interpolation error.
+# Black-Scholes depends on (S, K, T, r, sig) only through the forward
+# log-moneyness x = ln(S/K) + rT and the total vol w = sig * sqrt(T), once prices
+# are measured in units of K * exp(-rT). So one 2-D table over (x, w) covers every
+# strike, expiry and vol in the session. The tables hold the normalized call
+# price, N(d1) and n(d1) at the grid nodes, and lookups interpolate bilinearly.
+# The inverse (implied vol) table is indexed by x and the log of the option's
+# time value as a fraction of its no-arbitrage range, and holds w.
+#
+# When the grid is built, the interpolation error of every cell is measured
+# against the exact formulas at the cell centre and edge midpoints. A lookup is
+# answered from the grid only if its cell's error, scaled to the query's units
+# (price in currency, vol in vol points), is within the configured maximum.
+# Anything else, including everything outside the grid, goes through
+# chain_greeks / implied_vol_chain exactly.
+
+# defaults: a tenth of a price tick, N(d1)/n(d1) to 1e-3, vols to a hundredth of a vol point
+MAX_PRICE_ERROR = 1e-3
+MAX_GREEK_ERROR = 1e-3
+MAX_VOL_ERROR = 1e-4
+
+# Normalized call price, N(d1) and n(d1) at forward log-moneyness x and total vol w
+def normalized(x, w):
+    d1 = x / w + w / 2
+    return np.exp(x) * ndtr(d1) - ndtr(d1 - w), ndtr(d1), norm_pdf(d1)
+
+# Fraction of the no-arbitrage range [intrinsic, e^x] a normalized call price c covers
+def time_value_fraction(x, c):
+    lower = np.maximum(np.exp(x) - 1, 0.)
+    return (c - lower) / (np.exp(x) - lower)
+
+# Bilinear interpolation of a node table (or a stack of them along the first axis) in cell (i, j) at offsets (t, u)
+def bilinear(table, i, j, t, u):
+    return ((1 - t) * (1 - u) * table[..., i, j] + t * (1 - u) * table[..., i + 1, j]
+            + (1 - t) * u * table[..., i, j + 1] + t * u * table[..., i + 1, j + 1])
+
+# Worst error of each cell from errors at the cell centres and edge midpoints.
+# error_at(x, y, value) is the error of the interpolated value at (x, y)
+def cell_error(table, error_at, x, y):
+    xm = (x[:-1] + x[1:]) / 2
+    ym = (y[:-1] + y[1:]) / 2
+    center = error_at(*np.meshgrid(xm, ym, indexing='ij'),
+                      bilinear(table, *np.ix_(np.arange(x.size - 1), np.arange(y.size - 1)), 0.5, 0.5))
+    # midpoints of the edges along y (shape nx x ny-1) and along x (nx-1 x ny)
+    along_y = error_at(*np.meshgrid(x, ym, indexing='ij'), (table[:, :-1] + table[:, 1:]) / 2)
+    along_x = error_at(*np.meshgrid(xm, y, indexing='ij'), (table[:-1, :] + table[1:, :]) / 2)
+    err = np.maximum(center, np.maximum(along_y[:-1], along_y[1:]))
+    err = np.maximum(err, np.maximum(along_x[:, :-1], along_x[:, 1:]))
+    return np.where(np.isfinite(err), err, np.inf)
+
+# Error of an interpolated normalized price (k=0), N(d1) (k=1) or n(d1) (k=2)
+def forward_error(k):
+    return lambda x, w, value: np.abs(value - normalized(x, w)[k])
+
+# Error in w of an interpolated inverse value at (x, s): the miss in s divided by ds/dw
+def inverse_error(x, s, w):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c, _, pdf = normalized(x, w)
+        lower = np.maximum(np.exp(x) - 1, 0.)
+        # dc/dw = e^x n(d1)
+        return np.abs(np.log(time_value_fraction(x, c)) - s) * (c - lower) / (np.exp(x) * pdf)
+
+class BSGrid:
+    def __init__(self, x_range=(-0.4, 0.4), w_range=(0.002, 0.6), points=(801, 481), s_min=-25.,
+                 max_price_error=MAX_PRICE_ERROR, max_greek_error=MAX_GREEK_ERROR, max_vol_error=MAX_VOL_ERROR):
+        self.x = np.linspace(x_range[0], x_range[1], points[0])
+        self.w = np.linspace(w_range[0], w_range[1], points[1])
+        self.s = np.linspace(s_min, 0., points[1])
+        self.dx = self.x[1] - self.x[0]
+        self.dw = self.w[1] - self.w[0]
+        self.ds = self.s[1] - self.s[0]
+        self.lookups = 0
+        self.fallbacks = 0
+
+        X, W = np.meshgrid(self.x, self.w, indexing='ij')
+        self.tables = np.stack(normalized(X, W))
+        price, nd1, pdf = self.tables
+        price_error = cell_error(price, forward_error(0), self.x, self.w)
+        greek_error = np.maximum(cell_error(nd1, forward_error(1), self.x, self.w),
+                                 cell_error(pdf, forward_error(2), self.x, self.w))
+        # per cell: the largest K * exp(-rT) for which prices stay within bounds (0 if the Greeks do not)
+        with np.errstate(divide='ignore', over='ignore'):
+            self.price_scale = np.where(greek_error <= max_greek_error, max_price_error / price_error, 0.)
+
+        # inverse table: w along each row of x, by log time value fraction (nan where out of reach)
+        fine = np.linspace(w_range[0], w_range[1], 8 * points[1])
+        Xf, Wf = np.meshgrid(self.x, fine, indexing='ij')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s_rows = np.log(time_value_fraction(Xf, normalized(Xf, Wf)[0]))
+        self.inverse = np.array([np.interp(self.s, row, fine, left=np.nan, right=np.nan) for row in s_rows])
+        # per cell: the smallest sqrt(T) for which vols stay within bounds
+        vol_error = cell_error(self.inverse, inverse_error, self.x, self.s)
+        self.min_sqrt_t = vol_error / max_vol_error
+
+    # Cell indices and offsets of queries on a node axis; inside is False off the grid
+    def locate(self, value, start, step, size):
+        f = (value - start) / step
+        f = np.where(np.isfinite(f), f, -1.)
+        inside = (f >= 0) & (f < size - 1)
+        i = np.clip(f, 0, size - 2).astype(int)
+        return i, np.clip(f - i, 0., 1.), inside
+
+    # Same interface and results as bs_chain.chain_greeks, to within the configured errors
+    def greeks(self, call, S, K, T, r, sig):
+        call = np.asarray(call, dtype=bool)
+        K = np.asarray(K, dtype=float)
+        sig = np.asarray(sig, dtype=float)
+        T = np.asarray(T, dtype=float)
+        sqrt_t = np.sqrt(np.maximum(T, 0.))
+        disc = np.exp(-r * T)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.log(S / K) + r * T
+            w = sig * sqrt_t
+        i, t, in_x = self.locate(x, self.x[0], self.dx, self.x.size)
+        j, u, in_w = self.locate(w, self.w[0], self.dw, self.w.size)
+        ok = in_x & in_w & (T > 0) & (K * disc <= self.price_scale[i, j])
+
+        normalized_price, nd1, pdf = bilinear(self.tables, i, j, t, u)
+        call_price = normalized_price * K * disc
+        with np.errstate(divide='ignore', invalid='ignore'):
+            price = np.where(call, call_price, call_price + K * disc - S)
+            delta = nd1 - 1 + call
+            gamma = pdf / (S * w)
+            vega = S * pdf * sqrt_t
+
+        self.lookups += ok.size
+        if not ok.all():
+            miss = ~ok
+            self.fallbacks += int(miss.sum())
+            price, delta, gamma, vega = np.broadcast_arrays(price, delta, gamma, vega)
+            price, delta, gamma, vega = price.copy(), delta.copy(), gamma.copy(), vega.copy()
+            call, S, K, T, sig = np.broadcast_arrays(call, S, K, T, sig)
+            exact = chain_greeks(call[miss], S[miss], K[miss], T[miss], r, sig[miss])
+            for out, value in zip((price, delta, gamma, vega), exact):
+                out[miss] = value
+        return price, delta, gamma, vega
+
+    # Same interface as implied_vol.implied_vol_chain (T and S scalars); prices the grid
+    # cannot answer within the vol bound are solved exactly, which also reports why a solve failed
+    def implied_vol(self, P, call, S, K, T, r, guess=None):
+        P, call, K = np.broadcast_arrays(np.asarray(P, dtype=float), np.asarray(call, dtype=bool), np.asarray(K, dtype=float))
+        P, call, K = P.ravel(), call.ravel(), K.ravel()
+        sig = np.full(P.size, np.nan)
+        reasons = [None] * P.size
+        ok = np.zeros(P.size, dtype=bool)
+        if T > 0:
+            disc = np.exp(-r * T)
+            x = np.log(S / K) + r * T
+            c = np.where(call, P, P + S - K * disc) / (K * disc)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s = np.log(time_value_fraction(x, c))
+            i, t, in_x = self.locate(x, self.x[0], self.dx, self.x.size)
+            j, u, in_s = self.locate(s, self.s[0], self.ds, self.s.size)
+            ok = in_x & in_s & np.isfinite(P) & (P > 0)
+            ok &= np.sqrt(T) >= self.min_sqrt_t[i, j]
+            sig = bilinear(self.inverse, i, j, t, u) / np.sqrt(T)
+            ok &= np.isfinite(sig)
+
+        self.lookups += ok.size
+        miss = np.flatnonzero(~ok)
+        if miss.size:
+            self.fallbacks += miss.size
+            guess = None if guess is None else np.broadcast_to(np.asarray(guess, dtype=float), P.shape)[miss]
+            exact, why = implied_vol_chain(P[miss], call[miss], S, K[miss], T, r, guess)
+            sig[miss] = exact
+            for k, reason in zip(miss, why):
+                reasons[k] = reason
+        return sig, reasons
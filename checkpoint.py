@@ -0,0 +1,99 @@
+import os
+import time
+import zlib
+import pickle
+import threading
+
+# Periodic checkpoints of a bot's state for a warm restart after a crash or disconnect.
+# save() pickles the state on the calling thread, which gives a consistent
+# copy and costs little (RingBuffer pickles only its live values). A
+# background thread then compresses the bytes, writes them to a temporary file
+# next to the checkpoint, fsyncs it and os.replace()s it over the old one, so
+# a crash mid-write leaves the previous checkpoint intact. If a write is still
+# running when the next save comes, the newer state replaces the one waiting:
+# only the latest state matters.
+#
+# Each checkpoint carries a key for the case (tickers, case length), the case
+# time it was taken at and the wall time. load() only returns a checkpoint of
+# the same case, taken no later in the case than now and less than max_age
+# seconds ago. A leftover file from an earlier session starts the bot cold.
+
+MAGIC = b'BOTCKPT1'
+
+class Checkpointer:
+    def __init__(self, path, period=5, level=1):
+        self.path = path
+        self.period = period
+        self.level = level
+        self.last = None
+        self.waiting = None
+        self.writing = False
+        self.saved = 0
+        self.seconds = 0.
+        self.error = None
+        self.ready = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='checkpoint', daemon=True)
+        self.thread.start()
+
+    # True if the last save was at least `period` case seconds before `now`
+    def due(self, now):
+        return self.last is None or now - self.last >= self.period
+
+    # Queues state (any picklable object) for writing, taken at case time `now`
+    def save(self, now, key, state):
+        meta = {'key': key, 'elapsed': now, 'wall': time.time()}
+        data = pickle.dumps((meta, state), protocol=pickle.HIGHEST_PROTOCOL)
+        self.last = now
+        with self.ready:
+            self.waiting = data
+            self.ready.notify()
+
+    def run(self):
+        while True:
+            with self.ready:
+                while self.waiting is None:
+                    self.ready.wait()
+                data, self.waiting = self.waiting, None
+                self.writing = True
+            start = time.perf_counter()
+            try:
+                self.write(data)
+                self.saved += 1
+            except OSError as e:
+                self.error = e
+            self.seconds = time.perf_counter() - start
+            with self.ready:
+                self.writing = False
+                self.ready.notify_all()
+
+    def write(self, data):
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(zlib.compress(data, self.level))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    # Waits until everything saved so far is on disk
+    def flush(self, timeout=5.):
+        with self.ready:
+            self.ready.wait_for(lambda: self.waiting is None and not self.writing, timeout)
+
+# The state saved at `path` if it is a checkpoint of the case `key` taken at or before case time
+# `now` and less than max_age seconds ago, else None. Returns (case time it was taken at, state)
+def load(path, key, now, max_age=3600.):
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if not raw.startswith(MAGIC):
+            return None
+        meta, state = pickle.loads(zlib.decompress(raw[len(MAGIC):]))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print("Ignoring unreadable checkpoint %s: %s" % (path, e))
+        return None
+    if meta['key'] != key or meta['elapsed'] > now or time.time() - meta['wall'] > max_age:
+        return None
+    return meta['elapsed'], state
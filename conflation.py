@@ -0,0 +1,157 @@
+import time
+import threading
+import traceback
+from collections import deque
+
+import latency
+
+# Runs a bot's callbacks on a worker thread with latest-state conflation.
+# Once enabled, the callbacks TradersBot calls on its IOLoop only file the
+# message away: MARKET UPDATEs are kept per ticker and TRADER UPDATEs as the
+# newest one (so superseded ticks are dropped), while everything else (register,
+# trades, acks, news) is queued in arrival order and never dropped. The worker
+# takes the queued events and the snapshots together and replays them, in the
+# order they arrived, through the bot's real callbacks (a snapshot stands at
+# the place of the newest message it kept). Orders they make are
+# collected and handed back to the IOLoop thread, which writes them out on the
+# next callback or periodic flush (the websocket must only be used from its own
+# thread). A burst of updates therefore costs the strategy one pass per ticker
+# instead of one pass per message, and reaction time no longer grows with the
+# backlog.
+
+CALLBACKS = ('onAckRegister', 'onMarketUpdate', 'onTraderUpdate', 'onTrade', 'onAckModifyOrders', 'onNews')
+FLUSH_PERIOD_MS = 5
+
+# Records the order calls a callback makes so they can be replayed onto a TradersOrder later, with
+# the message that caused them (type, seq, arrival) for latency's round trips
+class OrderBatch:
+    def __init__(self, msg=None, arrived=None):
+        self.calls = []
+        self.kind = msg.get('message_type') if msg else None
+        self.seq = msg.get('seq') if msg else None
+        self.arrived = arrived
+
+    def addBuy(self, ticker, quantity, price=None, token=None):
+        self.calls.append(('addBuy', (ticker, quantity, price, token)))
+
+    def addSell(self, ticker, quantity, price=None, token=None):
+        self.calls.append(('addSell', (ticker, quantity, price, token)))
+
+    def addTrade(self, ticker, isBuy, quantity, price=None, token=None):
+        self.calls.append(('addTrade', (ticker, isBuy, quantity, price, token)))
+
+    def addCancel(self, ticker, orderId):
+        self.calls.append(('addCancel', (ticker, orderId)))
+
+    def toJson(self, token=None):
+        pass
+
+    def apply(self, order):
+        for name, args in self.calls:
+            getattr(order, name)(*args)
+
+class Conflator:
+    def __init__(self, t, period_ms=FLUSH_PERIOD_MS):
+        self.handlers = {}
+        for name in CALLBACKS:
+            callback = getattr(t, name, None)
+            if callable(callback) and getattr(callback, '__self__', None) is not t:
+                self.handlers[name] = callback
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.latest = {}
+        self.trader = None
+        self.events = deque()
+        self.outbox = deque()
+        # arrival order of every message filed, across events and snapshots
+        self.seq = 0
+        self.skipped = 0
+        self.running = True
+
+        t.onMarketUpdate = self.on_market_update
+        t.onTraderUpdate = self.on_trader_update
+        for name in CALLBACKS:
+            if name not in ('onMarketUpdate', 'onTraderUpdate'):
+                setattr(t, name, self.on_event(name))
+        if hasattr(t, 'addPeriodicCallback'):
+            t.addPeriodicCallback(self.flush, period_ms)
+
+        self.thread = threading.Thread(target=self.work, name='strategy', daemon=True)
+        self.thread.start()
+
+    # IOLoop side: file the message away, send whatever the worker has produced
+    def on_market_update(self, msg, order):
+        with self.lock:
+            if msg['market_state']['ticker'] in self.latest:
+                self.skipped += 1
+            self.seq += 1
+            self.latest[msg['market_state']['ticker']] = (self.seq, 'onMarketUpdate', time.perf_counter(), msg)
+        self.wake.set()
+        self.flush(order)
+
+    def on_trader_update(self, msg, order):
+        with self.lock:
+            if self.trader is not None:
+                self.skipped += 1
+            self.seq += 1
+            self.trader = (self.seq, 'onTraderUpdate', time.perf_counter(), msg)
+        self.wake.set()
+        self.flush(order)
+
+    def on_event(self, name):
+        def queued(msg, order):
+            if name == 'onAckModifyOrders':
+                latency.acked(time.perf_counter(), msg.get('seq'))
+            with self.lock:
+                self.seq += 1
+                self.events.append((self.seq, name, time.perf_counter(), msg))
+            self.wake.set()
+            self.flush(order)
+        return queued
+
+    # Also runs every period_ms (TradersBot passes a blank TradersOrder) so orders never wait for the next message.
+    # Everything written here leaves as one MODIFY ORDERS, timed from the oldest message it answers
+    def flush(self, order):
+        first = None
+        while self.outbox:
+            batch = self.outbox.popleft()
+            batch.apply(order)
+            first = first or batch
+        if first is not None:
+            latency.sent(first.kind, first.arrived, first.seq)
+
+    # Worker side: replay the queued events and the newest snapshots through the real callbacks, in
+    # arrival order
+    def work(self):
+        while self.running:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                pending = list(self.events) + list(self.latest.values())
+                if self.trader is not None:
+                    pending.append(self.trader)
+                self.events, self.latest, self.trader = deque(), {}, None
+                skipped, self.skipped = self.skipped, 0
+            pending.sort(key=lambda item: item[0])
+            for _, name, arrived, msg in pending:
+                self.run(name, arrived, msg)
+            if skipped:
+                latency.count('conflated ticks', skipped)
+
+    def run(self, name, arrived, msg):
+        handler = self.handlers.get(name)
+        if handler is None:
+            return
+        latency.record('conflated wait', (time.perf_counter() - arrived) * 1e6)
+        batch = OrderBatch(msg, arrived)
+        try:
+            handler(msg, batch)
+        except Exception:
+            traceback.print_exc()
+        if batch.calls:
+            self.outbox.append(batch)
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
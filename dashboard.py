@@ -0,0 +1,97 @@
+import sys
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import snapshot
+
+# Live dashboard for a running options bot, in its own process.
+# Reads the state the bot publishes with BOT_SNAPSHOT=<name> (see snapshot.py)
+# and redraws on a timer: the vol smile (IVs and the fitted fair vol per
+# strike), where each price sits within its Bollinger bands, position Greeks
+# per strike, and PnL / delta / vega over the session. Reading never blocks
+# the bot.
+#
+# Usage: BOT_SNAPSHOT=options python shen_wang_options.py localhost trader0 trader0
+#        python dashboard.py options [--interval 500] [--history 2000]
+
+# Band position of each price: -1 at the lower band, 0 at the mean, 1 at the upper band
+def band_position(rows):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (rows['price'] - rows['band_mean']) / (rows['band_upper'] - rows['band_mean'])
+
+class Dashboard:
+    def __init__(self, reader, history=2000):
+        self.reader = reader
+        self.history = history
+        self.times = []
+        self.series = {'pnl': [], 'delta': [], 'vega': []}
+        self.fig, axes = plt.subplots(2, 2, figsize=(12, 8))
+        (self.smile_ax, self.band_ax), (self.greek_ax, self.pnl_ax) = axes
+
+    def update(self, frame):
+        update = self.reader.read()
+        if update is None:
+            return
+        seq, summary, rows = update
+        self.times.append(float(summary['elapsed']))
+        for name, values in self.series.items():
+            values.append(float(summary[name]))
+            del values[:-self.history]
+        del self.times[:-self.history]
+
+        options = np.isfinite(rows['strike'])
+        calls = options & (rows['call'] == 1)
+        puts = options & (rows['call'] == 0)
+        self.smile_ax.clear()
+        self.smile_ax.scatter(rows['strike'][calls], rows['iv'][calls], s=12, label='call IV')
+        self.smile_ax.scatter(rows['strike'][puts], rows['iv'][puts], s=12, marker='x', label='put IV')
+        order = np.argsort(rows['strike'][calls])
+        self.smile_ax.plot(rows['strike'][calls][order], rows['fair_vol'][calls][order], 'k-', label='fitted')
+        self.smile_ax.set_title("Smile at t=%.0f, spot %.2f" % (summary['elapsed'], summary['spot']))
+        self.smile_ax.legend(loc='upper right')
+
+        self.band_ax.clear()
+        position = band_position(rows)
+        labels = [t.decode() for t in rows['ticker']]
+        self.band_ax.bar(np.arange(rows.size), np.nan_to_num(position), color=np.where(np.abs(position) > 1, 'r', 'b'))
+        self.band_ax.axhline(1, color='k', lw=0.5)
+        self.band_ax.axhline(-1, color='k', lw=0.5)
+        self.band_ax.set_xticks(np.arange(rows.size)[::max(rows.size // 12, 1)])
+        self.band_ax.set_xticklabels(labels[::max(rows.size // 12, 1)], rotation=45, fontsize=7)
+        self.band_ax.set_title("Price within Bollinger bands (+-1 = band)")
+
+        self.greek_ax.clear()
+        strikes = np.unique(rows['strike'][options])
+        for field in ('delta', 'vega'):
+            exposure = rows['position'][options] * rows[field][options]
+            self.greek_ax.plot(strikes, np.bincount(np.searchsorted(strikes, rows['strike'][options]),
+                                                    weights=np.nan_to_num(exposure), minlength=strikes.size),
+                               marker='o', label='position ' + field)
+        self.greek_ax.set_title("Exposure by strike: delta %.1f, gamma %.3f, vega %.1f"
+                                % (summary['delta'], summary['gamma'], summary['vega']))
+        self.greek_ax.legend(loc='upper right')
+
+        self.pnl_ax.clear()
+        for name, values in self.series.items():
+            self.pnl_ax.plot(self.times, values, label=name)
+        self.pnl_ax.set_title("PnL %.2f (update %d)" % (summary['pnl'], seq // 2))
+        self.pnl_ax.legend(loc='upper left')
+        self.fig.tight_layout()
+
+    def run(self, interval):
+        self.animation = animation.FuncAnimation(self.fig, self.update, interval=interval, cache_frame_data=False)
+        plt.show()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Live dashboard for a bot publishing a state snapshot")
+    parser.add_argument('name', help="shared-memory segment name (the bot's BOT_SNAPSHOT)")
+    parser.add_argument('--interval', type=int, default=500, help="redraw period in ms")
+    parser.add_argument('--history', type=int, default=2000, help="updates of PnL and Greeks to plot")
+    args = parser.parse_args()
+    try:
+        reader = snapshot.SnapshotReader(args.name)
+    except FileNotFoundError:
+        print("No snapshot named %s; start the bot with BOT_SNAPSHOT=%s" % (args.name, args.name), file=sys.stderr)
+        sys.exit(1)
+    Dashboard(reader, args.history).run(args.interval)
@@ -0,0 +1,91 @@
+import math
+import numpy as np
+
+# Fixed-capacity, array-backed history of one market series (prices, spreads, ivs...).
+# Values and their timestamps live in NumPy arrays of twice the capacity: every
+# value is written at i and i + capacity, so the most recent n values are always
+# one contiguous slice and view(n) never copies. Memory is fixed at construction
+# and count/mean/min/max are kept as running aggregates over everything appended,
+# so none of them scan the history.
+class RingBuffer:
+    def __init__(self, capacity, dtype=float):
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.times = np.full(2 * capacity, np.nan)
+        self.pos = 0
+        self.size = 0
+        self.count = 0
+        self.total = 0.
+        self.min = math.nan
+        self.max = math.nan
+
+    def append(self, value, t=math.nan):
+        i = self.pos
+        self.data[i] = self.data[i + self.capacity] = value
+        self.times[i] = self.times[i + self.capacity] = t
+        self.pos = (i + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+        self.count += 1
+        self.total += value
+        if self.count == 1:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    # Mean of every value appended so far (same as statistics.mean over the full list)
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    @property
+    def last(self):
+        return self.data[self.pos - 1 + self.capacity] if self.size else math.nan
+
+    # Zero-copy view of the last n values, oldest first
+    def view(self, n=None):
+        n = self.size if n is None else min(n, self.size)
+        end = self.pos + self.capacity
+        return self.data[end - n:end]
+
+    # Zero-copy view of the timestamps matching view(n)
+    def time_view(self, n=None):
+        n = self.size if n is None else min(n, self.size)
+        end = self.pos + self.capacity
+        return self.times[end - n:end]
+
+    # Pickles only the live values and their timestamps, as raw bytes (a pickled array costs
+    # several times more to write, and checkpoint.py pickles hundreds of these per save)
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['data'], state['times'] = self.view().tobytes(), self.time_view().tobytes()
+        state['dtype'] = self.data.dtype.str
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        data = np.frombuffer(state.pop('data'), dtype=state.pop('dtype'))
+        times = np.frombuffer(state.pop('times'))
+        self.__dict__.update(state)
+        n, capacity = data.size, self.capacity
+        self.data = np.zeros(2 * capacity, dtype=data.dtype)
+        self.times = np.full(2 * capacity, np.nan)
+        self.data[:n] = self.data[capacity:capacity + n] = data
+        self.times[:n] = self.times[capacity:capacity + n] = times
+        self.pos = n % capacity
+
+    # Mean of the last n values only
+    def window_mean(self, n):
+        return self.view(n).mean() if self.size else math.nan
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __iter__(self):
+        return iter(self.view())
@@ -0,0 +1,131 @@
+import math
+import numpy as np
+from bs_chain import chain_greeks
+
+# Batched implied volatility solver for a whole option chain.
+# Newton steps start from each strike's previous vol and are safeguarded by a
+# per-strike bracket: whenever vega is too small or the Newton step leaves the
+# bracket, that strike takes a bisection step instead. The number of passes is
+# fixed, so the cost per tick is bounded whatever the quotes look like.
+# A market update reprices a single strike, and NumPy's per-call overhead
+# dominates there, so up to SCALAR_MAX strikes are solved one at a time by the
+# same iteration in plain floats (implied_vol).
+
+SIG_MIN = 1e-4
+SIG_MAX = 10.
+MIN_VEGA = 1e-8
+TOL = 1e-6
+MAX_ITER = 30
+SCALAR_MAX = 4
+SQRT_2PI = math.sqrt(2 * math.pi)
+
+# Failure reasons reported per strike (None means the solve succeeded)
+NO_PRICE = 'no price'
+EXPIRED = 'expired'
+BELOW_INTRINSIC = 'price below intrinsic value'
+ABOVE_MAX = 'price above no-arbitrage bound'
+NO_CONVERGENCE = 'no convergence'
+
+# Inverts Black-Scholes for every option in the chain.
+# Returns (vols, reasons): vols is an array with nan where the solve failed and
+# reasons a list holding None or one of the failure reasons above for each strike.
+def implied_vol_chain(P, call, S, K, T, r, guess=None, tol=TOL, max_iter=MAX_ITER):
+    P, call, K = np.broadcast_arrays(np.asarray(P, dtype=float), np.asarray(call, dtype=bool), np.asarray(K, dtype=float))
+    n = P.size
+    P, call, K = P.ravel(), call.ravel(), K.ravel()
+    if n <= SCALAR_MAX:
+        guess = np.broadcast_to(np.nan if guess is None else np.asarray(guess, dtype=float), (n,))
+        solved = [implied_vol(float(P[i]), bool(call[i]), S, float(K[i]), T, r, float(guess[i]), tol, max_iter)
+                  for i in range(n)]
+        return np.array([s for s, _ in solved], dtype=float), [reason for _, reason in solved]
+    sig = np.full(n, np.nan)
+    reasons = [None] * n
+
+    disc = np.exp(-r * T)
+    lower = np.where(call, np.maximum(S - K * disc, 0.), np.maximum(K * disc - S, 0.))
+    upper = np.where(call, S, K * disc)
+
+    bad = ~np.isfinite(P) | (P <= 0)
+    for i in np.flatnonzero(bad):
+        reasons[i] = NO_PRICE
+    if T <= 0:
+        for i in np.flatnonzero(~bad):
+            reasons[i] = EXPIRED
+        return sig, reasons
+    for i in np.flatnonzero(~bad & (P <= lower)):
+        reasons[i] = BELOW_INTRINSIC
+    for i in np.flatnonzero(~bad & (P >= upper)):
+        reasons[i] = ABOVE_MAX
+
+    idx = np.flatnonzero([reason is None for reason in reasons])
+    if guess is None:
+        guess = np.full(n, np.nan)
+    guess = np.broadcast_to(np.asarray(guess, dtype=float), (n,))
+    x = guess[idx].copy()
+    # Brenner-Subrahmanyam approximation for strikes without a usable previous vol
+    cold = ~np.isfinite(x) | (x <= SIG_MIN) | (x >= SIG_MAX)
+    x[cold] = np.sqrt(2 * np.pi / T) * P[idx][cold] / S
+    x = np.clip(x, SIG_MIN * 2, SIG_MAX / 2)
+    lo = np.full(idx.size, SIG_MIN)
+    hi = np.full(idx.size, SIG_MAX)
+
+    for _ in range(max_iter):
+        if idx.size == 0:
+            break
+        price, _, _, vega = chain_greeks(call[idx], S, K[idx], T, r, x)
+        diff = price - P[idx]
+        done = np.abs(diff) < tol
+        sig[idx[done]] = x[done]
+
+        keep = ~done
+        idx, x, lo, hi, diff, vega = idx[keep], x[keep], lo[keep], hi[keep], diff[keep], vega[keep]
+        # price is increasing in vol, so the sign of diff tightens the bracket
+        hi = np.where(diff > 0, x, hi)
+        lo = np.where(diff < 0, x, lo)
+        # tiny vegas overflow the step; those strikes bisect instead (use_newton below)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            newton = x - diff / vega
+        use_newton = (vega > MIN_VEGA) & (newton > lo) & (newton < hi)
+        x = np.where(use_newton, newton, (lo + hi) / 2)
+
+    for i in idx:
+        reasons[i] = NO_CONVERGENCE
+    return sig, reasons
+
+# One strike of implied_vol_chain in plain floats. Returns (vol or nan, failure reason or None)
+def implied_vol(P, call, S, K, T, r, guess=math.nan, tol=TOL, max_iter=MAX_ITER):
+    if not math.isfinite(P) or P <= 0:
+        return math.nan, NO_PRICE
+    if T <= 0:
+        return math.nan, EXPIRED
+    disc = math.exp(-r * T)
+    if P <= (max(S - K * disc, 0.) if call else max(K * disc - S, 0.)):
+        return math.nan, BELOW_INTRINSIC
+    if P >= (S if call else K * disc):
+        return math.nan, ABOVE_MAX
+
+    x = guess
+    if not math.isfinite(x) or x <= SIG_MIN or x >= SIG_MAX:
+        x = math.sqrt(2 * math.pi / T) * P / S
+    x = min(max(x, SIG_MIN * 2), SIG_MAX / 2)
+    lo, hi = SIG_MIN, SIG_MAX
+    sqrt_t = math.sqrt(T)
+    log_sk = math.log(S / K)
+    for _ in range(max_iter):
+        sig_t = x * sqrt_t
+        d1 = (log_sk + (r + x * x / 2) * T) / sig_t
+        d2 = d1 - sig_t
+        price = 0.5 * math.erfc(-d1 / math.sqrt(2)) * S - 0.5 * math.erfc(-d2 / math.sqrt(2)) * K * disc
+        if not call:
+            price += K * disc - S
+        diff = price - P
+        if abs(diff) < tol:
+            return x, None
+        if diff > 0:
+            hi = x
+        elif diff < 0:
+            lo = x
+        vega = S * math.exp(-0.5 * d1 * d1) / SQRT_2PI * sqrt_t
+        newton = x - diff / vega if vega > MIN_VEGA else math.nan
+        x = newton if lo < newton < hi else (lo + hi) / 2
+    return math.nan, NO_CONVERGENCE
@@ -0,0 +1,251 @@
+import sys
+import json
+import math
+import time
+import atexit
+import contextlib
+from datetime import datetime, timezone
+from collections import Counter, deque
+
+# Opt-in latency instrumentation for the bots.
+# enable(t) wraps every callback registered on a TradersBot (or the backtester's
+# SimBot) and records, in log-bucketed histograms:
+# - how long each callback takes,
+# - how long each strategy stage takes (code wrapped in `with latency.stage(name):`),
+# - how old each order is when addBuy/addSell/addTrade is called, measured from the
+#   start of the callback handling the message that triggered it,
+# - how old each message is on arrival, when it carries a server timestamp,
+# - the round trip from a message to the ACK MODIFY ORDERS of the orders it caused, by
+#   message type, and the backlog: how many messages the server sent between the
+#   message and our orders reaching it (needs the 'seq' numbers mock_server.py sends),
+# plus counts of exceptions raised by callbacks and of named events (latency.count).
+# With instrumentation off, stage() and count() are no-ops.
+#
+# Turn it on by setting BOT_PROFILE (to a JSON path for the export, or to 1) when
+# running a bot or backtest.py; a percentile summary is printed at exit.
+
+# 20 buckets per decade: a recorded value is off by at most ~6% from its bucket edge
+BUCKETS_PER_DECADE = 20
+PERCENTILES = (50, 90, 99, 99.9)
+# Sent batches waiting for their ACK MODIFY ORDERS (an ack lost on the way would otherwise pile them up)
+MAX_UNACKED = 1024
+
+# Sparse log-bucketed histogram of durations in microseconds
+class Histogram:
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, us):
+        self.buckets[int(math.floor(BUCKETS_PER_DECADE * math.log10(max(us, 1e-3))))] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    # Upper edge of the bucket holding the p-th percentile
+    def percentile(self, p):
+        if not self.count:
+            return math.nan
+        rank = p / 100. * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(10 ** ((bucket + 1) / BUCKETS_PER_DECADE), self.max)
+        return self.max
+
+    def summary(self):
+        out = {'count': self.count, 'mean_us': self.total / self.count if self.count else math.nan, 'max_us': self.max}
+        for p in PERCENTILES:
+            out['p%g_us' % p] = self.percentile(p)
+        return out
+
+# Parses the server's RFC 3339 timestamps ("2015-03-21T21:12:17.764384883Z") to epoch seconds
+def parse_server_time(text):
+    if not isinstance(text, str):
+        return None
+    try:
+        head, _, frac = text.rstrip('Z').partition('.')
+        stamp = datetime.strptime(head, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        return stamp + (float('0.' + frac) if frac else 0.)
+    except ValueError:
+        return None
+
+# Wraps a callback's order object to time every order against the triggering message; the orders
+# themselves go out unchanged
+class TimedOrder:
+    def __init__(self, order, profiler, received):
+        self.order = order
+        self.profiler = profiler
+        self.received = received
+        self.orders = 0
+
+    def addBuy(self, ticker, quantity, price=None, token=None):
+        self.timed()
+        self.order.addBuy(ticker, quantity, price, token)
+
+    def addSell(self, ticker, quantity, price=None, token=None):
+        self.timed()
+        self.order.addSell(ticker, quantity, price, token)
+
+    def addTrade(self, ticker, isBuy, quantity, price=None, token=None):
+        self.timed()
+        self.order.addTrade(ticker, isBuy, quantity, price, token)
+
+    def timed(self):
+        self.orders += 1
+        self.profiler.record('order_age', (time.perf_counter() - self.received) * 1e6)
+
+    def __getattr__(self, name):
+        return getattr(self.order, name)
+
+class Profiler:
+    def __init__(self):
+        self.histograms = {}
+        self.counts = Counter()
+        # (message type, seq, arrival) of the message behind each batch sent, oldest first. The server
+        # acks every MODIFY ORDERS once and in order, so the next ack answers the oldest batch
+        self.unacked = deque(maxlen=MAX_UNACKED)
+
+    def record(self, name, us):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(us)
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    # A batch of orders or cancels went out in answer to a message of that type that arrived at received
+    def sent(self, kind, received, seq=None):
+        self.unacked.append((kind, seq, received))
+
+    # An ACK MODIFY ORDERS arrived at received: times the round trip of the oldest batch sent
+    def acked(self, received, seq=None):
+        if not self.unacked:
+            return
+        kind, sent_seq, sent = self.unacked.popleft()
+        self.record('round_trip %s' % kind, (received - sent) * 1e6)
+        if seq is not None and sent_seq is not None:
+            self.record('backlog (messages)', max(seq - sent_seq - 1, 0))
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record('stage ' + name, (time.perf_counter() - start) * 1e6)
+
+    # Wraps one callback: times it, times its orders and counts its exceptions. When order is the one
+    # TradersBot sends after the callback (not a batch collected for later, as under conflation.py),
+    # the round trip to its ack is timed too
+    def timed_callback(self, name, callback):
+        def wrapped(msg, order):
+            received = time.perf_counter()
+            state = msg.get('market_state') or msg.get('trader_state')
+            sent = parse_server_time(state.get('time')) if state else None
+            if sent is not None:
+                self.record('message_age', (time.time() - sent) * 1e6)
+            direct = hasattr(order, 'orders') and hasattr(order, 'cancels')
+            if direct and name == 'onAckModifyOrders':
+                self.acked(received, msg.get('seq'))
+            timed = TimedOrder(order, self, received)
+            try:
+                return callback(msg, timed)
+            except Exception:
+                self.count('exception ' + name)
+                raise
+            finally:
+                elapsed = (time.perf_counter() - received) * 1e6
+                self.record('callback ' + name, elapsed)
+                # orders only leave once the callback returns
+                if timed.orders:
+                    self.record('tick_to_send', elapsed)
+                if direct and (order.orders or order.cancels):
+                    self.sent(msg.get('message_type'), received, msg.get('seq'))
+        return wrapped
+
+    # Wraps every callback currently registered on t
+    def wrap(self, t):
+        for name in ('onAckRegister', 'onMarketUpdate', 'onTraderUpdate', 'onTrade',
+                     'onAckModifyOrders', 'onNews'):
+            callback = getattr(t, name, None)
+            if callable(callback) and getattr(callback, '__self__', None) is not t:
+                setattr(t, name, self.timed_callback(name, callback))
+        return t
+
+    def summary(self):
+        return {'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+                'counts': dict(self.counts)}
+
+    def report(self, out=None):
+        out = out or sys.stdout
+        print("%-36s %8s %10s %10s %10s %10s %10s" % (('latency (us)', 'count', 'mean')
+                                                      + tuple('p%g' % p for p in PERCENTILES)), file=out)
+        for name, h in sorted(self.histograms.items()):
+            print("%-36s %8d %10.1f %10.1f %10.1f %10.1f %10.1f" % ((name, h.count, h.total / h.count)
+                                                                    + tuple(h.percentile(p) for p in PERCENTILES)), file=out)
+        for name, n in sorted(self.counts.items()):
+            print("%-36s %8d" % (name, n), file=out)
+
+    def export(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+# Stand-in used while instrumentation is off
+class NullProfiler:
+    def record(self, name, us):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def sent(self, kind, received, seq=None):
+        pass
+
+    def acked(self, received, seq=None):
+        pass
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+PROFILER = NullProfiler()
+
+def stage(name):
+    return PROFILER.stage(name)
+
+def count(name, n=1):
+    PROFILER.count(name, n)
+
+def record(name, us):
+    PROFILER.record(name, us)
+
+def sent(kind, received, seq=None):
+    PROFILER.sent(kind, received, seq)
+
+def acked(received, seq=None):
+    PROFILER.acked(received, seq)
+
+# Turns instrumentation on (for t's callbacks, if given); reports (and exports to path) at exit
+def enable(t=None, path=None):
+    global PROFILER
+    if not isinstance(PROFILER, Profiler):
+        PROFILER = Profiler()
+        def finish():
+            PROFILER.report()
+            if path:
+                PROFILER.export(path)
+        atexit.register(finish)
+    if t is not None:
+        PROFILER.wrap(t)
+    return PROFILER
+
+# Reads the BOT_PROFILE switch: (enabled, export path or None)
+def profile_setting(value):
+    if not value or value == '0':
+        return False, None
+    return True, (None if value == '1' else value)
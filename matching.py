@@ -0,0 +1,213 @@
+import bisect
+from collections import deque
+
+# Price-time priority matching engine for the backtester.
+# Drop-in replacement for backtest.SimpleFillModel, built from what the case
+# file says about each security:
+# - Lit securities get a market maker that re-quotes BOOK_LEVELS levels per side
+#   every tick, pricepath.spread wide around the fair price, with
+#   pricepath.volume at each level. The fair price is pricepath.price plus an
+#   impact offset. Our fills against the market maker move the offset by
+#   quantity / price_reaction. Each tick, pricepath.strictness pulls the offset
+#   back towards the path (0 keeps it, 1 removes it).
+# - Dark securities have no market maker and show no book. Our resting orders
+#   there cross each other and the case's custom orders. A custom order is
+#   live from its time for `duration` ticks and trades as a taker at our price.
+#   An order of ours that crosses a live custom order takes it at the custom
+#   order's price, within both limits, as it would a resting order.
+# - Our orders queue behind earlier orders at the same price. They trade at the
+#   resting order's price and fill against the market maker's quotes.
+# - Takers pay fee_amount per share and makers receive rebate_amount per share.
+#   Trading with ourselves is fined self_trading_fine_amount per share.
+# Fills carry 'fee' and 'fine' for Backtest.settle.
+
+BOOK_LEVELS = 5
+
+# One security's resting orders: a FIFO of orders per price level
+class Book:
+    def __init__(self):
+        self.levels = {'bid': {}, 'ask': {}}
+        self.prices = {'bid': [], 'ask': []}
+
+    def add(self, side, price, entry):
+        queue = self.levels[side].get(price)
+        if queue is None:
+            queue = self.levels[side][price] = deque()
+            bisect.insort(self.prices[side], price)
+        queue.append(entry)
+
+    def remove(self, side, price, entry):
+        queue = self.levels[side].get(price)
+        if queue is None:
+            return False
+        try:
+            queue.remove(entry)
+        except ValueError:
+            return False
+        if not queue:
+            self.drop_level(side, price)
+        return True
+
+    def drop_level(self, side, price):
+        del self.levels[side][price]
+        prices = self.prices[side]
+        del prices[bisect.bisect_left(prices, price)]
+
+    def best(self, side):
+        prices = self.prices[side]
+        if not prices:
+            return None
+        return prices[-1] if side == 'bid' else prices[0]
+
+    # {price string: quantity} per side, like the server's market_state
+    def snapshot(self, digits):
+        out = []
+        for side in ('bid', 'ask'):
+            out.append({'%.*f' % (digits, price): sum(e['quantity'] for e in queue)
+                        for price, queue in self.levels[side].items()})
+        return out
+
+class MatchingEngine:
+    def __init__(self, case):
+        self.case = case
+        self.securities = {ticker: sec for ticker, sec in case['securities'].items() if sec['tradeable']}
+        self.books = {ticker: Book() for ticker in self.securities}
+        self.digits = {ticker: sec.get('maximum_decimal_digits', 2) for ticker, sec in self.securities.items()}
+        self.offset = dict.fromkeys(self.securities, 0.)
+        self.quotes = {ticker: [] for ticker in self.securities}
+        self.orders = {}
+        self.customs = []
+        self.queued = []
+        self.elapsed = None
+
+    def path_value(self, ticker, field, t):
+        path = self.securities[ticker]['pricepath'][field]
+        return path[min(t, len(path) - 1)]
+
+    def fair_price(self, ticker):
+        return self.path_value(ticker, 'price', self.elapsed) + self.offset[ticker]
+
+    def last_price(self, ticker):
+        return self.fair_price(ticker)
+
+    def book(self, ticker):
+        if self.securities[ticker].get('dark'):
+            return {}, {}
+        return self.books[ticker].snapshot(self.digits[ticker])
+
+    # Advances to tick t: decays impact, re-quotes the market makers and runs live custom orders.
+    # Fills this causes are returned by the next match_resting()
+    def tick(self, t):
+        if t == self.elapsed:
+            return
+        first = self.elapsed is None
+        self.elapsed = t
+        for ticker, sec in self.securities.items():
+            if sec.get('dark'):
+                continue
+            if not first:
+                self.offset[ticker] *= 1 - min(max(self.path_value(ticker, 'strictness', t), 0.), 1.)
+            self.requote(ticker)
+        self.customs = [c for c in self.customs if c['time'] + c['duration'] > t]
+        for c in self.case.get('custom_orders', []):
+            if c['time'] == t and c['ticker'] in self.securities:
+                self.customs.append(dict(c, order_id=None, custom=True))
+        for custom in self.customs:
+            self.match(custom, self.queued)
+
+    def requote(self, ticker):
+        book = self.books[ticker]
+        for side, price, entry in self.quotes[ticker]:
+            book.remove(side, price, entry)
+        self.quotes[ticker] = []
+        volume = self.path_value(ticker, 'volume', self.elapsed)
+        if volume <= 0:
+            return
+        digits = self.digits[ticker]
+        tick_size = 10. ** -digits
+        fair = self.fair_price(ticker)
+        half = max(self.path_value(ticker, 'spread', self.elapsed) / 2, tick_size)
+        for i in range(BOOK_LEVELS):
+            for buy, price in ((True, round(fair - half - i * tick_size, digits)),
+                               (False, round(fair + half + i * tick_size, digits))):
+                quote = {'order_id': None, 'ticker': ticker, 'buy': buy, 'quantity': volume,
+                         'price': price, 'market_maker': True}
+                # a quote that crosses our resting orders trades with them first
+                self.match(quote, self.queued)
+                if quote['quantity'] > 0:
+                    side = 'bid' if buy else 'ask'
+                    book.add(side, price, quote)
+                    self.quotes[ticker].append((side, price, quote))
+
+    def submit(self, order):
+        fills = []
+        self.match(order, fills)
+        ticker = order['ticker']
+        if self.securities[ticker].get('dark'):
+            for custom in self.customs:
+                if order['quantity'] <= 0:
+                    break
+                if custom['ticker'] != ticker or custom['buy'] == order['buy'] or custom['quantity'] <= 0:
+                    continue
+                price = custom.get('price')
+                if price is None:
+                    price = order['price'] if order['price'] is not None else self.path_value(ticker, 'price', self.elapsed)
+                elif order['price'] is not None and (price > order['price'] if order['buy'] else price < order['price']):
+                    continue
+                self.trade(order, custom, price, fills)
+        if order['quantity'] > 0 and order['price'] is not None:
+            side = 'bid' if order['buy'] else 'ask'
+            self.books[ticker].add(side, order['price'], order)
+            self.orders[order['order_id']] = (ticker, side, order['price'], order)
+        return fills
+
+    def cancel(self, order_id):
+        entry = self.orders.pop(order_id, None)
+        if entry is None:
+            return False
+        ticker, side, price, order = entry
+        return self.books[ticker].remove(side, price, order)
+
+    def match_resting(self):
+        fills, self.queued = self.queued, []
+        return fills
+
+    # Crosses a taker against the opposite side of its book, best price first then oldest first
+    def match(self, taker, fills):
+        ticker = taker['ticker']
+        book = self.books[ticker]
+        side = 'ask' if taker['buy'] else 'bid'
+        limit = taker['price']
+        while taker['quantity'] > 0:
+            level = book.best(side)
+            if level is None or (limit is not None and (level > limit if taker['buy'] else level < limit)):
+                break
+            maker = book.levels[side][level][0]
+            self.trade(taker, maker, level, fills)
+            if maker['quantity'] <= 0:
+                book.levels[side][level].popleft()
+                if not book.levels[side][level]:
+                    book.drop_level(side, level)
+                if maker.get('order_id') is not None:
+                    self.orders.pop(maker['order_id'], None)
+
+    # Trades quant = min of both quantities between a taker and a maker at price
+    def trade(self, taker, maker, price, fills):
+        quant = min(taker['quantity'], maker['quantity'])
+        taker['quantity'] -= quant
+        maker['quantity'] -= quant
+        ticker = taker['ticker']
+        sec = self.securities[ticker]
+        ours_taker = taker.get('order_id') is not None
+        ours_maker = maker.get('order_id') is not None
+        fine = sec.get('self_trading_fine_amount', 0.) * quant if ours_taker and ours_maker else 0.
+        if ours_taker:
+            fills.append({'order_id': taker['order_id'], 'ticker': ticker, 'buy': taker['buy'], 'quantity': quant,
+                          'price': price, 'fee': sec.get('fee_amount', 0.) * quant, 'fine': fine})
+        if ours_maker:
+            fills.append({'order_id': maker['order_id'], 'ticker': ticker, 'buy': maker['buy'], 'quantity': quant,
+                          'price': price, 'fee': -sec.get('rebate_amount', 0.) * quant, 'fine': 0.})
+        # only our own aggressive trades against the market maker move its price
+        reaction = sec.get('price_reaction') or 0
+        if reaction and ours_taker and maker.get('market_maker'):
+            self.offset[ticker] += (quant if taker['buy'] else -quant) / reaction
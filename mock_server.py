@@ -0,0 +1,166 @@
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timezone
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+from tornado import gen
+import backtest
+
+# Local stand-in for the MangoCore exchange, for end-to-end latency tests.
+# Serves the websocket protocol TradersBot speaks (ws://host:10914/<id>/<password>)
+# and replays a case file to every connected bot through its own
+# backtest.Backtest session, so the market, fills and trader state behave as in
+# the offline backtester. The bots are unchanged and run as separate processes.
+#
+# Time runs at --speed times real time (one case tick every 1/speed seconds).
+# With --flood RATE the server also resends market states at RATE messages per
+# second between ticks. Every message carries a sequence number ('seq'). A
+# bot running with BOT_PROFILE set times, per type of message that made it
+# order, the round trip to the ACK MODIFY ORDERS of those orders, and from the
+# seq numbers the backlog: how many messages the server had sent after the one
+# being answered, so how far the bot has fallen behind (see latency.py; bots
+# only have round trips for the messages they order on, e.g. none for MARKET
+# UPDATE in shen_wang_algost.py, which orders on news and trader updates).
+# Both are in the bot's percentile summary at exit; the server reports its
+# message counts. Raise --flood until the round trip and backlog stop being
+# flat to find a bot's highest sustainable message rate.
+#
+# Usage: python mock_server.py <case.json> [--speed 10] [--flood 500] [--fill-model matching]
+#   then run a bot against it: BOT_PROFILE=1 python shen_wang_algost.py localhost trader0 trader0
+
+PORT = 10914
+
+def server_time():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+# One bot's session: a backtest whose callbacks are messages on the websocket
+class ServerSession(backtest.Backtest):
+    def __init__(self, case, socket, fill_model=None):
+        super().__init__(case, None, fill_model)
+        self.socket = socket
+        self.seq = 0
+        self.sent = 0
+        self.received = 0
+
+    def market_state(self, ticker):
+        state = super().market_state(ticker)
+        state['time'] = server_time()
+        return state
+
+    def trader_state(self):
+        state = super().trader_state()
+        state['time'] = server_time()
+        return state
+
+    def dispatch(self, name, msg):
+        if self.socket.closed:
+            return
+        msg['elapsed_time'] = self.elapsed
+        self.seq += 1
+        msg['seq'] = self.seq
+        self.socket.write_message(json.dumps(msg))
+        self.sent += 1
+
+    # MODIFY ORDERS from the bot: executed as the backtest would, acked at once
+    def modify(self, msg):
+        self.received += 1
+        order = backtest.SimOrder()
+        for o in msg.get('orders', []):
+            order.addTrade(o['ticker'], o['buy'], o['quantity'], o.get('price'), o.get('token'))
+        for c in msg.get('cancels', []):
+            order.addCancel(c['ticker'], c['order_id'])
+        self.execute(order)
+        self.drain()
+
+    def flood(self):
+        ticker = random.choice(list(self.securities))
+        self.dispatch('onMarketUpdate', {'message_type': 'MARKET UPDATE', 'market_state': self.market_state(ticker)})
+
+    def report(self, name):
+        print("%s: PnL %.2f, %d messages sent, %d order messages received" % (
+            name, self.pnl(), self.sent, self.received))
+
+class ExchangeSocket(tornado.websocket.WebSocketHandler):
+    def initialize(self, server):
+        self.server = server
+        self.session = None
+        self.closed = False
+
+    def open(self, trader_id, password):
+        if password != self.server.password:
+            self.close(code=4001, reason='bad password')
+            return
+        self.trader_id = trader_id
+
+    def on_message(self, message):
+        msg = json.loads(message)
+        kind = msg.get('message_type')
+        if kind == 'REGISTER' and self.session is None:
+            self.session = ServerSession(self.server.case, self, self.server.fill_model(self.server.case))
+            tornado.ioloop.IOLoop.current().spawn_callback(self.play)
+        elif kind == 'MODIFY ORDERS' and self.session is not None:
+            self.session.modify(msg)
+
+    def on_close(self):
+        self.closed = True
+
+    @gen.coroutine
+    def play(self):
+        session = self.session
+        session.register()
+        period = 1. / self.server.speed
+        rate = self.server.flood
+        start = time.perf_counter()
+        for t in range(session.case_length):
+            if self.closed:
+                break
+            session.step(t)
+            due = start + (t + 1) * period
+            flooded = 0
+            tick_start = time.perf_counter()
+            while not self.closed:
+                now = time.perf_counter()
+                if now >= due:
+                    break
+                # send whatever the flood rate owes so far, then yield to read the bot's orders
+                owed = int((now - tick_start) * rate) - flooded
+                for _ in range(owed):
+                    session.flood()
+                flooded += owed
+                yield gen.sleep(min(due - now, 0.001) if rate else due - now)
+        session.report(self.trader_id)
+        if not self.closed:
+            self.close()
+
+class MockServer:
+    def __init__(self, case, speed=1., flood=0, fill_model=backtest.SimpleFillModel, password='trader0'):
+        self.case = case
+        self.speed = speed
+        self.flood = flood
+        self.fill_model = fill_model
+        self.password = password
+
+    def listen(self, port=PORT):
+        app = tornado.web.Application([(r'/([^/]+)/([^/]+)', ExchangeSocket, {'server': self})])
+        app.listen(port)
+        return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the MangoCore exchange")
+    parser.add_argument('case')
+    parser.add_argument('--speed', type=float, default=1., help="case seconds per real second")
+    parser.add_argument('--flood', type=float, default=0, help="extra market updates per second")
+    parser.add_argument('--fill-model', choices=sorted(backtest.FILL_MODELS), default='simple')
+    parser.add_argument('--password', default='trader0')
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    server = MockServer(backtest.load_case(args.case), args.speed, args.flood,
+                        backtest.FILL_MODELS[args.fill_model], args.password)
+    server.listen(args.port)
+    print("Serving %s on port %d at %gx" % (args.case, args.port, args.speed))
+    sys.stdout.flush()
+    tornado.ioloop.IOLoop.current().start()
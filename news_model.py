@@ -0,0 +1,106 @@
+import heapq
+import numpy as np
+
+# News-impact model for the AlgoS&T case.
+# Each news item says a source is buying or selling `amount` shares. If the
+# source is informed, the LIT price should move by about C * amount in that
+# direction within `lag` seconds. For every item the model measures
+#     impact = realised LIT move / (C * signed amount)
+# and treats each source's impacts as draws from N(mu, sigma^2). It keeps a
+# Normal-Inverse-Gamma posterior over (mu, sigma^2) per source, so both the
+# source's mean impact and its noise are learned. The four posterior
+# parameters live in arrays indexed by source.
+#
+# Items wait in a heap keyed on news time + lag. evaluate() pops every item that
+# is due and folds them into the posteriors in one vectorized step, so an
+# update with nothing due costs one heap peek.
+class NewsModel:
+    # The default prior matches the bot's old beliefs: mu ~ N(0.5, 0.5^2) with unit noise variance
+    def __init__(self, sources, C, lag=9, prior_mean=0.5, prior_std=0.5, prior_var=1., prior_strength=2.):
+        self.sources = list(sources)
+        self.index = {source: i for i, source in enumerate(self.sources)}
+        self.C = C
+        self.lag = lag
+        n = len(self.sources)
+        # alpha = prior_strength + 1 puts E[sigma^2] = beta / (alpha - 1) at prior_var
+        self.prior = (prior_mean, prior_var / prior_std ** 2, prior_strength + 1., prior_var * prior_strength)
+        self.mu = np.full(n, self.prior[0])
+        self.kappa = np.full(n, self.prior[1])
+        self.alpha = np.full(n, self.prior[2])
+        self.beta = np.full(n, self.prior[3])
+        self.observations = np.zeros(n, dtype=int)
+        self.pending = []
+        self.seq = 0
+
+    # Queues a news item for evaluation lag seconds after it came out; price is the LIT price then
+    def push(self, source, amount, buy, time, price):
+        signed = amount if buy else -amount
+        if source not in self.index or signed == 0:
+            return
+        heapq.heappush(self.pending, (time + self.lag, self.seq, self.index[source], signed, price))
+        self.seq += 1
+
+    # Folds in every queued item due by time, measured against the current LIT price.
+    # Returns the number of items evaluated
+    def evaluate(self, time, price):
+        if not self.pending or self.pending[0][0] > time:
+            return 0
+        due = []
+        while self.pending and self.pending[0][0] <= time:
+            due.append(heapq.heappop(self.pending))
+        _, _, sources, signed, start = np.array(due, dtype=float).T
+        self.observe(sources.astype(int), (price - start) / (self.C * signed))
+        return len(due)
+
+    # Conjugate update of the posteriors with impacts y observed for the given source indices
+    def observe(self, sources, y):
+        n_sources = len(self.sources)
+        n = np.bincount(sources, minlength=n_sources).astype(float)
+        seen = n > 0
+        total = np.bincount(sources, weights=y, minlength=n_sources)
+        ybar = np.divide(total, n, out=np.zeros(n_sources), where=seen)
+        ss = np.bincount(sources, weights=(y - ybar[sources]) ** 2, minlength=n_sources)
+        kappa = self.kappa + n
+        self.beta = self.beta + 0.5 * ss + self.kappa * n * (ybar - self.mu) ** 2 / (2 * kappa)
+        self.mu = np.where(seen, (self.kappa * self.mu + total) / kappa, self.mu)
+        self.alpha = self.alpha + n / 2
+        self.kappa = kappa
+        self.observations += n.astype(int)
+
+    # Rebuilds every source's posterior from the prior and the full news history in one batch,
+    # measuring each item at the LIT price standing at its due time (evaluate() takes the first
+    # update past it, which can be well after a quiet spell or a reconnect).
+    # history is [source, amount, action, time, LIT price] entries; price_times/prices is the
+    # LIT price series, and items whose lag has not passed in it yet stay queued. Returns False
+    # and keeps the posteriors when the series no longer reaches back to the oldest item
+    def reestimate(self, history, price_times, prices):
+        items = [h for h in history if h[0] in self.index and h[1]]
+        if len(prices) == 0:
+            return False
+        sources = np.array([self.index[h[0]] for h in items], dtype=int)
+        signed = np.array([h[1] if h[2] == 'buy' else -h[1] for h in items], dtype=float)
+        due = np.array([h[3] for h in items], dtype=float) + self.lag
+        start = np.array([h[4] for h in items], dtype=float)
+        if (due < price_times[0]).any():
+            return False
+        self.mu[:], self.kappa[:], self.alpha[:], self.beta[:] = self.prior
+        self.observations[:] = 0
+        done = due <= price_times[-1]
+        after = prices[np.searchsorted(price_times, due[done], side='right') - 1]
+        self.observe(sources[done], (after - start[done]) / (self.C * signed[done]))
+        # what was just measured must not be evaluated a second time
+        self.pending = [p for p in self.pending if p[0] > price_times[-1]]
+        heapq.heapify(self.pending)
+        return True
+
+    # Posterior mean of a source's impact (the expected fraction of C * amount the price moves)
+    def impact(self, source):
+        return self.mu[self.index[source]]
+
+    # Posterior standard deviation of the mean impact
+    def impact_std(self):
+        return np.sqrt(self.beta / ((self.alpha - 1) * self.kappa))
+
+    # Posterior mean of each source's noise variance
+    def noise_var(self):
+        return self.beta / (self.alpha - 1)
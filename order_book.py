@@ -0,0 +1,79 @@
+import math
+from bisect import bisect_left, insort
+
+# Incrementally maintained order book for one ticker.
+# The server sends the full {price string: quantity} dicts on every update;
+# update() diffs them against the previous message by wire key and only parses
+# and re-sorts the levels that actually changed. Level prices are kept sorted
+# (ascending on both sides) next to a price -> quantity map, so the touch is
+# O(1), depth queries walk out from it, and level updates are O(log n) searches.
+class OrderBook:
+    def __init__(self, ticker=None):
+        self.ticker = ticker
+        self.levels = {'bid': {}, 'ask': {}}
+        self.prices = {'bid': [], 'ask': []}
+        self.raw = {'bid': {}, 'ask': {}}
+
+    # Applies a MARKET UPDATE's bids/asks dicts as a diff against the current book
+    def update(self, bids, asks):
+        self.apply_raw('bid', bids)
+        self.apply_raw('ask', asks)
+
+    def apply_raw(self, side, new):
+        old = self.raw[side]
+        for key in old:
+            if key not in new:
+                self.set_level(side, float(key), 0)
+        for key, quant in new.items():
+            if old.get(key) != quant:
+                self.set_level(side, float(key), quant)
+        self.raw[side] = dict(new)
+
+    # Sets the quantity at one price level (0 removes the level)
+    def set_level(self, side, price, quant):
+        levels, prices = self.levels[side], self.prices[side]
+        if quant > 0:
+            if price not in levels:
+                insort(prices, price)
+            levels[price] = quant
+        elif price in levels:
+            del levels[price]
+            del prices[bisect_left(prices, price)]
+
+    @property
+    def best_bid(self):
+        prices = self.prices['bid']
+        return prices[-1] if prices else math.nan
+
+    @property
+    def best_ask(self):
+        prices = self.prices['ask']
+        return prices[0] if prices else math.nan
+
+    @property
+    def spread(self):
+        return self.best_ask - self.best_bid
+
+    @property
+    def mid(self):
+        return (self.best_ask + self.best_bid) / 2
+
+    # Levels from the touch outwards as (price, quantity)
+    def walk(self, side):
+        levels, prices = self.levels[side], self.prices[side]
+        ordered = reversed(prices) if side == 'bid' else prices
+        for price in ordered:
+            yield price, levels[price]
+
+    # Filling quant against one side: (quantity available, average price, worst price)
+    def depth(self, side, quant):
+        filled = cost = 0.
+        worst = math.nan
+        for price, size in self.walk(side):
+            if filled >= quant:
+                break
+            take = min(size, quant - filled)
+            filled += take
+            cost += take * price
+            worst = price
+        return filled, (cost / filled if filled else math.nan), worst
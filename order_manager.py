@@ -0,0 +1,269 @@
+import math
+from collections import Counter
+
+# Case seconds a sent order may go unacknowledged once a TRADER UPDATE has left it out
+ACK_TIMEOUT = 2
+
+# Order manager shared by the bots.
+# Keeps an indexed view of our open orders (by id and by ticker) and of orders
+# sent but not yet acknowledged, reconciles positions from fills and from the
+# server's trader_state, and checks every new order against the case limits
+# (order size, max open orders, position limits) before it is sent. The
+# quantity working on each side of each ticker is kept as a running total,
+# updated as orders are added, acked, filled and cancelled, so a limit check
+# costs one lookup per ticker in the limit and never scans orders. Strategies
+# call buy/sell/cancel during a callback and flush(order) once at the end, which
+# writes every cancel and new order of that callback into the one TradersOrder
+# batch the callback sends.
+class OrderManager:
+    def __init__(self):
+        self.positions = Counter()
+        self.open = {}
+        self.by_ticker = {}
+        self.pending = []
+        self.batch = []
+        self.cancels = {}
+        self.max_open_orders = math.inf
+        self.min_size = {}
+        self.max_size = {}
+        self.limits = []
+        self.rejected = Counter()
+        # (ticker, buy) -> quantity working: open (less those being cancelled), pending and batched
+        self.working_quant = Counter()
+        # elapsed_time of the latest message we were given; sent orders are stamped with it
+        self.elapsed = 0.
+
+    def seen(self, msg):
+        if msg.get('elapsed_time') is not None:
+            self.elapsed = msg['elapsed_time']
+
+    # Reads order sizes, max open orders and underlying position limits from ACK REGISTER's case_meta
+    def configure(self, case_meta):
+        # limits are rebuilt on every register (a reconnect registers again)
+        self.limits = []
+        self.max_open_orders = case_meta.get('max_open_orders', math.inf)
+        securities = case_meta.get('securities', {})
+        for ticker, sec in securities.items():
+            self.min_size[ticker] = sec.get('minimum_order_size', 0)
+            self.max_size[ticker] = sec.get('maximum_order_size', math.inf)
+        for name, underlying in case_meta.get('underlyings', {}).items():
+            if 'limit' not in underlying:
+                continue
+            weights = {ticker: sec['underlyings'][name] for ticker, sec in securities.items()
+                       if name in sec.get('underlyings', {})}
+            if weights:
+                self.add_limit(name, weights, underlying['limit'])
+
+    # Adds a position limit on sum(weight * position) (or sum(|weight * position|) if gross)
+    def add_limit(self, name, weights, limit, gross=False):
+        self.limits.append((name, dict(weights), limit, gross))
+
+    def position(self, ticker):
+        return self.positions[ticker]
+
+    # Quantity working (open, pending or about to be sent) on one side of a ticker
+    def working(self, ticker, buy):
+        return self.working_quant[(ticker, buy)]
+
+    def count_working(self, o, quant):
+        self.working_quant[(o['ticker'], o['buy'])] += quant
+
+    # Rebuilds the working totals from the orders themselves
+    def recount(self):
+        self.working_quant = Counter()
+        for o in self.pending + self.batch:
+            self.count_working(o, o['quantity'])
+        for order_id, o in self.open.items():
+            if order_id not in self.cancels:
+                self.count_working(o, o['quantity'])
+
+    # Open orders, optionally for one ticker
+    def orders(self, ticker=None):
+        if ticker is None:
+            return list(self.open.values())
+        return [self.open[order_id] for order_id in self.by_ticker.get(ticker, ())]
+
+    def open_count(self):
+        return len(self.open) - len(self.cancels) + len(self.pending) + len(self.batch)
+
+    # Worst-case exposure of a limit group if every working order on one side filled
+    def exposure(self, weights, gross, extra_ticker=None, extra=0):
+        long_total = short_total = 0.
+        for ticker, weight in weights.items():
+            pos = self.positions[ticker]
+            long_pos = pos + self.working(ticker, True)
+            short_pos = pos - self.working(ticker, False)
+            if ticker == extra_ticker:
+                long_pos += max(extra, 0)
+                short_pos += min(extra, 0)
+            if gross:
+                long_total += abs(weight) * max(abs(long_pos), abs(short_pos))
+            else:
+                long_total += max(weight * long_pos, weight * short_pos)
+                short_total += min(weight * long_pos, weight * short_pos)
+        return long_total if gross else max(abs(long_total), abs(short_total))
+
+    # Returns None if the order may be sent, else why not
+    def check(self, ticker, buy, quant, price):
+        if quant <= 0:
+            return 'non-positive quantity'
+        if quant < self.min_size.get(ticker, 0):
+            return 'below minimum order size'
+        if quant > self.max_size.get(ticker, math.inf):
+            return 'above maximum order size'
+        if self.open_count() + 1 > self.max_open_orders:
+            return 'too many open orders'
+        signed = quant if buy else -quant
+        for name, weights, limit, gross in self.limits:
+            if ticker in weights:
+                before = self.exposure(weights, gross)
+                after = self.exposure(weights, gross, ticker, signed)
+                # orders that only reduce an existing breach are still allowed
+                if after > limit and after > before:
+                    return 'breaches %s limit' % name
+        return None
+
+    # Queues an order for this callback's batch; returns False (and counts why) if rejected. token
+    # goes out with the order and comes back on its ack
+    def add(self, ticker, buy, quant, price=None, token=None):
+        reason = self.check(ticker, buy, quant, price)
+        if reason is not None:
+            self.rejected[reason] += 1
+            return False
+        o = {'ticker': ticker, 'buy': buy, 'quantity': quant, 'price': price, 'token': token}
+        self.batch.append(o)
+        self.count_working(o, quant)
+        return True
+
+    # Queues all of legs [(ticker, buy, quant, price)] or none of them: each leg is checked with the
+    # earlier ones already working, and those are taken back out if a later one is rejected
+    def add_all(self, legs):
+        start = len(self.batch)
+        for ticker, buy, quant, price in legs:
+            if not self.add(ticker, buy, quant, price):
+                for o in self.batch[start:]:
+                    self.count_working(o, -o['quantity'])
+                del self.batch[start:]
+                return False
+        return True
+
+    def buy(self, ticker, quant, price=None):
+        return self.add(ticker, True, quant, price)
+
+    def sell(self, ticker, quant, price=None):
+        return self.add(ticker, False, quant, price)
+
+    def cancel(self, order_id):
+        o = self.open.get(order_id)
+        if o is not None and order_id not in self.cancels:
+            self.cancels[order_id] = o['ticker']
+            self.count_working(o, -o['quantity'])
+
+    # Cancels every open order matching predicate(order), optionally for one ticker
+    def cancel_where(self, predicate, ticker=None):
+        for o in self.orders(ticker):
+            if predicate(o):
+                self.cancel(o['order_id'])
+
+    # Writes this callback's cancels and new orders into the TradersOrder as one batch
+    def flush(self, order):
+        for order_id, ticker in self.cancels.items():
+            order.addCancel(ticker, order_id)
+            # working again until the cancel is confirmed
+            o = self.open.get(order_id)
+            if o is not None:
+                self.count_working(o, o['quantity'])
+        for o in self.batch:
+            if o['buy']:
+                order.addBuy(o['ticker'], quantity=o['quantity'], price=o['price'], token=o['token'])
+            else:
+                order.addSell(o['ticker'], quantity=o['quantity'], price=o['price'], token=o['token'])
+            o['time'] = self.elapsed
+        self.pending += self.batch
+        self.batch = []
+        self.cancels = {}
+
+    # An order the TRADER UPDATE already listed (and maybe part filled since) may be acked afterwards;
+    # the listed one is kept
+    def add_open(self, o):
+        if o['order_id'] in self.open:
+            return
+        self.open[o['order_id']] = o
+        self.by_ticker.setdefault(o['ticker'], set()).add(o['order_id'])
+        if o['order_id'] not in self.cancels:
+            self.count_working(o, o['quantity'])
+
+    def remove_open(self, order_id):
+        o = self.open.pop(order_id, None)
+        if o is not None:
+            self.by_ticker[o['ticker']].discard(order_id)
+            if self.cancels.pop(order_id, None) is None:
+                self.count_working(o, -o['quantity'])
+
+    # ACK MODIFY ORDERS: sent orders become open (or disappear if rejected), cancels are confirmed
+    def on_ack(self, msg):
+        self.seen(msg)
+        for o in msg.get('orders', []):
+            for i, p in enumerate(self.pending):
+                if acked_as(p, o):
+                    del self.pending[i]
+                    self.count_working(p, -p['quantity'])
+                    break
+            if o.get('order_id') and not o.get('error'):
+                self.add_open({'order_id': o['order_id'], 'ticker': o['ticker'], 'buy': o['buy'],
+                               'quantity': o['quantity'], 'price': o.get('price')})
+        for order_id, error in (msg.get('cancels') or {}).items():
+            if error is None:
+                self.remove_open(order_id)
+
+    # TRADE: books fills of our own orders into positions and open quantities.
+    # Returns our fills as (ticker, signed quantity, price)
+    def on_trade(self, msg):
+        self.seen(msg)
+        fills = []
+        for trade in msg.get('trades', []):
+            for key, sign in (('buy_order_id', 1), ('sell_order_id', -1)):
+                o = self.open.get(trade.get(key))
+                if o is None:
+                    continue
+                self.positions[o['ticker']] += sign * trade['quantity']
+                fills.append((o['ticker'], sign * trade['quantity'], trade['price']))
+                o['quantity'] -= trade['quantity']
+                if o['order_id'] not in self.cancels:
+                    self.count_working(o, -trade['quantity'])
+                if o['quantity'] <= 0:
+                    self.remove_open(o['order_id'])
+        return fills
+
+    # TRADER UPDATE: the server's positions and open orders replace our view. Orders sent after the
+    # server built the update are not in it, so unacknowledged orders it does not list stay pending
+    # until their ack, or until they are ACK_TIMEOUT old
+    def on_trader_update(self, msg):
+        self.seen(msg)
+        state = msg['trader_state']
+        self.positions = Counter({ticker: int(quant) for ticker, quant in state.get('positions', {}).items()})
+        self.open = {}
+        self.by_ticker = {}
+        for order_id, o in state.get('open_orders', {}).items():
+            self.add_open({'order_id': o.get('order_id', order_id), 'ticker': o['ticker'], 'buy': o['buy'],
+                           'quantity': o['quantity'], 'price': o.get('price')})
+        listed = list(self.open.values())
+        pending = []
+        for p in self.pending:
+            for i, o in enumerate(listed):
+                if acked_as(p, o):
+                    del listed[i]
+                    break
+            else:
+                if self.elapsed - p.get('time', self.elapsed) <= ACK_TIMEOUT:
+                    pending.append(p)
+        self.pending = pending
+        self.recount()
+
+# True if order o of an ACK MODIFY ORDERS answers the order we sent: by token when both carry
+# one, else by ticker, side, quantity and price
+def acked_as(sent, o):
+    if sent.get('token') is not None and o.get('token') is not None:
+        return sent['token'] == o['token']
+    return (sent['ticker'] == o['ticker'] and sent['buy'] == o['buy'] and sent['quantity'] == o['quantity']
+            and sent['price'] == o.get('price'))
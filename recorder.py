@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+import numpy as np
+
+# Binary session recorder.
+# Recorder(path).wrap(t) wraps a TradersBot's (or the backtester's SimBot's)
+# callbacks and appends what it sees to one file per stream of fixed-width
+# NumPy records:
+#   market    one row per market_state: last price and the top DEPTH book levels
+#   trade     one row per trade
+#   news      one row per news item
+#   trader    one row per trader_state: cash, PnL, fees, fines, open order count
+#   position  one row per ticker per trader_state
+#   order     one row per order event: sent, acked, rejected, cancel sent, cancel acked
+# Strings (tickers, order ids, news sources and headlines) are stored as indices
+# into symbols.txt. Rows go into preallocated chunks and full chunks are written
+# by a background thread, so a callback never waits on the disk. load(path)
+# maps the files back as structured arrays without parsing anything.
+#
+# Turn it on by setting BOT_RECORD to a directory when running a bot or
+# backtest.py; every session gets its own subdirectory.
+
+DEPTH = 5
+CHUNK = 4096
+
+SEND, ACK, REJECT, CANCEL, CANCEL_ACK = range(5)
+
+STREAMS = {
+    'market': [('wall', 'f8'), ('elapsed', 'f8'), ('ticker', 'i4'), ('last_price', 'f8'),
+               ('bid', 'f8', (DEPTH,)), ('bid_size', 'f8', (DEPTH,)),
+               ('ask', 'f8', (DEPTH,)), ('ask_size', 'f8', (DEPTH,))],
+    'trade': [('wall', 'f8'), ('elapsed', 'f8'), ('ticker', 'i4'), ('price', 'f8'), ('quantity', 'f8'),
+              ('buy', '?'), ('buy_order', 'i4'), ('sell_order', 'i4')],
+    'news': [('wall', 'f8'), ('elapsed', 'f8'), ('time', 'f8'), ('source', 'i4'), ('amount', 'f8'),
+             ('headline', 'i4')],
+    'trader': [('wall', 'f8'), ('elapsed', 'f8'), ('cash', 'f8'), ('pnl', 'f8'), ('fees', 'f8'),
+               ('fines', 'f8'), ('open_orders', 'i4')],
+    'position': [('wall', 'f8'), ('elapsed', 'f8'), ('ticker', 'i4'), ('quantity', 'f8')],
+    'order': [('wall', 'f8'), ('elapsed', 'f8'), ('event', 'i1'), ('ticker', 'i4'), ('order', 'i4'),
+              ('buy', '?'), ('quantity', 'f8'), ('price', 'f8')],
+}
+
+# Top n levels of a {price string: quantity} side, best first, nan/0 padded
+def book_levels(side, descending, n=DEPTH):
+    levels = sorted(((float(p), q) for p, q in side.items() if q), reverse=descending)[:n]
+    pad = n - len(levels)
+    return [p for p, _ in levels] + [np.nan] * pad, [q for _, q in levels] + [0] * pad
+
+def number(value):
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def total(value):
+    # cash/pnl come as {currency: amount}
+    if isinstance(value, dict):
+        return float(sum(value.values()))
+    return number(value)
+
+# Records an order object's sends and cancels on their way to the real one
+class RecordedOrder:
+    def __init__(self, order, recorder, elapsed):
+        self.order = order
+        self.recorder = recorder
+        self.elapsed = elapsed
+
+    def addBuy(self, ticker, quantity, price=None, token=None):
+        self.addTrade(ticker, True, quantity, price, token)
+
+    def addSell(self, ticker, quantity, price=None, token=None):
+        self.addTrade(ticker, False, quantity, price, token)
+
+    def addTrade(self, ticker, isBuy, quantity, price=None, token=None):
+        self.recorder.order(self.elapsed, SEND, ticker, None, isBuy, quantity, price)
+        self.order.addTrade(ticker, isBuy, quantity, price, token)
+
+    def addCancel(self, ticker, orderId):
+        self.recorder.order(self.elapsed, CANCEL, ticker, orderId, False, 0, None)
+        self.order.addCancel(ticker, orderId)
+
+    def __getattr__(self, name):
+        return getattr(self.order, name)
+
+class Recorder:
+    def __init__(self, path, chunk=CHUNK):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'streams.json'), 'w') as f:
+            json.dump({name: np.dtype(fields).descr for name, fields in STREAMS.items()}, f)
+        self.buffers = {name: np.zeros(chunk, dtype=STREAMS[name]) for name in STREAMS}
+        self.counts = dict.fromkeys(STREAMS, 0)
+        self.symbols = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.files = {name: open(os.path.join(path, name + '.bin'), 'ab') for name in STREAMS}
+        self.symbol_file = open(os.path.join(path, 'symbols.txt'), 'a')
+        self.writer = threading.Thread(target=self.write, name='recorder', daemon=True)
+        self.writer.start()
+        self.closed = False
+        atexit.register(self.close)
+
+    # Index of a string in symbols.txt (-1 for None)
+    def symbol(self, text):
+        if text is None:
+            return -1
+        text = str(text).replace('\n', ' ')
+        i = self.symbols.get(text)
+        if i is None:
+            i = self.symbols[text] = len(self.symbols)
+            self.queue.put(('symbols.txt', text + '\n'))
+        return i
+
+    # Stores one row (a tuple in the stream's field order); full chunks are handed to the writer
+    def append(self, name, row):
+        n = self.counts[name]
+        buf = self.buffers[name]
+        if n == len(buf):
+            self.queue.put((name, buf.tobytes()))
+            n = 0
+        buf[n] = row
+        self.counts[name] = n + 1
+
+    def flush(self):
+        with self.lock:
+            for name, n in self.counts.items():
+                if n:
+                    self.queue.put((name, self.buffers[name][:n].tobytes()))
+                    self.counts[name] = 0
+
+    def write(self):
+        while True:
+            name, data = self.queue.get()
+            if name is None:
+                break
+            f = self.symbol_file if name == 'symbols.txt' else self.files[name]
+            f.write(data)
+            if self.queue.empty():
+                f.flush()
+        for f in list(self.files.values()) + [self.symbol_file]:
+            f.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.queue.put((None, None))
+        self.writer.join()
+
+    def market(self, elapsed, state):
+        bid, bid_size = book_levels(state.get('bids') or {}, True)
+        ask, ask_size = book_levels(state.get('asks') or {}, False)
+        with self.lock:
+            self.append('market', (time.time(), elapsed, self.symbol(state.get('ticker')),
+                                   number(state.get('last_price')), bid, bid_size, ask, ask_size))
+
+    def trade(self, elapsed, trade):
+        with self.lock:
+            self.append('trade', (time.time(), elapsed, self.symbol(trade.get('ticker')), number(trade.get('price')),
+                                  number(trade.get('quantity')), bool(trade.get('buy')),
+                                  self.symbol(trade.get('buy_order_id')), self.symbol(trade.get('sell_order_id'))))
+
+    def news(self, elapsed, news):
+        with self.lock:
+            self.append('news', (time.time(), elapsed, number(news.get('time')), self.symbol(news.get('source')),
+                                 number(news.get('body')), self.symbol(news.get('headline'))))
+
+    def trader(self, elapsed, state):
+        wall = time.time()
+        with self.lock:
+            self.append('trader', (wall, elapsed, total(state.get('cash')), total(state.get('pnl')),
+                                   number(state.get('total_fees')), number(state.get('total_fines')),
+                                   len(state.get('open_orders') or {})))
+            for ticker, quant in (state.get('positions') or {}).items():
+                self.append('position', (wall, elapsed, self.symbol(ticker), number(quant)))
+
+    def order(self, elapsed, event, ticker, order_id, buy, quant, price):
+        with self.lock:
+            self.append('order', (time.time(), elapsed, event, self.symbol(ticker), self.symbol(order_id),
+                                  bool(buy), number(quant), number(price)))
+
+    # Records one incoming message
+    def message(self, msg):
+        elapsed = number(msg.get('elapsed_time'))
+        if 'market_state' in msg:
+            self.market(elapsed, msg['market_state'])
+        for state in (msg.get('market_states') or {}).values():
+            self.market(elapsed, state)
+        for trade in msg.get('trades') or []:
+            self.trade(elapsed, trade)
+        if 'news' in msg:
+            self.news(elapsed, msg['news'])
+        for o in msg.get('orders') or []:
+            event = REJECT if o.get('error') or not o.get('order_id') else ACK
+            self.order(elapsed, event, o.get('ticker'), o.get('order_id'), o.get('buy'), o.get('quantity'), o.get('price'))
+        for order_id, error in (msg.get('cancels') or {}).items():
+            self.order(elapsed, CANCEL_ACK if error is None else REJECT, None, order_id, False, 0, None)
+        if 'trader_state' in msg:
+            self.trader(elapsed, msg['trader_state'])
+            # trader updates come once a second: a natural point to push rows to disk
+            self.flush()
+        if 'case_meta' in msg:
+            with open(os.path.join(self.path, 'case_meta.json'), 'w') as f:
+                json.dump(msg['case_meta'], f)
+
+    def recorded_callback(self, callback):
+        def wrapped(msg, order):
+            try:
+                self.message(msg)
+            except Exception as e:
+                print("recorder: %r" % e, file=sys.stderr)
+            return callback(msg, RecordedOrder(order, self, number(msg.get('elapsed_time'))))
+        return wrapped
+
+    # Wraps every callback currently registered on t
+    def wrap(self, t):
+        for name in ('onAckRegister', 'onMarketUpdate', 'onTraderUpdate', 'onTrade',
+                     'onAckModifyOrders', 'onNews'):
+            callback = getattr(t, name, None)
+            if callable(callback) and getattr(callback, '__self__', None) is not t:
+                setattr(t, name, self.recorded_callback(callback))
+        return t
+
+# New session directory under root
+def session_path(root, name=None):
+    name = name or time.strftime('session_%Y%m%d_%H%M%S')
+    path = os.path.join(root, name)
+    i = 1
+    while os.path.exists(path):
+        i += 1
+        path = os.path.join(root, '%s_%d' % (name, i))
+    return path
+
+def stream_dtype(descr):
+    return np.dtype([tuple(tuple(x) if isinstance(x, list) else x for x in field) for field in descr])
+
+# Maps a recorded session: ({stream: structured array}, symbols)
+def load(path):
+    with open(os.path.join(path, 'streams.json')) as f:
+        descrs = json.load(f)
+    streams = {}
+    for name, descr in descrs.items():
+        dtype = stream_dtype(descr)
+        file = os.path.join(path, name + '.bin')
+        rows = os.path.getsize(file) // dtype.itemsize if os.path.exists(file) else 0
+        if rows:
+            streams[name] = np.memmap(file, dtype=dtype, mode='r', shape=(rows,))
+        else:
+            streams[name] = np.zeros(0, dtype=dtype)
+    with open(os.path.join(path, 'symbols.txt')) as f:
+        symbols = f.read().split('\n')[:-1]
+    return streams, symbols
+
+# Maps every session recorded under root, in name order
+def load_all(root):
+    return {name: load(os.path.join(root, name)) for name in sorted(os.listdir(root))
+            if os.path.exists(os.path.join(root, name, 'streams.json'))}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python recorder.py <session dir>")
+        sys.exit(1)
+    streams, symbols = load(sys.argv[1])
+    for name, rows in streams.items():
+        print("%-10s %8d rows" % (name, len(rows)))
@@ -0,0 +1,83 @@
+import numpy as np
+from bs_chain import chain_greeks
+
+# Portfolio risk for the option chain plus its future.
+# Positions live in an array aligned with the chain, so revaluing every
+# position's Greeks when spot, vol or time to expiry move is one chain_greeks
+# call and three dot products. Between revaluations, fills adjust the totals
+# incrementally with the last per-unit Greeks.
+class RiskEngine:
+    def __init__(self, tickers, calls, strikes, future='TMXFUT', vega_scale=1.):
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.calls = np.asarray(calls, dtype=bool)
+        self.strikes = np.asarray(strikes, dtype=float)
+        self.future = future
+        self.vega_scale = vega_scale
+
+        n = len(self.tickers)
+        self.quant = np.zeros(n)
+        self.future_quant = 0
+        self.price = np.zeros(n)
+        self.unit_delta = np.zeros(n)
+        self.unit_gamma = np.zeros(n)
+        self.unit_vega = np.zeros(n)
+        self.delta = self.gamma = self.vega = 0.
+
+    # Reprices every option at the current spot, expiry and vols and recomputes the totals
+    def revalue(self, S, T, r, ivs):
+        self.set_greeks(*chain_greeks(self.calls, S, self.strikes, T, r, ivs))
+
+    # Takes per-unit price, delta, gamma and vega computed elsewhere (e.g. memoized) and recomputes the totals
+    def set_greeks(self, price, delta, gamma, vega):
+        self.price, self.unit_delta, self.unit_gamma = price, delta, gamma
+        self.unit_vega = vega * self.vega_scale
+        self.totals()
+
+    def totals(self):
+        self.delta = self.quant @ self.unit_delta + self.future_quant
+        self.gamma = self.quant @ self.unit_gamma
+        self.vega = self.quant @ self.unit_vega
+
+    # Replaces the positions (e.g. with the server's) and recomputes the totals
+    def set_positions(self, positions):
+        self.quant[:] = 0
+        for ticker, quant in positions.items():
+            i = self.index.get(ticker)
+            if i is not None:
+                self.quant[i] = quant
+        self.future_quant = positions.get(self.future, 0)
+        self.totals()
+
+    # Books a fill (signed quantity) into the position and the totals
+    def on_fill(self, ticker, quant):
+        if ticker == self.future:
+            self.future_quant += quant
+            self.delta += quant
+            return
+        i = self.index.get(ticker)
+        if i is None:
+            return
+        self.quant[i] += quant
+        self.delta += quant * self.unit_delta[i]
+        self.gamma += quant * self.unit_gamma[i]
+        self.vega += quant * self.unit_vega[i]
+
+    # Delta and vega totals if a further (signed) quantity of ticker were added
+    def after(self, ticker, quant):
+        if ticker == self.future:
+            return self.delta + quant, self.vega
+        i = self.index[ticker]
+        return self.delta + quant * self.unit_delta[i], self.vega + quant * self.unit_vega[i]
+
+    # Futures quantity (signed) that brings delta back to target once it leaves the band.
+    # pending is the futures quantity already working; the result keeps the futures
+    # position within limit and each order within max_order.
+    def hedge_quantity(self, band, limit, max_order, pending=0, target=0.):
+        delta = self.delta + pending
+        if abs(delta - target) <= band:
+            return 0
+        quant = int(round(target - delta))
+        position = self.future_quant + pending
+        quant = max(min(quant, limit - position), -limit - position)
+        return max(min(quant, max_order), -max_order)
@@ -0,0 +1,74 @@
+import math
+from collections import deque
+
+# Streaming rolling window with Bollinger bands.
+# Each update adds one value (and drops the oldest once the window is full)
+# and adjusts the running mean and sum of squared deviations in place, so the
+# cost per price is constant however long the session runs. The std matches
+# pandas' rolling().std() (sample std, nan until there are two values). The
+# running sums are kept on the values less a reference value, which is moved
+# to the price (and the sums reset) whenever the whole window holds that one
+# price, so rounding left over from earlier prices cannot creep in while
+# prices sit still: a flat window has exactly its price as mean and exactly
+# zero std, and a price equal to it is never outside the bands.
+class RollingBands:
+    def __init__(self, window, width=2):
+        self.window = window
+        self.width = width
+        self.values = deque()
+        self.shift = None
+        self.shifted_mean = 0.
+        # how many of the latest values equal the latest one
+        self.run = 0
+        self.mean = math.nan
+        self.m2 = 0.
+        self.std = math.nan
+        self.upper = math.nan
+        self.lower = math.nan
+        self.prev_mean = math.nan
+        self.prev_std = math.nan
+        self.prev_upper = math.nan
+        self.prev_lower = math.nan
+
+    def __len__(self):
+        return len(self.values)
+
+    # Adds a new value and returns the updated bands
+    def update(self, x):
+        self.prev_mean, self.prev_std = self.mean, self.std
+        self.prev_upper, self.prev_lower = self.upper, self.lower
+
+        values = self.values
+        if self.shift is None:
+            self.shift = x
+        d = x - self.shift
+        if not values:
+            self.shifted_mean, self.m2 = d, 0.
+        elif len(values) < self.window:
+            old_mean = self.shifted_mean
+            self.shifted_mean += (d - old_mean) / (len(values) + 1)
+            self.m2 += (d - old_mean) * (d - self.shifted_mean)
+        else:
+            e = values.popleft() - self.shift
+            old_mean = self.shifted_mean
+            self.shifted_mean += (d - e) / self.window
+            self.m2 += (d - e) * (d - self.shifted_mean + e - old_mean)
+        self.run = self.run + 1 if values and values[-1] == x else 1
+        values.append(x)
+        if self.run >= len(values):
+            self.shift, self.shifted_mean, self.m2 = x, 0., 0.
+        self.mean = self.shift + self.shifted_mean
+
+        n = len(values)
+        self.std = math.sqrt(max(self.m2, 0.) / (n - 1)) if n > 1 else math.nan
+        self.upper = self.mean + self.std * self.width
+        self.lower = self.mean - self.std * self.width
+        return self
+
+    # Checkpoints taken before the shift was kept restore shifted by their mean
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'shift' not in state:
+            self.shift = self.mean if self.values else None
+            self.shifted_mean = 0.
+            self.run = 0
@@ -0,0 +1,586 @@
+import math
+import time
+import traceback
+from collections import Counter
+import numpy as np
+from history import RingBuffer
+from order_book import OrderBook
+from order_manager import OrderManager, acked_as
+from session_clock import SessionClock
+from implied_vol import implied_vol_chain
+import latency
+
+# Runs any number of strategies on one connection and one shared market state.
+# The runtime owns the TradersBot callbacks. Each message is decoded once into
+# a MarketState (books, last prices, price histories, and the option chain's
+# IVs, re-solved lazily and only for options whose price or spot changed),
+# then handed to every strategy through the hooks of Strategy below. A
+# strategy never sends orders itself. It states intents (buy / sell / cancel)
+# that are checked against its own budget: a position limit per ticker and a
+# gross limit. At the end of the callback the runtime nets the intents of all
+# strategies into one batch:
+# - buys and sells on the same ticker whose prices cross are matched
+#   internally at the midpoint, without going to the exchange;
+# - what is left is merged into one order per ticker, side and price (split
+#   at the case's maximum order size) and checked against the case limits by
+#   the shared OrderManager.
+# Every order remembers each strategy's share of it, so fills are booked back
+# to the strategies pro rata. Orders carry a token of their own and stay
+# 'sent' until the ack with that token says what became of them. Each
+# strategy has its own positions and can only cancel its own share; once the
+# exchange confirms the cancel, the other shares go out again as new intents.
+#
+# The CPU time (thread time) of every hook call is measured per strategy.
+# Each strategy earns `cpu` CPU seconds per case second, up to a burst of
+# BURST_SECONDS worth, and spends what its hooks use. A hook is skipped when
+# the strategy's credit is less than what that hook has been costing it
+# (a moving average), so a strategy that is too slow only throttles itself.
+# The runtime keeps its market state and positions up to date in the
+# meantime, and the strategy resumes with a current view. This is a limit
+# on the average, not a deadline: a hook that has started is never
+# interrupted (stopping it halfway could leave its intents and the shared
+# state half updated), so a call that runs far longer than its average is
+# only paid for afterwards, out of the strategy's later calls.
+
+HISTORY_LEN = 1024
+UNDERLYING = 'TMXFUT'
+SPOT = 100
+BURST_SECONDS = 5
+# Weight of the latest call in a hook's moving average cost
+COST_WEIGHT = 0.1
+# Netting passes per callback: internal crosses are reported to the strategies at once, and what
+# they order in response is netted in a second pass (anything later waits for the next callback)
+FLUSH_PASSES = 2
+# Case seconds a sent order may go unacknowledged (the backtest drops rejected orders without an ack)
+ACK_TIMEOUT = 2
+
+# Options are named T<strike>C / T<strike>P
+def option_ticker(ticker):
+    return len(ticker) > 2 and ticker[-1] in 'CP' and ticker[1:-1].isdigit()
+
+# Shared, incrementally updated view of the market for every strategy
+class MarketState:
+    def __init__(self, history=HISTORY_LEN, rate=0.):
+        self.history = history
+        self.rate = rate
+        self.clock = SessionClock(rate=rate)
+        self.meta = {}
+        self.price = {}
+        self.prices = {}
+        self.books = {}
+        self.news = []
+        self.chain = {'tickers': [], 'calls': np.zeros(0, dtype=bool), 'strikes': np.zeros(0), 'index': {}}
+        self.iv = np.zeros(0)
+        self.iv_history = {}
+        self.stale = set()
+        self.repriced = set()
+        # bumped on every book or price change; ivs() is cached against it
+        self.version = 0
+        self.iv_version = None
+        self.iv_spot = None
+
+    def register(self, msg):
+        self.meta = msg['case_meta']
+        self.clock = SessionClock(self.meta.get('case_length', 450), rate=self.rate)
+        self.clock.observe(msg)
+        states = msg.get('market_states', {})
+        tickers = []
+        for ticker, sec in self.meta['securities'].items():
+            if not sec['tradeable']:
+                continue
+            self.price[ticker] = sec['starting_price']
+            self.prices[ticker] = RingBuffer(self.history)
+            self.books[ticker] = OrderBook(ticker)
+            if ticker in states:
+                self.books[ticker].update(states[ticker]['bids'], states[ticker]['asks'])
+            if option_ticker(ticker):
+                tickers.append(ticker)
+        self.chain = {'tickers': tickers, 'calls': np.array([t[-1] == 'C' for t in tickers], dtype=bool),
+                      'strikes': np.array([int(t[1:-1]) for t in tickers], dtype=float),
+                      'index': {t: i for i, t in enumerate(tickers)}}
+        self.iv = np.full(len(tickers), np.nan)
+        self.iv_history = {t: RingBuffer(self.history) for t in tickers}
+        self.stale = set(tickers)
+        self.version += 1
+        self.iv_spot = None
+
+    def on_market_update(self, msg):
+        state = msg['market_state']
+        self.books[state['ticker']].update(state['bids'], state['asks'])
+        self.version += 1
+        self.set_price(state['ticker'], state['last_price'])
+
+    def on_trade(self, msg):
+        for trade in msg.get('trades', []):
+            if trade['ticker'] in self.price:
+                self.set_price(trade['ticker'], trade['price'])
+
+    def set_price(self, ticker, price):
+        self.version += 1
+        self.price[ticker] = price
+        self.prices[ticker].append(price, self.clock.elapsed)
+        if ticker in self.chain['index']:
+            self.stale.add(ticker)
+            self.repriced.add(ticker)
+
+    # The underlying's last price (SPOT until the future is known)
+    def spot(self):
+        return self.price.get(UNDERLYING, SPOT)
+
+    def intrinsic(self, ticker):
+        strike = self.chain['strikes'][self.chain['index'][ticker]]
+        return max(self.spot() - strike, 0) if ticker[-1] == 'C' else max(strike - self.spot(), 0)
+
+    # Current IV of every option in the chain (nan where none could be solved), cached until the books
+    # change. Solved on demand, in one batch for the options whose price changed, or for all of them
+    # once spot moved; time passing alone re-solves nothing (an option's IV is as of the last change
+    # to its price or to spot). Options that traded since the last solve get their IV appended to
+    # iv_history
+    def ivs(self):
+        if self.version == self.iv_version:
+            return self.iv
+        self.iv_version = self.version
+        if self.spot() != self.iv_spot:
+            self.iv_spot = self.spot()
+            self.stale.update(self.chain['tickers'])
+        if self.stale:
+            tickers = list(self.stale)
+            idx = [self.chain['index'][t] for t in tickers]
+            prices = np.array([self.price[t] for t in tickers], dtype=float)
+            sig, reasons = implied_vol_chain(prices, self.chain['calls'][idx], self.spot(), self.chain['strikes'][idx],
+                                             self.clock.T, self.rate, self.iv[idx])
+            for i, ticker in enumerate(tickers):
+                if reasons[i] is not None:
+                    continue
+                self.iv[idx[i]] = sig[i]
+                if ticker in self.repriced:
+                    self.iv_history[ticker].append(sig[i], self.clock.elapsed)
+            self.stale.clear()
+            self.repriced.clear()
+        return self.iv
+
+    def iv_of(self, ticker):
+        return self.ivs()[self.chain['index'][ticker]]
+
+# A strategy run by the Runtime. Subclasses override the hooks they need; each gets the shared
+# MarketState. Budget: `limit` on |position| per ticker (`limits` for some tickers), `max_gross`
+# on the sum of |position| plus working quantity, and `cpu` CPU seconds per case second (None
+# for the runtime's default)
+class Strategy:
+    def __init__(self, name, limit=math.inf, limits=None, max_gross=math.inf, cpu=None):
+        self.name = name
+        self.limit = limit
+        self.limits = dict(limits or {})
+        self.max_gross = max_gross
+        self.cpu_budget = cpu
+        self.runtime = None
+        self.positions = Counter()
+        self.rejected = Counter()
+        self.cpu = 0.
+        self.calls = 0
+        self.skipped = 0
+        self.errors = 0
+        self.credit = 0.
+        # hook -> moving average CPU seconds of a call
+        self.costs = {}
+
+    def on_register(self, market):
+        pass
+
+    def on_market_update(self, market, ticker):
+        pass
+
+    # Fills of this strategy's own orders (and internal crosses), as (ticker, signed quantity, price)
+    def on_trade(self, market, fills):
+        pass
+
+    def on_trader_update(self, market):
+        pass
+
+    def on_news(self, market, news):
+        pass
+
+    def buy(self, ticker, quant, price=None):
+        return self.runtime.intend(self, ticker, True, quant, price)
+
+    def sell(self, ticker, quant, price=None):
+        return self.runtime.intend(self, ticker, False, quant, price)
+
+    # Cancels this strategy's share of its open orders (on one ticker, or those matching predicate)
+    def cancel(self, ticker=None, predicate=None):
+        self.runtime.withdraw(self, ticker, predicate)
+
+    def position(self, ticker):
+        return self.positions[ticker]
+
+    # Quantity this strategy has working on one side of a ticker
+    def working(self, ticker, buy):
+        return self.runtime.working(self, ticker, buy)
+
+    # This strategy's share of the open orders, as order dicts
+    def orders(self, ticker=None):
+        return self.runtime.orders_of(self, ticker)
+
+class Runtime:
+    # cpu is the default CPU seconds per case second each strategy may use
+    def __init__(self, strategies, cpu=0.1, history=HISTORY_LEN, rate=0.):
+        self.market = MarketState(history, rate)
+        self.orders = OrderManager()
+        self.strategies = list(strategies)
+        self.cpu = cpu
+        self.intents = []
+        self.sent = []
+        self.tokens = 0
+        self.owners = {}
+        self.crossed = 0
+        self.netted = 0
+        self.refilled = None
+        # (strategy, ticker, buy) -> quantity working: queued, sent or open and not withdrawn
+        self.working_quant = Counter()
+        self.working_total = Counter()
+        for strategy in self.strategies:
+            strategy.runtime = self
+            strategy.cpu_budget = cpu if strategy.cpu_budget is None else strategy.cpu_budget
+            strategy.credit = strategy.cpu_budget * BURST_SECONDS
+
+    # Hooks the callbacks up to a TradersBot (or the backtester's stand-in)
+    def attach(self, t):
+        t.onAckRegister = self.on_register
+        t.onMarketUpdate = self.on_market_update
+        t.onTraderUpdate = self.on_trader_update
+        t.onTrade = self.on_trade
+        t.onAckModifyOrders = self.on_ack
+        t.onNews = self.on_news
+
+    def on_register(self, msg, order):
+        self.market.register(msg)
+        self.orders.configure(msg['case_meta'])
+        if 'trader_state' in msg:
+            self.orders.on_trader_update(msg)
+        self.refilled = self.market.clock.elapsed
+        for strategy in self.strategies:
+            self.call(strategy, 'on_register')
+        self.flush(order)
+
+    def on_market_update(self, msg, order):
+        self.advance(msg)
+        self.market.on_market_update(msg)
+        ticker = msg['market_state']['ticker']
+        for strategy in self.strategies:
+            self.call(strategy, 'on_market_update', ticker)
+        self.flush(order)
+
+    def on_trade(self, msg, order):
+        self.advance(msg)
+        self.market.on_trade(msg)
+        fills = {}
+        for trade in msg.get('trades', []):
+            for key, sign in (('buy_order_id', 1), ('sell_order_id', -1)):
+                order_id = trade.get(key)
+                entry = self.owners.get(order_id)
+                if entry is None:
+                    continue
+                for strategy, quant in allocate(entry['shares'], trade['quantity']).items():
+                    if strategy not in entry.get('withdrawn', ()):
+                        self.count_working(strategy, entry['ticker'], entry['buy'], -quant)
+                    strategy.positions[entry['ticker']] += sign * quant
+                    fills.setdefault(strategy, []).append((entry['ticker'], sign * quant, trade['price']))
+                if not entry['shares']:
+                    del self.owners[order_id]
+        self.orders.on_trade(msg)
+        for strategy, strategy_fills in fills.items():
+            self.call(strategy, 'on_trade', strategy_fills)
+        self.flush(order)
+
+    def on_trader_update(self, msg, order):
+        self.advance(msg)
+        self.orders.on_trader_update(msg)
+        # orders the server no longer has open were filled (booked on TRADE) or cancelled; those with a
+        # cancel in flight wait for its ack, unless that is overdue
+        now = self.market.clock.elapsed
+        for order_id, entry in list(self.owners.items()):
+            if order_id in self.orders.open:
+                continue
+            if 'withdrawn' not in entry:
+                self.count_shares(self.owners.pop(order_id), -1)
+            elif now - entry['withdrawn_at'] > ACK_TIMEOUT:
+                self.cancelled(order_id)
+        for sent in self.sent:
+            if now - sent['time'] > ACK_TIMEOUT:
+                self.count_shares(sent, -1)
+        self.sent = [sent for sent in self.sent if now - sent['time'] <= ACK_TIMEOUT]
+        for strategy in self.strategies:
+            self.call(strategy, 'on_trader_update')
+        self.flush(order)
+
+    def on_ack(self, msg, order):
+        self.advance(msg)
+        for o in msg.get('orders', []):
+            for i, sent in enumerate(self.sent):
+                if acked_as(sent, o):
+                    del self.sent[i]
+                    if o.get('order_id') and not o.get('error'):
+                        self.owners[o['order_id']] = sent
+                    else:
+                        self.count_shares(sent, -1)
+                    break
+        self.orders.on_ack(msg)
+        for order_id, error in (msg.get('cancels') or {}).items():
+            entry = self.owners.get(order_id)
+            if entry is None:
+                continue
+            if error is None:
+                self.cancelled(order_id)
+            elif 'withdrawn' in entry:
+                # already filled or gone: an ordinary order again until TRADER UPDATE drops it
+                withdrawn = entry.pop('withdrawn')
+                del entry['withdrawn_at']
+                for strategy in withdrawn:
+                    self.count_working(strategy, entry['ticker'], entry['buy'], entry['shares'].get(strategy, 0))
+        self.flush(order)
+
+    def on_news(self, msg, order):
+        self.advance(msg)
+        self.market.news.append(msg['news'])
+        for strategy in self.strategies:
+            self.call(strategy, 'on_news', msg['news'])
+        self.flush(order)
+
+    # Moves the clock and pays every strategy its CPU allowance for the case time that passed
+    def advance(self, msg):
+        self.market.clock.observe(msg)
+        now = self.market.clock.elapsed
+        if self.refilled is None or now <= self.refilled:
+            return
+        for strategy in self.strategies:
+            strategy.credit = min(strategy.credit + (now - self.refilled) * strategy.cpu_budget,
+                                  strategy.cpu_budget * BURST_SECONDS)
+        self.refilled = now
+
+    # Runs one hook of a strategy unless its CPU credit does not cover what the hook usually costs
+    # (a hook costing more than the whole burst still runs on a full burst, so its cost is measured
+    # again); exceptions stay with the strategy
+    def call(self, strategy, hook, *args):
+        cost = strategy.costs.get(hook, 0.)
+        if strategy.credit < min(cost, strategy.cpu_budget * BURST_SECONDS):
+            strategy.skipped += 1
+            latency.count('skipped ' + strategy.name)
+            return
+        start = time.thread_time()
+        try:
+            getattr(strategy, hook)(self.market, *args)
+        except Exception:
+            strategy.errors += 1
+            traceback.print_exc()
+        used = time.thread_time() - start
+        strategy.cpu += used
+        strategy.calls += 1
+        strategy.credit -= used
+        strategy.costs[hook] = cost + COST_WEIGHT * (used - cost) if hook in strategy.costs else used
+        latency.record('strategy ' + strategy.name, used * 1e6)
+
+    # Queues a strategy's order if it fits the strategy's budget; returns False (and counts why) if not
+    def intend(self, strategy, ticker, buy, quant, price):
+        reason = self.check(strategy, ticker, buy, quant)
+        if reason is not None:
+            strategy.rejected[reason] += 1
+            return False
+        self.intents.append([strategy, ticker, buy, quant, price])
+        self.count_working(strategy, ticker, buy, quant)
+        return True
+
+    def check(self, strategy, ticker, buy, quant):
+        if quant <= 0:
+            return 'non-positive quantity'
+        if ticker not in self.market.price:
+            return 'unknown ticker'
+        position = strategy.positions[ticker]
+        if buy:
+            after = position + self.working(strategy, ticker, True) + quant
+        else:
+            after = position - self.working(strategy, ticker, False) - quant
+        if abs(after) > strategy.limits.get(ticker, strategy.limit) and abs(after) > abs(position):
+            return 'position limit'
+        gross = sum(abs(p) for p in strategy.positions.values()) + self.working(strategy)
+        if gross + quant > strategy.max_gross and abs(position + (quant if buy else -quant)) > abs(position):
+            return 'gross limit'
+        return None
+
+    # Quantity a strategy has working (open, sent or queued), on one ticker and side or in total. Kept
+    # as running totals, updated wherever an intent, sent order or open order changes hands, so a
+    # budget check never scans the orders
+    def working(self, strategy, ticker=None, buy=None):
+        if ticker is None:
+            return self.working_total[strategy]
+        if buy is None:
+            return self.working_quant[(strategy, ticker, True)] + self.working_quant[(strategy, ticker, False)]
+        return self.working_quant[(strategy, ticker, buy)]
+
+    def count_working(self, strategy, ticker, buy, quant):
+        self.working_quant[(strategy, ticker, buy)] += quant
+        self.working_total[strategy] += quant
+
+    # Counts (sign 1) or uncounts (-1) the shares of a sent or open order, less those withdrawn
+    def count_shares(self, entry, sign):
+        for strategy, quant in entry['shares'].items():
+            if strategy not in entry.get('withdrawn', ()):
+                self.count_working(strategy, entry['ticker'], entry['buy'], sign * quant)
+
+    # Rebuilds the working totals from the intents and orders themselves
+    def recount(self):
+        self.working_quant = Counter()
+        self.working_total = Counter()
+        for entry in list(self.owners.values()) + self.sent:
+            self.count_shares(entry, 1)
+        for strategy, ticker, buy, quant, _ in self.intents:
+            self.count_working(strategy, ticker, buy, quant)
+
+    def orders_of(self, strategy, ticker=None):
+        return [{'order_id': order_id, 'ticker': entry['ticker'], 'buy': entry['buy'],
+                 'quantity': entry['shares'][strategy], 'price': entry['price']}
+                for order_id, entry in self.owners.items()
+                if strategy in entry['shares'] and strategy not in entry.get('withdrawn', ())
+                and (ticker is None or entry['ticker'] == ticker)]
+
+    # Cancels a strategy's queued intents and its share of open orders (on one ticker, or matching
+    # predicate). An order shared with other strategies is cancelled as a whole; on_ack queues their
+    # shares again once the cancel is confirmed
+    def withdraw(self, strategy, ticker=None, predicate=None):
+        if predicate is None:
+            kept = []
+            for i in self.intents:
+                if i[0] is strategy and (ticker is None or i[1] == ticker):
+                    self.count_working(i[0], i[1], i[2], -i[3])
+                else:
+                    kept.append(i)
+            self.intents = kept
+        for o in self.orders_of(strategy, ticker):
+            if predicate is not None and not predicate(o):
+                continue
+            if o['order_id'] not in self.orders.open:
+                continue
+            entry = self.owners[o['order_id']]
+            self.count_working(strategy, entry['ticker'], entry['buy'], -entry['shares'][strategy])
+            entry.setdefault('withdrawn', set()).add(strategy)
+            entry.setdefault('withdrawn_at', self.market.clock.elapsed)
+            self.orders.cancel(o['order_id'])
+
+    # A cancelled order's remaining shares of the strategies that did not withdraw go out again
+    def cancelled(self, order_id):
+        entry = self.owners.pop(order_id)
+        self.count_shares(entry, -1)
+        for other, quant in entry['shares'].items():
+            if other not in entry.get('withdrawn', ()) and quant > 0:
+                self.intend(other, entry['ticker'], entry['buy'], quant, entry['price'])
+
+    # Nets this callback's intents into one batch on the TradersOrder
+    def flush(self, order):
+        for _ in range(FLUSH_PASSES):
+            if not self.intents:
+                break
+            intents, self.intents = self.intents, []
+            by_ticker = {}
+            for intent in intents:
+                by_ticker.setdefault(intent[1], []).append(intent)
+            fills = {}
+            for ticker, group in by_ticker.items():
+                self.cross(ticker, group, fills)
+                self.merge(ticker, group)
+            for strategy, strategy_fills in fills.items():
+                self.call(strategy, 'on_trade', strategy_fills)
+        self.orders.flush(order)
+
+    # Matches buys against sells on one ticker whose prices cross (orders without a price cross
+    # anything) between the strategies themselves, at the midpoint
+    def cross(self, ticker, group, fills):
+        buys = sorted((i for i in group if i[2]), key=lambda i: -math.inf if i[4] is None else -i[4])
+        sells = sorted((i for i in group if not i[2]), key=lambda i: -math.inf if i[4] is None else i[4])
+        while buys and sells:
+            buy, sell = buys[0], sells[0]
+            if buy[4] is not None and sell[4] is not None and buy[4] < sell[4]:
+                break
+            if buy[4] is not None and sell[4] is not None:
+                price = (buy[4] + sell[4]) / 2
+            else:
+                price = next((p for p in (buy[4], sell[4]) if p is not None), self.market.price[ticker])
+            quant = min(buy[3], sell[3])
+            buy[3] -= quant
+            sell[3] -= quant
+            self.count_working(buy[0], ticker, True, -quant)
+            self.count_working(sell[0], ticker, False, -quant)
+            buy[0].positions[ticker] += quant
+            sell[0].positions[ticker] -= quant
+            fills.setdefault(buy[0], []).append((ticker, quant, price))
+            fills.setdefault(sell[0], []).append((ticker, -quant, price))
+            self.crossed += quant
+            if buy[3] == 0:
+                buys.pop(0)
+            if sell[3] == 0:
+                sells.pop(0)
+
+    # Merges what is left on one ticker into one order per side and price, each at most the case's
+    # maximum order size, and queues them with the OrderManager
+    def merge(self, ticker, group):
+        merged = {}
+        for strategy, _, buy, quant, price in group:
+            if quant > 0:
+                shares = merged.setdefault((buy, price), {})
+                shares[strategy] = shares.get(strategy, 0) + quant
+        max_size = self.orders.max_size.get(ticker, math.inf)
+        for (buy, price), shares in merged.items():
+            self.netted += len(shares) - 1
+            for part in split(shares, max_size):
+                quant = sum(part.values())
+                self.tokens += 1
+                token = 'rt:%d' % self.tokens
+                if self.orders.add(ticker, buy, quant, price, token):
+                    self.sent.append({'ticker': ticker, 'buy': buy, 'quantity': quant, 'price': price, 'shares': part,
+                                      'token': token, 'time': self.market.clock.elapsed})
+                else:
+                    for strategy, share in part.items():
+                        strategy.rejected['case limits'] += 1
+                        self.count_working(strategy, ticker, buy, -share)
+
+    # Per-strategy CPU use, throttling, errors, rejections and positions
+    def report(self):
+        return {strategy.name: {'cpu_s': strategy.cpu, 'calls': strategy.calls,
+                                'mean_us': strategy.cpu / strategy.calls * 1e6 if strategy.calls else math.nan,
+                                'skipped': strategy.skipped, 'errors': strategy.errors,
+                                'rejected': dict(strategy.rejected),
+                                'positions': {t: q for t, q in strategy.positions.items() if q}}
+                for strategy in self.strategies}
+
+# Takes quant off the shares of an order pro rata (largest remainders first) and returns each
+# strategy's part
+def allocate(shares, quant):
+    total = sum(shares.values())
+    if quant >= total:
+        parts = dict(shares)
+    else:
+        exact = {strategy: quant * q / total for strategy, q in shares.items()}
+        parts = {strategy: int(x) for strategy, x in exact.items()}
+        left = quant - sum(parts.values())
+        for strategy in sorted(exact, key=lambda s: exact[s] - parts[s], reverse=True)[:left]:
+            parts[strategy] += 1
+    for strategy, q in parts.items():
+        shares[strategy] -= q
+        if shares[strategy] <= 0:
+            del shares[strategy]
+    return {strategy: q for strategy, q in parts.items() if q}
+
+# Splits {strategy: quantity} into orders of at most max_size, in order
+def split(shares, max_size):
+    parts = []
+    part, room = {}, max_size
+    for strategy, quant in shares.items():
+        while quant > 0:
+            take = min(quant, room)
+            part[strategy] = part.get(strategy, 0) + take
+            quant -= take
+            room -= take
+            if room <= 0:
+                parts.append(part)
+                part, room = {}, max_size
+    if part:
+        parts.append(part)
+    return parts
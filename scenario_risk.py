@@ -0,0 +1,191 @@
+import time
+import math
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from bs_chain import chain_greeks
+
+# Monte Carlo scenario risk for the option book, checked against the case's loss limit.
+# Each refresh simulates joint spot / vol paths over the time left to expiry.
+# Spot follows a GBM at the at-the-money vol. Every option's vol is scaled by
+# exp(v), where v is a random walk with volatility vol_of_vol, correlated
+# `corr` with spot returns, so the smile keeps its shape and moves as a
+# whole. Along each path the positions held are fully repriced at every step
+# (chain_greeks on paths x options arrays). That gives the worst PnL each path
+# reaches, and so the probability of hitting the loss limit. At the horizon
+# every instrument is repriced, which gives each one's PnL per unit in every
+# scenario. VaR and expected shortfall of the book come from those, and so
+# does the marginal tail risk of any order (size()).
+#
+# The paths are split into `chunks` jobs with their own seeds and run on a
+# process pool. The pool's workers are spawned, not forked, so they do not
+# inherit the bot's IOLoop and threads. A refresh that takes longer than
+# `budget` seconds is cut short and keeps the chunks that finished. With
+# workers=0 the chunks run in the calling thread instead, spread over the
+# calls of one period: each refresh() runs chunks until budget / period
+# seconds have passed. Either way the path count adapts so refreshes fit the
+# budget.
+
+# Runs one chunk of scenarios. Returns the PnL per unit of every option and the future at the
+# horizon (paths x options + 1) and the worst PnL of the given positions along each path
+def simulate(seed, paths, steps, calls, strikes, ivs, quant, future_quant, S, T, r, spot_vol, vol_of_vol, corr):
+    rng = np.random.default_rng(seed)
+    dt = T / steps
+    z = rng.standard_normal((2, steps, paths))
+    spot_shock = z[0]
+    vol_shock = corr * z[0] + math.sqrt(1 - corr * corr) * z[1]
+    log_s = np.cumsum((r - spot_vol ** 2 / 2) * dt + spot_vol * math.sqrt(dt) * spot_shock, axis=0)
+    spots = S * np.exp(log_s)
+    factors = np.exp(np.cumsum(-vol_of_vol ** 2 / 2 * dt + vol_of_vol * math.sqrt(dt) * vol_shock, axis=0))
+
+    now = chain_greeks(calls, S, strikes, T, r, ivs)[0]
+    held = np.flatnonzero(quant)
+    worst = np.zeros(paths)
+    for k in range(steps - 1):
+        pnl = future_quant * (spots[k] - S)
+        if held.size:
+            price = chain_greeks(calls[held], spots[k][:, None], strikes[held], T - (k + 1) * dt, r,
+                                 ivs[held] * factors[k][:, None])[0]
+            pnl = pnl + (price - now[held]) @ quant[held]
+        np.minimum(worst, pnl, out=worst)
+
+    # at the horizon every instrument is repriced (at expiry that is its intrinsic value)
+    end = spots[-1][:, None]
+    price = chain_greeks(calls, end, strikes, T - steps * dt, r, ivs * factors[-1][:, None])[0]
+    unit_pnl = np.hstack([price - now, end - S])
+    np.minimum(worst, unit_pnl @ np.append(quant, future_quant), out=worst)
+    return unit_pnl, worst
+
+# Expected shortfall (mean loss in the worst 1 - alpha of scenarios) of each column of pnl
+def expected_shortfall(pnl, alpha):
+    k = max(int(math.ceil((1 - alpha) * pnl.shape[0])), 1)
+    return -np.partition(pnl, k - 1, axis=0)[:k].mean(axis=0)
+
+class ScenarioRisk:
+    def __init__(self, loss_limit=-np.inf, paths=4000, steps=20, budget=0.5, period=5, workers=None,
+                 chunks=8, alpha=0.95, vol_of_vol=1., corr=-0.5, seed=0):
+        self.loss_limit = loss_limit
+        self.paths = paths
+        self.max_paths = 4 * paths
+        self.min_paths = chunks * 64
+        self.steps = steps
+        self.budget = budget
+        self.period = period
+        self.chunks = chunks
+        self.alpha = alpha
+        self.vol_of_vol = vol_of_vol
+        self.corr = corr
+        self.seed = seed
+        self.pool = None
+        if workers != 0:
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        # wall time each in-process refresh() may spend on chunks
+        self.slice = budget / period if period > 0 else budget
+        self.chunk_seconds = 0.
+        self.jobs = []
+        self.args = None
+        self.results = []
+        self.spent = 0.
+        self.started = None
+        self.last = None
+        self.refreshes = 0
+        self.inputs = None
+
+        self.unit_pnl = None
+        self.pnl = None
+        self.var = self.es = self.p_limit = math.nan
+        self.seconds = math.nan
+
+    # Starts a refresh at session time `now` unless one is running or the last one started less
+    # than `period` session seconds ago. pnl is the session's PnL so far (for the loss limit).
+    # In-process, also runs the next chunks of the refresh under way
+    def refresh(self, now, calls, strikes, ivs, quant, future_quant, S, T, r, spot_vol, pnl):
+        self.collect()
+        if self.jobs or (self.last is not None and now - self.last < self.period) or T <= 0:
+            return False
+        ivs = np.asarray(ivs, dtype=float)
+        fill = np.nanmedian(ivs) if np.isfinite(ivs).any() else spot_vol
+        ivs = np.where(np.isfinite(ivs), ivs, fill)
+        quant = np.asarray(quant, dtype=float)
+        args = (np.asarray(calls, dtype=bool), np.asarray(strikes, dtype=float), ivs, quant, float(future_quant),
+                S, T, r, spot_vol, self.vol_of_vol, self.corr)
+        self.inputs = (pnl, np.append(quant, future_quant))
+        seeds = np.random.SeedSequence([self.seed, self.refreshes]).spawn(self.chunks)
+        per_chunk = max(self.paths // self.chunks, 1)
+        self.started = time.perf_counter()
+        self.last = now
+        self.refreshes += 1
+        if self.pool is None:
+            self.jobs = [(seed, per_chunk) for seed in seeds]
+            self.args = args
+            self.results = []
+            self.spent = 0.
+            self.collect()
+        else:
+            self.jobs = [self.pool.submit(simulate, seed, per_chunk, self.steps, *args) for seed in seeds]
+        return True
+
+    # Picks up a pool refresh once all of its chunks are done or its budget has run out; in-process,
+    # runs the chunks that fit this call's slice of the budget (at least one, timed by the last chunk)
+    # and finishes the refresh after the last
+    def collect(self):
+        if not self.jobs:
+            return
+        if self.pool is None:
+            start = now = time.perf_counter()
+            while self.jobs and (now == start or now - start + self.chunk_seconds <= self.slice):
+                seed, paths = self.jobs.pop(0)
+                self.results.append(simulate(seed, paths, self.steps, *self.args))
+                self.chunk_seconds = time.perf_counter() - now
+                now = time.perf_counter()
+            self.spent += now - start
+            if not self.jobs:
+                self.finish(self.results, True)
+            return
+        complete = all(job.done() for job in self.jobs)
+        if not complete and time.perf_counter() - self.started < self.budget:
+            return
+        results = [job.result() for job in self.jobs if job.done() and not job.cancelled() and job.exception() is None]
+        for job in self.jobs:
+            job.cancel()
+        self.jobs = []
+        self.finish(results, complete)
+
+    # seconds is the time the refresh took on the pool, or the time spent simulating in-process
+    def finish(self, results, complete):
+        self.seconds = time.perf_counter() - self.started if self.pool is not None else self.spent
+        # fit the next refresh to the budget
+        if not complete or self.seconds > self.budget:
+            self.paths = max(int(self.paths * 0.7), self.min_paths)
+        elif self.seconds < self.budget / 2:
+            self.paths = min(int(self.paths * 1.25), self.max_paths)
+        if not results:
+            return
+        pnl, position = self.inputs
+        self.unit_pnl = np.vstack([unit_pnl for unit_pnl, _ in results])
+        worst = np.concatenate([worst for _, worst in results])
+        self.pnl = self.unit_pnl @ position
+        self.var = -np.quantile(self.pnl, 1 - self.alpha)
+        self.es = expected_shortfall(self.pnl[:, None], self.alpha)[0]
+        self.p_limit = np.mean(pnl + worst <= self.loss_limit)
+
+    # Largest quantity up to max_quant of instrument i (sign +1 to buy, -1 to sell) that keeps the
+    # expected shortfall of position (options then the future) within budget, or that does not
+    # raise it if it is over budget already. None until the first refresh finished
+    def size(self, i, sign, position, max_quant, budget):
+        if self.unit_pnl is None:
+            return None
+        base = self.unit_pnl @ position
+        sizes = np.arange(max_quant + 1)
+        es = expected_shortfall(base[:, None] + sign * self.unit_pnl[:, i, None] * sizes, self.alpha)
+        over = np.flatnonzero(es > max(budget, es[0]))
+        return int(over[0] - 1) if over.size else max_quant
+
+    def summary(self):
+        return {'paths': 0 if self.pnl is None else self.pnl.size, 'var': self.var, 'es': self.es,
+                'p_loss_limit': self.p_limit, 'seconds': self.seconds}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
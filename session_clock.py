@@ -0,0 +1,50 @@
+import math
+
+# Session clock driven by the server's timestamps.
+# Every message carries elapsed_time, the seconds since the case started. The
+# clock moves only when that changes, so every computation inside one tick
+# sees the same time to expiry, and a replay of the same messages computes
+# the same numbers. Time to expiry T (in years), sqrt(T) and the discount
+# factor exp(-rT) are computed once per tick. memo() caches anything else for
+# the rest of the tick (Greeks keyed on spot and vols, fair prices, ...).
+# Everything cached is dropped when the clock advances.
+class SessionClock:
+    # The options expire at the end of the case, which stands for `expiry` years (a month by default)
+    def __init__(self, case_length=450, expiry=1 / 12., rate=0.):
+        self.case_length = case_length
+        self.expiry = expiry
+        self.rate = rate
+        self.elapsed = None
+        self.ticks = 0
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.advance(0)
+
+    # Moves the clock to a message's elapsed_time (messages without one leave it where it is)
+    def observe(self, msg):
+        elapsed = msg.get('elapsed_time')
+        if elapsed is not None:
+            self.advance(elapsed)
+
+    # Sets the clock to elapsed seconds into the case; returns False if it was already there
+    def advance(self, elapsed):
+        if elapsed == self.elapsed:
+            return False
+        self.elapsed = elapsed
+        self.ticks += 1
+        self.T = max(self.case_length - elapsed, 0) / self.case_length * self.expiry
+        self.sqrt_t = math.sqrt(self.T)
+        self.discount = math.exp(-self.rate * self.T)
+        self.cache.clear()
+        return True
+
+    # compute() the first time key is seen this tick, the cached value after that
+    def memo(self, key, compute):
+        try:
+            value = self.cache[key]
+            self.hits += 1
+        except KeyError:
+            value = self.cache[key] = compute()
+            self.misses += 1
+        return value
@@ -1,22 +1,33 @@
-from tradersbot import *
-from datetime import datetime, timedelta
-import numpy as np
-import pandas as pd
+import sys
+import os
+import atexit
+from history import RingBuffer
+from order_book import OrderBook
+from order_manager import OrderManager
+from news_model import NewsModel
+import latency
 
 #Initialize variables: positions, expectations, future customer orders, etc
 position_limit = 5000
 case_length = 450
+LIQUIDATION_TIME = 90 #stop opening positions and unwind this many seconds before the end
 cash = 0
 C = 1/25000.
-position_lit = 0
-position_dark = 0
+ORDERS = OrderManager() #open orders, positions and case limits
 time = 0
+HISTORY_LEN = 1024
 topBid = 0
 topAsk = 0
+NEWS_LAG = 9 #seconds after a news item at which its effect on the LIT price is measured
+NEWS_QUANT = 1000 #shares traded on each side per news item
 news_history = {}
 MARKET = {}
-statistics = {} #keep track of mean and standard deviation of a normal distribution (starting at 0.5, 0.5)
-#for how much each person's orders match with fluctuations in p0.
+NEWS = None #per source beliefs about how much each person's orders move p0 (see news_model.py)
+NEWS_REESTIMATE_PERIOD = 30 #case seconds between rebuilding NEWS from news_history in one batch
+reestimated = 0 #case time NEWS was last rebuilt
+CHECKPOINT_PATH = None #file the state is checkpointed to for a warm restart (BOT_CHECKPOINT)
+CHECKPOINT_PERIOD = 5 #case seconds between checkpoints
+CHECKPOINT = None
 #etc etc
 
 ##Objectives:
@@ -28,8 +39,8 @@ statistics = {} #keep track of mean and standard deviation of a normal distribut
 
 def register(msg, order):
     #Set case information
-    global MARKET, time
-    time = msg['elapsed_time']
+    global MARKET, NEWS, CHECKPOINT, time, reestimated
+    time = reestimated = msg['elapsed_time']
     security_dict = msg['case_meta']['securities']
     for security in security_dict.keys():
         if not(security_dict[security]['tradeable']):
@@ -37,77 +48,126 @@ def register(msg, order):
         price = security_dict[security]['starting_price']
         MARKET[security] = {}
         MARKET[security]['cur_price'] = price
-        MARKET[security]['prices'] = []
-        MARKET[security]['cur_bids'] = msg['market_states'][security]['bids']
-        MARKET[security]['cur_asks'] = msg['market_states'][security]['asks']
+        MARKET[security]['prices'] = RingBuffer(HISTORY_LEN)
+        MARKET[security]['book'] = OrderBook(security)
+        MARKET[security]['book'].update(msg['market_states'][security]['bids'], msg['market_states'][security]['asks'])
         #MARKET[security]['price'] = [price]
+    ORDERS.configure(msg['case_meta'])
     news_sources = msg['case_meta']['news_sources']
     for source in news_sources.keys():
         news_history[source] = []
-        statistics[source] = {'mean': 0.5, 'std': 0.5}
-    MARKET['cur_news'] = []
+    NEWS = NewsModel(news_sources.keys(), C, lag=NEWS_LAG)
+    if CHECKPOINT_PATH:
+        import checkpoint
+        restore_checkpoint(msg)
+        #One writer for the whole process, however often the bot registers again
+        if CHECKPOINT is None:
+            CHECKPOINT = checkpoint.Checkpointer(CHECKPOINT_PATH, CHECKPOINT_PERIOD)
+            atexit.register(CHECKPOINT.flush)
+    #Start from the server's positions and open orders (not flat when reconnecting mid-case)
+    if 'trader_state' in msg:
+        ORDERS.on_trader_update(msg)
     #print(MARKET)
 
+def checkpoint_key():
+    #Identifies the case a checkpoint belongs to
+    return ('algost', tuple(sorted(MARKET)), case_length)
+
+def save_checkpoint():
+    #Price histories (books come fresh from the server on reconnect), news history and news beliefs
+    if CHECKPOINT is None or not CHECKPOINT.due(time):
+        return
+    market = {security: {k: v for k, v in fields.items() if k != 'book'} for security, fields in MARKET.items()}
+    CHECKPOINT.save(time, checkpoint_key(), {'market': market, 'news_history': news_history, 'news': NEWS})
+
+def restore_checkpoint(msg):
+    #Picks up from the latest checkpoint of this case, if any, at the prices in ACK REGISTER
+    global NEWS
+    if CHECKPOINT is not None:
+        CHECKPOINT.flush() #after a reconnect in the same process, let the last save land first
+    import checkpoint
+    saved = checkpoint.load(CHECKPOINT_PATH, checkpoint_key(), time)
+    if saved is None:
+        return False
+    elapsed, state = saved
+    for security, fields in state['market'].items():
+        MARKET[security].update(fields)
+        last_price = msg['market_states'][security].get('last_price')
+        if last_price is not None:
+            MARKET[security]['cur_price'] = last_price
+            MARKET[security]['prices'].append(last_price, time)
+    news_history.update(state['news_history'])
+    NEWS = state['news']
+    print("Restored checkpoint from t=%s at t=%s" % (elapsed, time))
+    return True
+
 def update_market(msg, order):
     #Update market information
-    global MARKET, time, C
+    global MARKET, time, C, topBid, topAsk
     time = msg['elapsed_time']
     security = msg['market_state']['ticker']
     MARKET[security]['cur_price'] = msg['market_state']['last_price']
-    MARKET[security]['prices'].append(MARKET[security]['cur_price'])
-    MARKET[security]['cur_bids'] = msg['market_state']['bids']
-    MARKET[security]['cur_asks'] = msg['market_state']['asks']
-
-    if len(MARKET['cur_news']) > 0:
-        if time >= int(MARKET['cur_news'][0][3]) + 9: #Check how much the order actually affects p0 (zero-th level approx):
-            change = MARKET['TRDRS.LIT']['cur_price']-MARKET['cur_news'][0][4] #The first order, and price at the time.
-            print(change, C, MARKET['cur_news'][0][1])
-            proportion = change/(C*MARKET['cur_news'][0][1])
-            if MARKET['cur_news'][0][2] == 'sell':
-                proportion = -proportion
-            print(proportion)
-            source = MARKET['cur_news'][0][0]
-            mean = statistics[source]['mean']
-            std = statistics[source]['std']
-            updated_mean = (mean+std**2*proportion)/(1+std**2) #updating with the assumption of a 1 std for the data point. Might need to adjust this.
-            updated_std = ((std**2)/(1+std**2))**0.5
-            print(updated_mean, updated_std)
-            statistics[source]['mean'] = updated_mean
-            statistics[source]['std'] = updated_std
-            MARKET['cur_news'].pop(0) #remove the oldest order news
+    MARKET[security]['prices'].append(MARKET[security]['cur_price'], time)
+    MARKET[security]['book'].update(msg['market_state']['bids'], msg['market_state']['asks'])
+    if security == 'TRDRS.LIT':
+        topBid = MARKET[security]['book'].best_bid
+        topAsk = MARKET[security]['book'].best_ask
+
+        #Check how much every order due by now actually moved p0 (zero-th level approx)
+        NEWS.evaluate(time, MARKET[security]['cur_price'])
 
 
 def update_trader(msg, order):
     #Update positions
-    global MARKET, time, position_dark, position_lit
-    #position_dark = int(msg['trader_state']['positions']['TRDRS.DARK'])
-    #position_lit = int(msg['trader_state']['positions']['TRDRS.LIT'])
-    if len(msg['trader_state']['open_orders'].keys()) > 0: #Cancel bad outstanding orders
-        usr = msg['trader_state']['open_orders'].keys()[0]
-        security = msg['trader_state']['open_orders'][usr]['ticker']
-        if msg['trader_state']['open_orders'][usr]['buy'] and msg['trader_state']['open_orders'][usr]['price'] > MARKET[security]['cur_price']:
-            order.addCancel(security, msg['trader_state']['open_orders'][usr]['order_id'])
-    if case_length-time < 90:
-        if position_dark > 0:
-            order.addSell('TRDRS.DARK', quantity=position_dark, price=MARKET['TRDRS.DARK']['cur_price'])
-            position_dark = 0
-        elif position_dark < 0:
-            order.addBuy('TRDRS.DARK', quantity=position_dark, price=MARKET['TRDRS.DARK']['cur_price'])
-            position_dark = 0
-        if position_lit > 0:
-            if position_lit > 1000:
-                order.addSell('TRDRS.LIT', quantity=1000, price=MARKET['TRDRS.LIT']['cur_price'])
-                position_lit = position_lit - 1000
-            else:
-                order.addSell('TRDRS.LIT', quantity=position_lit, price=MARKET['TRDRS.LIT']['cur_price'])
-                position_lit = 0
-        elif position_lit < 0:
-            if position_lit < -1000:
-                order.addBuy ('TRDRS.LIT', quantity=1000, price=MARKET['TRDRS.LIT']['cur_price'])
-                position_lit = position_lit + 1000
-            else:
-                order.addBuy('TRDRS.LIT', quantity=position_lit, price=MARKET['TRDRS.LIT']['cur_price'])
-                position_lit = 0
+    global MARKET, time
+    ORDERS.on_trader_update(msg)
+    #Cancel bad outstanding orders
+    ORDERS.cancel_where(lambda o: o['buy'] and o['price'] is not None and o['price'] > MARKET[o['ticker']]['cur_price'])
+    if case_length-time < LIQUIDATION_TIME:
+        unwind('TRDRS.DARK')
+        unwind('TRDRS.LIT')
+    ORDERS.flush(order)
+    reestimate_news()
+    save_checkpoint()
+
+def reestimate_news():
+    #Re-measures every news item so far at the LIT price standing at its due time
+    global reestimated
+    if time - reestimated < NEWS_REESTIMATE_PERIOD:
+        return
+    reestimated = time
+    lit = MARKET['TRDRS.LIT']['prices']
+    NEWS.reestimate([h for items in news_history.values() for h in items], lit.time_view(), lit.view())
+
+def unwind(security):
+    #Work the position back to flat
+    size = unwind_size(ORDERS.position(security), ORDERS.working(security, True), ORDERS.working(security, False),
+                       ORDERS.max_size.get(security, 1000))
+    if size is not None:
+        ORDERS.add(security, size[0], size[1], MARKET[security]['cur_price'])
+
+def unwind_size(position, working_buy, working_sell, max_quant):
+    #(buy, quantity) of one maximum size order towards flat on top of what is already working, or None
+    if position > 0 and position - working_sell > 0:
+        return False, min(position - working_sell, max_quant)
+    if position < 0 and -position - working_buy > 0:
+        return True, min(-position - working_buy, max_quant)
+    return None
+
+def news_side(headline):
+    #True if the news says the source is buying, False if selling
+    if "buying" in headline:
+        return True
+    if "selling" in headline:
+        return False
+    raise ValueError("News message contains neither buying nor selling statement. It says: ", headline)
+
+def news_orders(model, source, amount, buy, dark, lit, quant=None):
+    #Orders [(ticker, buy, quantity, price)] on a news item: the other side of the informed trader in the
+    #dark pool, hedged on the lit market, both at the price the source's learned impact says it moves to
+    quant = NEWS_QUANT if quant is None else quant
+    move = model.impact(source) * model.C * amount * (1 if buy else -1)
+    return [('TRDRS.DARK', not buy, quant, dark + move), ('TRDRS.LIT', buy, quant, lit + move)]
 
 def trade_method(msg, order):
     #Update trade information
@@ -118,50 +178,59 @@ def trade_method(msg, order):
     for trade in trade_dict:
         security = trade["ticker"]
         MARKET[security]['cur_price'] = trade["price"]
-        MARKET[security]['prices'].append(MARKET[security]['cur_price'])
+        MARKET[security]['prices'].append(MARKET[security]['cur_price'], time)
+    ORDERS.on_trade(msg)
 
 def update_order(msg, order):
     #Update order information
-    pass
+    ORDERS.on_ack(msg)
 
 def update_news(msg, order):
-    global MARKET, news_history, C, position_dark, position_lit
+    global MARKET, news_history, C
     #Update news information
     source = msg['news']['source']
     amount = int(msg['news']['body'])
     time = int(msg['news']['time'])
     headline = msg['news']['headline']
     print(headline)
-    if case_length-time < 90:
-        pass
-    #bypass the next parts in the last 30 seconds. Make no new orders.
-    elif "buying" in headline:
-        action = "buy"
-        order.addSell('TRDRS.DARK', quantity=1000, price=MARKET['TRDRS.DARK']['cur_price']+statistics[source]['mean']*C*amount) #Should be market price-c*position of market maker (which you calculate by keeping track of things) + how much you're willing to bet that p0 will move, currently set at 0.25*quantity.
-        order.addBuy('TRDRS.LIT', quantity = 1000, price= MARKET['TRDRS.LIT']['cur_price']+statistics[source]['mean']*C*amount) #Neutralize your overall position on TRDRS
-        position_dark -= 1000
-        position_lit += 1000
-        MARKET['cur_news'] += [[source, amount, action, time, MARKET['TRDRS.LIT']['cur_price']]]
-        news_history[source] += [[source, amount, action, time, MARKET['TRDRS.LIT']['cur_price']]]
-    elif "selling" in headline:
-        action = "sell"
-        order.addBuy('TRDRS.DARK', quantity = 1000, price= MARKET['TRDRS.DARK']['cur_price']-statistics[source]['mean']*C*amount)
-        order.addSell('TRDRS.LIT', quantity=1000, price=MARKET['TRDRS.LIT']['cur_price']-statistics[source]['mean']*C*amount)
-        position_dark += 1000
-        position_lit -= 1000
-        MARKET['cur_news'] += [[source, amount, action, time, MARKET['TRDRS.LIT']['cur_price']]]
-        news_history[source] += [[source, amount, action, time, MARKET['TRDRS.LIT']['cur_price']]]
-    else:
-        raise ValueError("News message contains neither buying nor selling statement. It says: ", headline)
+    #bypass the next parts in the last LIQUIDATION_TIME seconds. Make no new orders.
+    if case_length-time >= LIQUIDATION_TIME:
+        buy = news_side(headline)
+        #DARK: should be market price-c*position of market maker (which you calculate by keeping track of things) + how much you're willing to bet that p0 will move
+        #LIT: neutralize your overall position on TRDRS
+        for security, side, quant, price in news_orders(NEWS, source, amount, buy, MARKET['TRDRS.DARK']['cur_price'],
+                                                        MARKET['TRDRS.LIT']['cur_price']):
+            ORDERS.add(security, side, quant, price)
+        NEWS.push(source, amount, buy, time, MARKET['TRDRS.LIT']['cur_price'])
+        news_history[source] += [[source, amount, 'buy' if buy else 'sell', time, MARKET['TRDRS.LIT']['cur_price']]]
+    ORDERS.flush(order)
     #print(order)
 
-t = TradersBot(host=sys.argv[1], id=sys.argv[2], password=sys.argv[3])
+# Hooks the callbacks up to a TradersBot (or the backtester's stand-in)
+def attach(t):
+    t.onAckRegister = register
+    t.onMarketUpdate = update_market
+    t.onTraderUpdate = update_trader
+    t.onTrade = trade_method
+    t.onAckModifyOrders = update_order
+    t.onNews = update_news
 
-t.onAckRegister = register
-t.onMarketUpdate = update_market
-t.onTraderUpdate = update_trader
-t.onTrade = trade_method
-#t.onAckModifyOrders = update_order
-t.onNews = update_news
+if __name__ == '__main__':
+    from tradersbot import TradersBot
+    import conflation
+    import recorder
+    t = TradersBot(host=sys.argv[1], id=sys.argv[2], password=sys.argv[3])
+    attach(t)
+    enabled, path = latency.profile_setting(os.environ.get('BOT_PROFILE'))
+    if enabled:
+        latency.enable(t, path)
+    # BOT_CONFLATE=1 runs the strategy on a worker thread on the latest market snapshot
+    if os.environ.get('BOT_CONFLATE', '0') != '0':
+        conflation.Conflator(t)
+    # BOT_CHECKPOINT=<file> checkpoints the bot's state there and restores it on restart
+    CHECKPOINT_PATH = os.environ.get('BOT_CHECKPOINT')
+    # BOT_RECORD=<dir> records every message and order of the session (see recorder.py)
+    if os.environ.get('BOT_RECORD'):
+        recorder.Recorder(recorder.session_path(os.environ['BOT_RECORD'])).wrap(t)
+    t.run()
 
-t.run()
@@ -1,28 +1,23 @@
 from __future__ import division
-from tradersbot import TradersBot
 
 import sys
+import os
 import math
-from statistics import mean
-from scipy.stats import norm
-import datetime
-import time
-import random
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from py_vollib.black.implied_volatility import implied_volatility as iv
-from py_vollib.black.greeks.analytical import delta, gamma, vega
+import atexit
+import numpy as np
+from implied_vol import implied_vol_chain
+from rolling import RollingBands
+from history import RingBuffer
+from order_book import OrderBook
+from order_manager import OrderManager
+from risk import RiskEngine
+from smile import SmileModel
+from session_clock import SessionClock
+from arbitrage import ArbitrageScanner
+from bs_chain import chain_greeks, norm_pdf
+import latency
 
 
-t = TradersBot(host=sys.argv[1], id=sys.argv[2], password=sys.argv[3])
-
-START_TIME = time.time()
-
-def exp_time():
-    global START_TIME
-    return (7.5 * 60 - (time.time() - START_TIME)) / (7.5 * 60 * 12)
-
 DELTA_MAX = 1000
 VEGA_MAX = 9000
 
@@ -31,8 +26,40 @@ TRADE_FEE = 0.005
 OPTIONS_LIM = 5000
 FUTURES_LIM = 2500
 WINDOW = 10
-
-# TODO: Make volatility prediction model (basic smile?), update strategy to keep track of current bids, market make
+# Strategy constants (overridable per run by backtest.py / sweep.py)
+IV_LOW = 0.8
+IV_HIGH = 1.20
+BAND_LOW_TOL = 0.95
+BAND_HIGH_TOL = 1.05
+MM_SPREAD_MULT = 2.5
+# market making quotes rest behind this many times their own size on the book
+MM_DEPTH = 2
+HISTORY_LEN = 1024
+SPOT = 100
+# Solve IVs from bs_grid's lookup tables (built on register) instead of iteratively. Greeks stay
+# on chain_greeks, which is already faster than the grid for a whole chain
+BS_GRID = False
+# Monte Carlo scenario risk, refreshed every SCENARIO_PERIOD case seconds. Orders are sized so the
+# book's expected shortfall stays within TAIL_BUDGET of the room left to the loss limit (ORDER_QUANT
+# until the first scenarios are in). Off in backtests unless a run sets SCENARIO_RISK, and then
+# simulated in-process (SCENARIO_WORKERS = 0) within its time budget; a live run uses a process pool
+SCENARIO_RISK = False
+SCENARIO_WORKERS = 0
+SCENARIO_PERIOD = 5
+TAIL_BUDGET = 0.05
+ORDER_QUANT = 10
+MAX_ORDER_QUANT = 50
+# Arbitrage: the chain is scanned on every market update that moves a touch for bundles with a
+# fee-adjusted edge above ARB_MIN_EDGE, and the best one of the ARB_MAX_TRIES most profitable that
+# fits the limits is traded, up to ARB_MAX_BUNDLES at a time
+ARB_TRADE = True
+ARB_MIN_EDGE = 0.02
+ARB_MAX_BUNDLES = 10
+ARB_MAX_TRIES = 3
+# py_vollib reports vega per vol point, VEGA_MAX is expressed in those units
+VEGA_SCALE = 0.01
+
+# TODO: Update strategy to keep track of current bids, market make
 
 # TRADE STRATEGY
 # 1. Use Bollinger Bands on price as baseline (in simulation, returns $14,000 PNL in one round)
@@ -51,6 +78,8 @@ WINDOW = 10
 PORTFOLIO = {}
 PORTFOLIO['positions'] = {}
 PORTFOLIO['money'] = 1000000
+PORTFOLIO['pnl'] = 0
+PORTFOLIO['risk'] = {}
 PORTFOLIO['options'] = 0
 PORTFOLIO['futures'] = 0
 PORTFOLIO['greeks'] = {}
@@ -68,22 +97,61 @@ PORTFOLIO['greeks']['vega'] = 0
 
 MARKET = {}
 
+# Open orders, reconciled positions and order limits
+ORDERS = OrderManager()
+# Position Greeks for the chain and the future, set up on register
+RISK = None
+# Volatility smile fitted to the chain, set up on register
+SMILE = None
+# Arbitrage scanner over the chain's quotes, set up on register
+ARBS = None
+# Scenario risk engine (scenario_risk.py), set up on register
+SCENARIOS = None
+# Session time and time to expiry from the messages' elapsed_time, rebuilt on register
+CLOCK = SessionClock()
+# Shared-memory segment the bot's state is published to for dashboard.py (BOT_SNAPSHOT),
+# and its writer, set up on register
+SNAPSHOT_NAME = None
+SNAPSHOT = None
+# Black-Scholes lookup tables over the chain's moneyness range, built on register if BS_GRID
+GRID = None
+# Checkpoint file for a warm restart after a crash or disconnect (BOT_CHECKPOINT), saved every
+# CHECKPOINT_PERIOD case seconds, and its writer, set up on register
+CHECKPOINT_PATH = None
+CHECKPOINT_PERIOD = 5
+CHECKPOINT = None
+
+# Arrays describing the option chain (same order in every array), built on register:
+# - tickers, strikes, call flags
+CHAIN = {}
+CHAIN['tickers'] = []
+CHAIN['strikes'] = None
+CHAIN['calls'] = None
+CHAIN['index'] = {}
+CHAIN['fair_price'] = None
+# - the latest arbitrage bundles worth trading, best first
+CHAIN['arbitrage'] = []
+
 ## GREEKS
 
+# Standard normal CDF of a float (what scipy's ndtr computes, without importing scipy for one number)
+def norm_cdf(x):
+    return 0.5 * math.erfc(-x / math.sqrt(2))
+
 # Calculates delta
 def calc_delta(call, S, K, T, r, sig):
     d1 = (math.log(S/K) + (r + sig ** 2 / 2) * T) / (sig * math.sqrt(T))
-    return norm.cdf(d1) - 1 + call
+    return norm_cdf(d1) - 1 + call
 
 # Calculates gamma
 def calc_gamma(S, K, T, r, sig):
     d1 = (math.log(S/K) + (r + sig ** 2 / 2) * T) / (sig * math.sqrt(T))
-    return norm.pdf(d1) / (S * sig * sqrt(T))
+    return norm_pdf(d1) / (S * sig * math.sqrt(T))
 
 # Calculates vega
 def calc_vega(S, K, T, r, sig):
     d1 = (math.log(S/K) + (r + sig ** 2 / 2) * T) / (sig * math.sqrt(T))
-    return S * norm.pdf(d1) * math.sqrt(T)
+    return S * norm_pdf(d1) * math.sqrt(T)
 
 ## VOLATILITY
 
@@ -91,102 +159,255 @@ def calc_vega(S, K, T, r, sig):
 def calc_price(call, S, K, T, r, sig):
     d1 = (math.log(S/K) + (r + sig ** 2 / 2) * T) / (sig * math.sqrt(T))
     d2 = d1 - sig * math.sqrt(T)
-    call_price = norm.cdf(d1) * S - norm.cdf(d2) * K * math.exp(-r * T)
+    call_price = norm_cdf(d1) * S - norm_cdf(d2) * K * math.exp(-r * T)
     if call:
         return call_price
     else:
         # using put-call parity
         return call_price + K * math.exp(-r * T) - S
 
-# Calculates implied volatility
-def calc_vol(P, S, K, T, r):
-    #initial guess
-    sig = 0.5
-
-    max_iter = 10
-    thresh = 1e-4
-    eps = 1
-
-    i = 0
-    for i in range(max_iter):
-        if eps < thresh:
-            return sig
-        diff = calc_price(1, S, K, T, r, sig) - P
-        vega = calc_vega(S, K, T, r, sig)
-        if vega == 0:
-            return (S, K, T, r, sig)
-        sig =  -diff/vega + sig
-        eps = abs(diff)
-    print("Implied volatility = ", sig)
-    print("Num iterations = ", i)
-    return sig
-
-# Plots implied volatility smile
-def plot_vol(type):
-    # Live plots volatility
-    fig = plt.figure()
-    ax1 = fig.add_subplot(1,1,1)
-
-    def animate(i):
-        strike = []
-        iv = []
-        for security in MARKET:
-            if MARKET[security]['type'] == type:
-                strike.append(MARKET[security]['strike'])
-                iv.append(MARKET[security]['cur_iv'])
-        ax1.clear()
-        ax1.scatter(strike,iv)
-    ani = animation.FuncAnimation(fig, animate, interval=1000)
-    #plt.show()
-
+# Calculates implied volatility (None if the price cannot be inverted)
+def calc_vol(call, P, S, K, T, r):
+    sig, reasons = implied_vol_chain(P, call, S, K, T, r)
+    return sig[0] if reasons[0] is None else None
+
+# Seconds into the case, used to timestamp the history
+def session_time():
+    return CLOCK.elapsed
+
+# Records a new price for a security and rolls its Bollinger bands forward
+def add_price(security, price):
+    MARKET[security]['cur_price'] = price
+    MARKET[security]['prices'].append(price, session_time())
+    MARKET[security]['bands'].update(price)
+
+# Re-solves implied volatility for the given options (the whole chain by default) in one batch,
+# warm-started from each strike's current IV. Failed strikes keep their previous IV and record
+# why in 'iv_error' instead of being zeroed.
+def update_ivs(securities=None, record=True):
+    securities = CHAIN['tickers'] if securities is None else list(securities)
+    if not securities:
+        return
+    idx = [CHAIN['index'][security] for security in securities]
+    prices = np.array([MARKET[security]['cur_price'] for security in securities], dtype=float)
+    guess = np.array([MARKET[security]['cur_iv'] for security in securities], dtype=float)
+    solve = GRID.implied_vol if GRID is not None else implied_vol_chain
+    sig, reasons = solve(prices, CHAIN['calls'][idx], spot(), CHAIN['strikes'][idx], CLOCK.T, INTEREST_RATE, guess)
+    for i, security in enumerate(securities):
+        MARKET[security]['iv_error'] = reasons[i]
+        if reasons[i] is not None:
+            latency.count('iv failed: ' + reasons[i])
+        else:
+            MARKET[security]['cur_iv'] = sig[i]
+            if record:
+                MARKET[security]['ivs'].append(sig[i], session_time())
+
+# Refits the vol smile to the chain's current IVs (vega-weighted once Greeks are known)
+def update_smile():
+    if SMILE is None:
+        return
+    ivs = np.array([MARKET[security]['cur_iv'] for security in CHAIN['tickers']])
+    weights = RISK.unit_vega if RISK is not None and RISK.unit_vega.any() else None
+    SMILE.fit(ivs, spot(), weights)
+    S = spot()
+    CHAIN['fair_price'] = CLOCK.memo(('fair_price', S, SMILE.fair.tobytes()),
+                                     lambda: SMILE.fair_price(CHAIN['calls'], S, CLOCK.T, INTEREST_RATE))
+
+# The smile's vol for an option (the mean of its observed IVs until the smile has been fitted)
+def fair_vol(security):
+    if SMILE is None or not SMILE.fitted:
+        return MARKET[security]['ivs'].mean
+    return SMILE.fair[CHAIN['index'][security]]
+
+# The option's price at the smile's vol (nan until the smile has been fitted)
+def fair_price(security):
+    if CHAIN['fair_price'] is None:
+        return np.nan
+    return CHAIN['fair_price'][CHAIN['index'][security]]
+
+# Underlying price: the future's last price, SPOT until the future is known
+def spot():
+    future = MARKET.get("TMXFUT")
+    return future['cur_price'] if future else SPOT
+
+# Revalues every position at the current spot, expiry and vols in one array pass
+# (once per tick for each spot and set of vols)
+def update_greeks():
+    if RISK is None:
+        return
+    ivs = np.array([MARKET[security]['cur_iv'] for security in CHAIN['tickers']])
+    S = spot()
+    RISK.set_greeks(*CLOCK.memo(('greeks', S, ivs.tobytes()),
+                                lambda: chain_greeks(CHAIN['calls'], S, CHAIN['strikes'], CLOCK.T, INTEREST_RATE, ivs)))
+    sync_portfolio()
+
+# Starts a scenario refresh when one is due and copies the last results into PORTFOLIO['risk']
+def update_scenarios():
+    if SCENARIOS is None:
+        return
+    ivs = np.array([MARKET[security]['cur_iv'] for security in CHAIN['tickers']])
+    S = spot()
+    atm = SMILE.fair_vol([S], S)[0] if SMILE.fitted else np.nan
+    if not np.isfinite(atm) and np.isfinite(ivs).any():
+        atm = np.nanmedian(ivs)
+    if np.isfinite(atm):
+        SCENARIOS.refresh(CLOCK.elapsed, CHAIN['calls'], CHAIN['strikes'], ivs, RISK.quant, RISK.future_quant,
+                          S, CLOCK.T, INTEREST_RATE, atm, PORTFOLIO['pnl'])
+    PORTFOLIO['risk'] = SCENARIOS.summary()
+
+# Size of a new order: the largest up to MAX_ORDER_QUANT whose marginal tail risk keeps the book's
+# expected shortfall within budget (ORDER_QUANT without scenario results)
+def order_size(type, security):
+    if SCENARIOS is None:
+        return ORDER_QUANT
+    position = np.append(RISK.quant, RISK.future_quant)
+    budget = TAIL_BUDGET * (PORTFOLIO['pnl'] - SCENARIOS.loss_limit)
+    quant = SCENARIOS.size(CHAIN['index'][security], 1 if type == 'buy' else -1, position, MAX_ORDER_QUANT, budget)
+    return ORDER_QUANT if quant is None else quant
+
+# Queues an order through the order manager; it reaches the wire when the callback flushes.
+# Orders that would take the book's vega further past VEGA_MAX are dropped.
 def make_order(order, type, security, quant, price):
-    d = quant*delta(MARKET[security]['type'], 100, MARKET[security]['strike'], exp_time(), INTEREST_RATE, MARKET[security]['cur_iv'])
-    g = quant*gamma(MARKET[security]['type'], 100, MARKET[security]['strike'], exp_time(), INTEREST_RATE, MARKET[security]['cur_iv'])
-    v = quant*vega(MARKET[security]['type'], 100, MARKET[security]['strike'], exp_time(), INTEREST_RATE, MARKET[security]['cur_iv'])
-
-    if security not in PORTFOLIO:
-        PORTFOLIO['positions'][security] = {}
-        PORTFOLIO['positions'][security]['quant'] = 0
-        PORTFOLIO['positions'][security]['delta'] = 0
-        PORTFOLIO['positions'][security]['gamma'] = 0
-        PORTFOLIO['positions'][security]['vega'] = 0
-
+    if quant <= 0:
+        return
+    _, vega = RISK.after(security, quant if type == 'buy' else -quant)
+    if abs(vega) > VEGA_MAX and abs(vega) > abs(RISK.vega):
+        print("VEGA LIMIT, skipping", type, security, ": ", vega)
+        return
     if type == 'buy':
-        order.addBuy(security, quantity=quant, price=price)
-        print("BUY", security, ": ", quant, " @", price)
-        PORTFOLIO['positions'][security]['quant'] += quant
-        PORTFOLIO['positions'][security]['price'] = price
-        PORTFOLIO['positions'][security]['delta'] += d
-        PORTFOLIO['positions'][security]['gamma'] += g
-        PORTFOLIO['positions'][security]['vega'] += v
-        PORTFOLIO['greeks']['delta'] += d
-        PORTFOLIO['greeks']['gamma'] += g
-        PORTFOLIO['greeks']['vega'] += v
-        PORTFOLIO['options'] += quant
+        if ORDERS.buy(security, quant, price):
+            print("BUY", security, ": ", quant, " @", price)
     elif type == 'sell':
-        order.addSell(security, quantity=quant, price=price)
-        print("SELL", security, ": ", quant, " @", price)
-        PORTFOLIO['positions'][security]['quant'] -= quant
-        PORTFOLIO['positions'][security]['delta'] -= d
-        PORTFOLIO['positions'][security]['gamma'] -= g
-        PORTFOLIO['positions'][security]['vega'] -= v
-        PORTFOLIO['greeks']['delta'] -= d
-        PORTFOLIO['greeks']['gamma'] -= g
-        PORTFOLIO['greeks']['vega'] -= v
-        PORTFOLIO['options'] += quant
-
-
+        if ORDERS.sell(security, quant, price):
+            print("SELL", security, ": ", quant, " @", price)
+
+# Trades TMXFUT at the touch to bring delta back to zero once it leaves +/- DELTA_MAX
+def hedge():
+    if RISK is None or "TMXFUT" not in MARKET:
+        return
+    pending = ORDERS.working("TMXFUT", True) - ORDERS.working("TMXFUT", False)
+    max_order = min(ORDERS.max_size.get("TMXFUT", FUTURES_LIM), FUTURES_LIM)
+    quant = RISK.hedge_quantity(DELTA_MAX, FUTURES_LIM, max_order, pending)
+    book = MARKET["TMXFUT"]['book']
+    if quant > 0:
+        price = book.best_ask if book.prices['ask'] else MARKET["TMXFUT"]['cur_price']
+        if ORDERS.buy("TMXFUT", quant, price):
+            print("HEDGE BUY TMXFUT: ", quant, " @", price, " delta ", RISK.delta)
+    elif quant < 0:
+        price = book.best_bid if book.prices['bid'] else MARKET["TMXFUT"]['cur_price']
+        if ORDERS.sell("TMXFUT", -quant, price):
+            print("HEDGE SELL TMXFUT: ", -quant, " @", price, " delta ", RISK.delta)
+
+# Scans the chain for arbitrage (a no-op until a touch changes) and queues every leg of the best
+# bundle worth trading (or none of them), trying at most the ARB_MAX_TRIES most profitable
+def trade_arbitrage():
+    CHAIN['arbitrage'] = ARBS.scan(CLOCK.T, INTEREST_RATE, ARB_MIN_EDGE, ARB_MAX_TRIES)
+    if not ARB_TRADE:
+        return
+    for bundle in CHAIN['arbitrage']:
+        bundles = min(bundle['quantity'], ARB_MAX_BUNDLES)
+        legs = [(ticker, buy, ratio * bundles, price) for ticker, buy, ratio, price in bundle['legs']]
+        if ORDERS.open_count() + len(legs) > ORDERS.max_open_orders:
+            return
+        if not ORDERS.add_all(legs):
+            continue
+        ARBS.take(bundle, bundles)
+        latency.count('arbitrage: ' + bundle['kind'])
+        print("ARB", bundle['kind'], bundle['strikes'], ": ", bundles, "x", legs, " edge", bundle['edge'])
+        return
+
+# Copies the risk engine's positions and totals into PORTFOLIO
+def sync_portfolio():
+    PORTFOLIO['positions'] = {}
+    for i in np.flatnonzero(RISK.quant):
+        security = RISK.tickers[i]
+        quant = RISK.quant[i]
+        PORTFOLIO['positions'][security] = {'quant': quant, 'delta': quant * RISK.unit_delta[i],
+                                            'gamma': quant * RISK.unit_gamma[i], 'vega': quant * RISK.unit_vega[i]}
+    PORTFOLIO['options'] = np.abs(RISK.quant).sum()
+    PORTFOLIO['futures'] = RISK.future_quant
+    PORTFOLIO['greeks']['delta'] = RISK.delta
+    PORTFOLIO['greeks']['gamma'] = RISK.gamma
+    PORTFOLIO['greeks']['vega'] = RISK.vega
+
+
+# Publishes prices, IVs, Greeks, positions and bands to the shared-memory snapshot (if any)
+def publish_snapshot():
+    if SNAPSHOT is None:
+        return
+    securities = CHAIN['tickers'] + ['TMXFUT']
+    fair_price = CHAIN['fair_price'] if CHAIN['fair_price'] is not None else np.full(len(CHAIN['tickers']), np.nan)
+    bands = [MARKET[security]['bands'] for security in securities]
+    SNAPSHOT.publish({
+        'price': [MARKET[security]['cur_price'] for security in securities],
+        'iv': [MARKET[security]['cur_iv'] for security in CHAIN['tickers']] + [np.nan],
+        'fair_vol': np.append(SMILE.fair, np.nan),
+        'fair_price': np.append(fair_price, np.nan),
+        'delta': np.append(RISK.unit_delta, 1.),
+        'gamma': np.append(RISK.unit_gamma, 0.),
+        'vega': np.append(RISK.unit_vega, 0.),
+        'position': np.append(RISK.quant, RISK.future_quant),
+        'band_lower': [b.lower for b in bands],
+        'band_mean': [b.mean for b in bands],
+        'band_upper': [b.upper for b in bands],
+    }, elapsed=CLOCK.elapsed, spot=spot(), pnl=PORTFOLIO['pnl'], cash=PORTFOLIO['money'],
+        delta=RISK.delta, gamma=RISK.gamma, vega=RISK.vega)
+
+# Identifies the case a checkpoint belongs to
+def checkpoint_key():
+    return ('options', tuple(sorted(MARKET)), CLOCK.case_length)
+
+# Checkpoints the strategy's state when one is due: every security's histories and bands (not its
+# book, which the server sends again on reconnect) and the smile. PORTFOLIO is not saved: register
+# rebuilds it from the server's trader_state and the current Greeks
+def save_checkpoint():
+    if CHECKPOINT is None or not CHECKPOINT.due(CLOCK.elapsed):
+        return
+    market = {security: {k: v for k, v in fields.items() if k != 'book'} for security, fields in MARKET.items()}
+    CHECKPOINT.save(CLOCK.elapsed, checkpoint_key(), {'market': market, 'smile': SMILE.coef})
+
+# Restores the latest checkpoint of this case (if any), then brings prices and books up to date
+# from ACK REGISTER's market states
+def restore_checkpoint(msg):
+    # after a reconnect in the same process, let the last save land first
+    if CHECKPOINT is not None:
+        CHECKPOINT.flush()
+    import checkpoint
+    saved = checkpoint.load(CHECKPOINT_PATH, checkpoint_key(), CLOCK.elapsed)
+    if saved is None:
+        return False
+    elapsed, state = saved
+    for security, fields in state['market'].items():
+        MARKET[security].update(fields)
+    SMILE.coef = state['smile']
+    for security, market_state in msg.get('market_states', {}).items():
+        if security not in MARKET:
+            continue
+        MARKET[security]['book'].update(market_state['bids'], market_state['asks'])
+        ARBS.update_book(security, MARKET[security]['book'])
+        if market_state.get('last_price') is not None:
+            add_price(security, market_state['last_price'])
+    print("Restored checkpoint from t=%s at t=%s" % (elapsed, CLOCK.elapsed))
+    return True
+
+# Quotes both sides of an option whose spread is MM_SPREAD_MULT times its mean, each at the average
+# price of the size resting ahead of MM_DEPTH times the quote on its side of the book
 def make_market(order):
     for security in MARKET.keys():
-        if security != "TMXFUT" and MARKET[security]['spreads'][-1] > mean(MARKET[security]['spreads']) * 2.5:
-            price1, quant1 = mean([MARKET[security]['mn_bid'],MARKET[security]['min_bid']]), 10
-            price2, quant2 = mean([MARKET[security]['max_ask'], MARKET[security]['mn_ask']]), 10
+        if security != "TMXFUT" and MARKET[security]['spreads'].last > MARKET[security]['spreads'].mean * MM_SPREAD_MULT:
+            book = MARKET[security]['book']
+            quant1, quant2 = order_size('buy', security), order_size('sell', security)
+            price1, price2 = book.depth('bid', MM_DEPTH * quant1)[1], book.depth('ask', MM_DEPTH * quant2)[1]
 
             # TODO: Check to see if cur prices are better than previous prices, and if there are open orders.
             if price1 > MARKET[security]['intrinsic']:
                 print("MM Spread: ", price2 - price1)
-                make_order(order, 'buy', security, quant1, round(price1 - 0.3, 2))
-                make_order(order, 'sell', security, quant2, round(price2, 2))
+                # only quote the sides that are on the right side of the smile's fair price
+                fair = fair_price(security)
+                if not fair < price1 - 0.3:
+                    make_order(order, 'buy', security, quant1, round(price1 - 0.3, 2))
+                if not (fair > price2 or math.isnan(price2)):
+                    make_order(order, 'sell', security, quant2, round(price2, 2))
 
 
 
@@ -194,22 +415,14 @@ def make_market(order):
 def bb_strategy(order):
     for security in MARKET.keys():
         if len(MARKET[security]['prices']) > WINDOW:
-            s = pd.DataFrame(MARKET[security]['prices'])
-            MARKET[security]['MA'] = s.rolling(window=WINDOW, min_periods=1).mean()
-            MARKET[security]['STD'] = s.rolling(window=WINDOW, min_periods=1).std()
-            MARKET[security]['Upper'] = MARKET[security]['MA'] + (MARKET[security]['STD'] * 2)
-            MARKET[security]['Lower'] = MARKET[security]['MA'] - (MARKET[security]['STD'] * 2)
-            MARKET[security]['MA'] = MARKET[security]['MA'].values.flatten().tolist()
-            MARKET[security]['STD'] = MARKET[security]['STD'].values.flatten().tolist()
-            MARKET[security]['Upper'] = MARKET[security]['Upper'].values.flatten().tolist()
-            MARKET[security]['Lower'] = MARKET[security]['Lower'].values.flatten().tolist()
+            bands = MARKET[security]['bands']
 
             # Bollinger Bands Strategy
-            if security != "TMXFUT":
-                if MARKET[security]['cur_iv'] < 0.8 * mean(MARKET[security]['ivs']) and MARKET[security]['prices'][-1] < MARKET[security]['Lower'][-1] and MARKET[security]['prices'][-2] > MARKET[security]['Lower'][-2] * 0.95:
+            if security != "TMXFUT" and MARKET[security]['ivs']:
+                fair = fair_vol(security)
+                if MARKET[security]['cur_iv'] < IV_LOW * fair and MARKET[security]['prices'][-1] < bands.lower and MARKET[security]['prices'][-2] > bands.prev_lower * BAND_LOW_TOL:
                     # price, quant = min(MARKET[security]["bids"].items(), key=lambda x: x[0])
-                    # quant = 10
-                    price, quant = MARKET[security]['cur_price'], 10
+                    price, quant = MARKET[security]['cur_price'], order_size('buy', security)
                     time_val = price - MARKET[security]['intrinsic']
 
                     if time_val > 0:
@@ -218,10 +431,9 @@ def bb_strategy(order):
                         make_order(order, 'buy', security, quant, round(price - time_val, 2))
                     # Move this to onTrade because you only update when the trade actually happens
 
-                elif MARKET[security]['cur_iv'] > 1.20 * mean(MARKET[security]['ivs']) and MARKET[security]['prices'][-1] > MARKET[security]['Upper'][-1] and MARKET[security]['prices'][-2] < MARKET[security]['Upper'][-2] * 1.05:
+                elif MARKET[security]['cur_iv'] > IV_HIGH * fair and MARKET[security]['prices'][-1] > bands.upper and MARKET[security]['prices'][-2] < bands.prev_upper * BAND_HIGH_TOL:
                     # price, quant = min(MARKET[security]["bids"].items(), key=lambda x: x[0])
-                    # quant = 10
-                    price, quant = MARKET[security]['cur_price'], 10
+                    price, quant = MARKET[security]['cur_price'], order_size('sell', security)
                     time_val = price - MARKET[security]['intrinsic']
                     if time_val > 0:
                         time_val = 0.1 * time_val if 0.1 * time_val > 0.5 else 0.5
@@ -229,17 +441,16 @@ def bb_strategy(order):
                         make_order(order, 'sell', security, quant, round(price + time_val, 2))
 
 
-
-                if PORTFOLIO['greeks']['delta'] > DELTA_MAX:
-                    print("DELTA LIMIT PASSED: ", PORTFOLIO['greeks']['delta'])
-                if PORTFOLIO['greeks']['vega'] > VEGA_MAX:
-                    print("VEGA LIMIT PASSED: ", PORTFOLIO['greeks']['vega'])
-
 ## CALLBACKS
 
 # Initializes the prices
 def ack_register_method(msg, order):
-    global MARKET
+    global MARKET, RISK, SMILE, GRID, CLOCK, SNAPSHOT, SCENARIOS, ARBS, CHECKPOINT
+    CLOCK = SessionClock(msg['case_meta'].get('case_length', 450), rate=INTEREST_RATE)
+    CLOCK.observe(msg)
+    # a reconnect registers again: rebuild the chain rather than appending to it
+    CHAIN['tickers'] = []
+    CHAIN['arbitrage'] = []
     security_dict = msg['case_meta']['securities']
     for security in security_dict.keys():
         if not(security_dict[security]['tradeable']):
@@ -249,112 +460,177 @@ def ack_register_method(msg, order):
         MARKET[security] = {}
         MARKET[security]['type'] = type
         MARKET[security]['cur_price'] = price
-        MARKET[security]['prices'] = []
-        MARKET[security]['spreads'] = []
+        MARKET[security]['prices'] = RingBuffer(HISTORY_LEN)
+        MARKET[security]['bands'] = RollingBands(WINDOW)
+        MARKET[security]['spreads'] = RingBuffer(HISTORY_LEN)
+        MARKET[security]['book'] = OrderBook(security)
         #MARKET[security]['price'] = [price]
         if security != "TMXFUT":
             strike = int(security[1:-1])
             MARKET[security]['strike'] = strike
             intrinsic = (100 - strike) * (MARKET[security]['type'] == 'c')
             MARKET[security]['intrinsic'] = intrinsic if intrinsic > 0 else 0
-            MARKET[security]['cur_iv'] = iv(price, 100, strike, INTEREST_RATE, 1/12, type)
-            MARKET[security]['ivs'] = []
+            MARKET[security]['cur_iv'] = np.nan
+            MARKET[security]['ivs'] = RingBuffer(HISTORY_LEN)
+            CHAIN['tickers'].append(security)
+    CHAIN['strikes'] = np.array([MARKET[security]['strike'] for security in CHAIN['tickers']], dtype=float)
+    CHAIN['calls'] = np.array([MARKET[security]['type'] == 'c' for security in CHAIN['tickers']])
+    CHAIN['index'] = {security: i for i, security in enumerate(CHAIN['tickers'])}
+    if BS_GRID:
+        from bs_grid import BSGrid
+        # log-moneyness of the chain with room for spot to move 20% either way
+        x = np.log(spot() / CHAIN['strikes'])
+        GRID = BSGrid((x.min() - 0.2, x.max() + 0.2))
+    RISK = RiskEngine(CHAIN['tickers'], CHAIN['calls'], CHAIN['strikes'], "TMXFUT", VEGA_SCALE)
+    SMILE = SmileModel(CHAIN['strikes'])
+    ARBS = ArbitrageScanner(CHAIN['tickers'], CHAIN['calls'], CHAIN['strikes'], "TMXFUT", TRADE_FEE)
+    if CHECKPOINT_PATH:
+        import checkpoint
+        with latency.stage('restore'):
+            restore_checkpoint(msg)
+        # one writer for the whole process, however often the bot registers again
+        if CHECKPOINT is None:
+            CHECKPOINT = checkpoint.Checkpointer(CHECKPOINT_PATH, CHECKPOINT_PERIOD)
+            atexit.register(CHECKPOINT.flush)
+    ORDERS.configure(msg['case_meta'])
+    ORDERS.add_limit('options', {security: 1 for security in CHAIN['tickers']}, OPTIONS_LIM, gross=True)
+    ORDERS.add_limit('futures', {'TMXFUT': 1}, FUTURES_LIM)
+    # start from the server's positions and open orders (not flat when reconnecting mid-case)
+    if 'trader_state' in msg:
+        reconcile(msg)
+    update_ivs(record=False)
+    update_greeks()
+    update_smile()
+    if SCENARIOS is not None:
+        SCENARIOS.close()
+        SCENARIOS = None
+    if SCENARIO_RISK:
+        from scenario_risk import ScenarioRisk
+        SCENARIOS = ScenarioRisk(msg['case_meta'].get('loss_limit', -np.inf), period=SCENARIO_PERIOD,
+                                 workers=SCENARIO_WORKERS)
+        atexit.register(SCENARIOS.close)
+    if SNAPSHOT_NAME:
+        import snapshot
+        # a row per option, then the future
+        SNAPSHOT = snapshot.SnapshotWriter(SNAPSHOT_NAME, CHAIN['tickers'] + ['TMXFUT'],
+                                           np.append(CHAIN['strikes'], np.nan), np.append(CHAIN['calls'], False))
+        atexit.register(SNAPSHOT.close)
+    with latency.stage('warm up'):
+        warm_up()
     print(MARKET)
 
+# Runs the kernels the first orders go through that register did not, on chain-shaped inputs,
+# so the first market updates do not pay their first-call costs
+def warm_up():
+    ARBS.scan(CLOCK.T, INTEREST_RATE)
+    if SCENARIOS is not None:
+        from scenario_risk import simulate, expected_shortfall
+        unit_pnl, _ = simulate(0, 16, 2, CHAIN['calls'], CHAIN['strikes'], np.full(len(CHAIN['tickers']), 0.25),
+                               np.ones(len(CHAIN['tickers'])), 1., spot(), max(CLOCK.T, 1e-4), INTEREST_RATE, 0.25, 1., 0.)
+        expected_shortfall(unit_pnl, SCENARIOS.alpha)
+    if CHAIN['tickers']:
+        ORDERS.check(CHAIN['tickers'][0], True, 1, None)
+
 
 # Updates latest price periodically
 def market_update_method(msg, order):
     global MARKET
+    CLOCK.observe(msg)
     security = msg['market_state']['ticker']
-    MARKET[security]['cur_price'] = msg['market_state']['last_price']
-    MARKET[security]['prices'].append(MARKET[security]['cur_price'])
-
-    #bids, q1 = zip(*msg['market_state']['bids'].items())
-    bids = list(msg['market_state']['bids'].keys())
-    bids = [float(i) for i in bids]
-    #asks, q2 = zip(*msg['market_state']['asks'].items())
-    asks = list(msg['market_state']['asks'].keys())
-    asks = [float(i) for i in asks]
-
-    #print(bids, asks)
+    add_price(security, msg['market_state']['last_price'])
 
-    # MARKET[security]['bids'] = bids
-    # MARKET[security]['asks'] = asks
-    #
-    a_mn = mean(asks)
-    b_mn = mean(bids)
+    book = MARKET[security]['book']
+    book.update(msg['market_state']['bids'], msg['market_state']['asks'])
 
-    a_min = min(asks)
-    a_max = max(asks)
-    b_min = min(bids)
-    b_max = max(bids)
-
-    MARKET[security]['mn_ask'] = a_mn
-    MARKET[security]['min_ask'] = a_min
-    MARKET[security]['max_ask'] = a_max
-    MARKET[security]['mn_bid'] = b_mn
-    MARKET[security]['min_bid'] = b_min
-    MARKET[security]['max_bid'] = b_max
-    MARKET[security]['spreads'].append(a_mn - b_mn)
+    if book.prices['bid'] and book.prices['ask']:
+        MARKET[security]['spreads'].append(book.spread, session_time())
+    ARBS.update_book(security, book)
+    with latency.stage('arbitrage'):
+        trade_arbitrage()
 
 
 
     #print("bids: ", MARKET[security]['bids'])
     #print("asks: ", MARKET[security]['asks'])
     if security != "TMXFUT":
-        try:
-            MARKET[security]['cur_iv'] = iv(MARKET[security]['cur_price'], 100, MARKET[security]['strike'], INTEREST_RATE, exp_time(), MARKET[security]['type'])
-            MARKET[security]['ivs'].append(MARKET[security]['cur_iv'])
-        except:
-            MARKET[security]['cur_iv'] = 0
-            MARKET[security]['ivs'].append(MARKET[security]['cur_iv'])
-            #print(security)
+        with latency.stage('iv'):
+            update_ivs((security,))
+        with latency.stage('smile'):
+            update_smile()
 
         # if security != "TMXFUT":
         #     MARKET[security]['ivs'].append(MARKET[security]['cur_iv'])
         # print(MARKET[security]['prices'])
         # print(MARKET[security]['ivs'])
-    # plot_vol('c')
+
+    # revalue the book on every tick and hedge delta with the future
+    with latency.stage('risk'):
+        update_greeks()
+        hedge()
+    ORDERS.flush(order)
 
 
 # Updates market and portfolio state after each trade
 def trade_method(msg, order):
     global MARKET
+    CLOCK.observe(msg)
     print('TRADE')
     trade_dict = msg['trades']
+    updated = set()
     for trade in trade_dict:
         security = trade["ticker"]
-        MARKET[security]['cur_price'] = trade["price"]
-        MARKET[security]['prices'].append(MARKET[security]['cur_price'])
+        add_price(security, trade["price"])
         #security['price'].append(trade["price"])
-        # security['vol'] = calc_vol(security['type'] == 'C', trade['price'], 100, security['strike'], exp_time(), INTEREST_RATE)
-
-        # still some weird errors with IV calculation
         if security != "TMXFUT":
-            try:
-                MARKET[security]['cur_iv'] = iv(MARKET[security]['cur_price'], 100, MARKET[security]['strike'], INTEREST_RATE, exp_time(), MARKET[security]['type'])
-                MARKET[security]['ivs'].append(MARKET[security]['cur_iv'])
-            except:
-                MARKET[security]['cur_iv'] = 0
-                MARKET[security]['ivs'].append(MARKET[security]['cur_iv'])
-                #print(security, MARKET[security]['cur_price'], MARKET[security]['strike'], exp_time(), MARKET[security]['cur_iv']);
+            updated.add(security)
+
+    # one solve for every option that traded in this message
+    if updated:
+        with latency.stage('iv'):
+            update_ivs(updated)
+    for security, quant, price in ORDERS.on_trade(msg):
+        RISK.on_fill(security, quant)
+    sync_portfolio()
     #print(MARKET['T89C'])
 
+# Tracks which of our orders the server accepted and which cancels went through
+def ack_modify_orders_method(msg, order):
+    ORDERS.on_ack(msg)
+
+# Takes positions, open orders, cash and PnL from the server's trader_state
+def reconcile(msg):
+    ORDERS.on_trader_update(msg)
+    PORTFOLIO['money'] = sum(msg['trader_state'].get('cash', {}).values())
+    PORTFOLIO['pnl'] = sum(msg['trader_state'].get('pnl', {}).values())
+    RISK.set_positions(ORDERS.positions)
+
 # Buy and sell here
 def trader_update_method(msg, order):
     global MARKET
+    CLOCK.observe(msg)
     print('TRADER UPDATE\n')
 
-    bb_strategy(order)
+    reconcile(msg)
+    with latency.stage('greeks'):
+        update_greeks()
+    with latency.stage('scenarios'):
+        update_scenarios()
+    with latency.stage('bb_strategy'):
+        bb_strategy(order)
     #make_market(order)
+    ORDERS.flush(order)
+    with latency.stage('snapshot'):
+        publish_snapshot()
+    with latency.stage('checkpoint'):
+        save_checkpoint()
 
 
         # Basic trading strategies to test program (some bugs to fix)
 
-        # if security != "TMXFUT" and MARKET[security]['cur_iv'] < 0.8 * mean(MARKET[security]['ivs']):
+        # if security != "TMXFUT" and MARKET[security]['cur_iv'] < 0.8 * MARKET[security]['ivs'].mean:
         #     print("BUY (IV) ", security, ": 10 @", MARKET[security]['cur_price'])
         #     order.addBuy(security, quantity=10, price=MARKET[security]['cur_price'])
-        # elif security != "TMXFUT" and MARKET[security]['cur_iv'] > 1.25 * mean(MARKET[security]['ivs']):
+        # elif security != "TMXFUT" and MARKET[security]['cur_iv'] > 1.25 * MARKET[security]['ivs'].mean:
         #     print("SELL (IV) ", security, ": 10 @", MARKET[security]['cur_price'])
         #     order.addSell(security, quantity=10, price=MARKET[security]['cur_price'])
         #
@@ -365,10 +641,36 @@ def trader_update_method(msg, order):
         #     print("SELL (AVG) ", security, ": 10 @", MARKET[security]['cur_price'])
         #     order.addSell(security, quantity=10, price=MARKET[security]['cur_price'])
 
-t.onAckRegister = ack_register_method
-t.onMarketUpdate = market_update_method
-t.onTraderUpdate = trader_update_method
-t.onTrade = trade_method
-#t.onAckModifyOrders = ack_modify_orders_method
-#t.onNews = news_method
-t.run()
+# Hooks the callbacks up to a TradersBot (or the backtester's stand-in)
+def attach(t):
+    t.onAckRegister = ack_register_method
+    t.onMarketUpdate = market_update_method
+    t.onTraderUpdate = trader_update_method
+    t.onTrade = trade_method
+    t.onAckModifyOrders = ack_modify_orders_method
+    #t.onNews = news_method
+
+if __name__ == '__main__':
+    from tradersbot import TradersBot
+    import conflation
+    import recorder
+    t = TradersBot(host=sys.argv[1], id=sys.argv[2], password=sys.argv[3])
+    attach(t)
+    enabled, path = latency.profile_setting(os.environ.get('BOT_PROFILE'))
+    if enabled:
+        latency.enable(t, path)
+    # BOT_CONFLATE=1 runs the strategy on a worker thread on the latest market snapshot
+    if os.environ.get('BOT_CONFLATE', '0') != '0':
+        conflation.Conflator(t)
+    # scenarios run on a process pool next to the bot (BOT_SCENARIOS=0 turns them off)
+    SCENARIO_RISK = os.environ.get('BOT_SCENARIOS', '1') != '0'
+    SCENARIO_WORKERS = None
+    # BOT_SNAPSHOT=<name> publishes the bot's state to shared memory for dashboard.py
+    SNAPSHOT_NAME = os.environ.get('BOT_SNAPSHOT')
+    # BOT_CHECKPOINT=<file> checkpoints the bot's state there and restores it on restart
+    CHECKPOINT_PATH = os.environ.get('BOT_CHECKPOINT')
+    # BOT_RECORD=<dir> records every message and order of the session (see recorder.py)
+    if os.environ.get('BOT_RECORD'):
+        recorder.Recorder(recorder.session_path(os.environ['BOT_RECORD'])).wrap(t)
+    t.run()
+
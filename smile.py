@@ -0,0 +1,63 @@
+import numpy as np
+from bs_chain import chain_greeks
+
+# Volatility smile fitted to the chain's current IVs.
+# The smile is a quadratic in log-moneyness, vol = a + b*x + c*x^2 with
+# x = ln(K/S), fitted by weighted least squares. Each fit is pulled towards the
+# previous tick's coefficients (a ridge penalty of strength `stiffness`), which
+# warm-starts it and keeps one noisy quote from throwing the curve around. A fit
+# is a 3x3 solve, so it can run on every market update.
+class SmileModel:
+    def __init__(self, strikes, stiffness=1e-2, min_points=3):
+        self.strikes = np.asarray(strikes, dtype=float)
+        self.stiffness = stiffness
+        self.min_points = min_points
+        self.coef = None
+        self.fair = np.full(self.strikes.size, np.nan)
+        self.richness = np.full(self.strikes.size, np.nan)
+
+    @property
+    def fitted(self):
+        return self.coef is not None
+
+    def design(self, S):
+        x = np.log(self.strikes / S)
+        return np.stack([np.ones_like(x), x, x * x], axis=1)
+
+    # Refits the smile to ivs (nan for strikes without a usable IV) and updates fair vols and richness.
+    # weights default to equal; passing vegas fits the curve in price rather than vol terms.
+    def fit(self, ivs, S, weights=None):
+        ivs = np.asarray(ivs, dtype=float)
+        A = self.design(S)
+        ok = np.isfinite(ivs) & (ivs > 0)
+        if weights is not None:
+            ok &= np.asarray(weights) > 0
+        if ok.sum() >= self.min_points:
+            w = np.ones(ok.sum()) if weights is None else np.asarray(weights, dtype=float)[ok]
+            w = w / w.mean()
+            Aw = A[ok] * w[:, None]
+            lhs = Aw.T @ A[ok]
+            rhs = Aw.T @ ivs[ok]
+            if self.coef is not None:
+                lhs = lhs + self.stiffness * np.eye(3)
+                rhs = rhs + self.stiffness * self.coef
+            try:
+                self.coef = np.linalg.solve(lhs, rhs)
+            except np.linalg.LinAlgError:
+                pass
+        if self.coef is not None:
+            self.fair = A @ self.coef
+            self.richness = ivs - self.fair
+        return self.fair
+
+    # Fair vol for arbitrary strikes
+    def fair_vol(self, strikes, S):
+        if self.coef is None:
+            return np.full(np.shape(strikes), np.nan)
+        x = np.log(np.asarray(strikes, dtype=float) / S)
+        return self.coef[0] + self.coef[1] * x + self.coef[2] * x * x
+
+    # Fair price of every option in the chain at the smile's vols
+    def fair_price(self, calls, S, T, r):
+        price, _, _, _ = chain_greeks(calls, S, self.strikes, T, r, self.fair)
+        return price
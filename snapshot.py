@@ -0,0 +1,117 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# Bot state published to a shared-memory segment for out-of-process monitoring.
+# The segment holds a small header, one summary record (time, spot, PnL,
+# position Greeks) and one row per security (price, IV, fair vol, Greeks,
+# position, Bollinger bands). Its layout is fixed by the dtypes below and the
+# row count in the header.
+#
+# Writes are guarded by a sequence lock. The writer makes the sequence
+# number odd, updates the segment in place, then makes it even again. A
+# reader copies the segment out and keeps the copy only if the sequence was
+# the same even number before and after. So readers never see a half-written
+# update, and the writer never waits for them. Publishing is a few array
+# copies, and the bot never blocks on the dashboard (dashboard.py).
+
+MAGIC = 0x534e4150
+HEADER = np.dtype([('magic', 'u4'), ('rows', 'u4'), ('seq', 'u8')])
+SUMMARY = np.dtype([('wall', 'f8'), ('elapsed', 'f8'), ('spot', 'f8'), ('pnl', 'f8'), ('cash', 'f8'),
+                    ('delta', 'f8'), ('gamma', 'f8'), ('vega', 'f8')])
+ROW = np.dtype([('ticker', 'S16'), ('strike', 'f8'), ('call', 'i1'), ('price', 'f8'), ('iv', 'f8'),
+                ('fair_vol', 'f8'), ('fair_price', 'f8'), ('delta', 'f8'), ('gamma', 'f8'), ('vega', 'f8'),
+                ('position', 'f8'), ('band_lower', 'f8'), ('band_mean', 'f8'), ('band_upper', 'f8')])
+
+def segment_size(rows):
+    return HEADER.itemsize + SUMMARY.itemsize + rows * ROW.itemsize
+
+# Structured views of the header, summary and rows in a segment's buffer
+def views(buf, rows):
+    header = np.ndarray((), HEADER, buf, 0)
+    summary = np.ndarray((), SUMMARY, buf, HEADER.itemsize)
+    table = np.ndarray((rows,), ROW, buf, HEADER.itemsize + SUMMARY.itemsize)
+    return header, summary, table
+
+class SnapshotWriter:
+    # Creates the segment `name` with a row per ticker (replacing a stale one left by a crashed run)
+    def __init__(self, name, tickers, strikes=None, calls=None):
+        self.name = name
+        size = segment_size(len(tickers))
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.header, self.summary, self.rows = views(self.shm.buf, len(tickers))
+        self.rows[...] = np.zeros((), ROW)
+        for field in ROW.names[3:]:
+            self.rows[field] = np.nan
+        self.rows['ticker'] = [ticker.encode() for ticker in tickers]
+        if strikes is not None:
+            self.rows['strike'] = strikes
+        if calls is not None:
+            self.rows['call'] = calls
+        self.summary[...] = tuple([np.nan] * len(SUMMARY.names))
+        self.header['rows'] = len(tickers)
+        self.header['seq'] = 0
+        self.header['magic'] = MAGIC
+        self.published = 0
+
+    # Writes one update: summary fields as keywords, row columns as a dict of arrays
+    # aligned with the tickers (missing columns keep their last values)
+    def publish(self, columns, **summary):
+        self.header['seq'] += 1
+        for field, value in summary.items():
+            self.summary[field] = value
+        self.summary['wall'] = time.time()
+        for field, values in columns.items():
+            self.rows[field] = values
+        self.header['seq'] += 1
+        self.published += 1
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.header = self.summary = self.rows = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            # another writer took the name over
+            pass
+        self.shm = None
+
+class SnapshotReader:
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name)
+        # the writer owns the segment: keep this process's tracker from unlinking it at exit
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        header = np.ndarray((), HEADER, self.shm.buf, 0)
+        if header['magic'] != MAGIC:
+            self.shm.close()
+            raise ValueError("%s is not a bot snapshot" % name)
+        self.header, self.summary, self.rows = views(self.shm.buf, int(header['rows']))
+        self.seq = 0
+
+    # (seq, summary, rows) copies of a consistent update, or None if nothing new was
+    # published since the last read (or the writer stayed busy for all attempts)
+    def read(self, attempts=100):
+        for _ in range(attempts):
+            before = int(self.header['seq'])
+            if before & 1:
+                continue
+            if before == self.seq:
+                return None
+            summary = self.summary.copy()
+            rows = self.rows.copy()
+            if int(self.header['seq']) == before:
+                self.seq = before
+                return before, summary, rows
+        return None
+
+    def close(self):
+        self.header = self.summary = self.rows = None
+        self.shm.close()
@@ -0,0 +1,209 @@
+import sys
+import os
+import atexit
+from history import RingBuffer
+from news_model import NewsModel
+from rolling import RollingBands
+from runtime import Runtime, Strategy
+from shen_wang_options import WINDOW, IV_LOW, IV_HIGH, BAND_LOW_TOL, BAND_HIGH_TOL, MM_SPREAD_MULT, MM_DEPTH, ORDER_QUANT
+from shen_wang_algost import NEWS_QUANT, NEWS_LAG, NEWS_REESTIMATE_PERIOD, C, LIQUIDATION_TIME, news_side, news_orders, unwind_size
+import latency
+import conflation
+import recorder
+
+# The bots' strategies on the shared runtime (runtime.py): any mix of them runs on one
+# connection and one market state, each with its own positions and budget.
+# - bollinger: shen_wang_options' bb_strategy (Bollinger bands on price, IV
+#   against the option's mean IV)
+# - spread: shen_wang_options' make_market (quotes inside unusually wide
+#   spreads)
+# - news: shen_wang_algost's news strategy (trades DARK against LIT on news,
+#   weighted by each source's learned impact, unwinds before the end)
+# A strategy whose securities are not in the case stays idle, so the same
+# set runs on either case. Their constants and the news logic are the bots'
+# own, imported from them.
+#
+# Usage: python strategies.py <host> <id> <password>
+#        python backtest.py strategies.py <case.json>
+# BOT_STRATEGIES=bollinger,news picks the strategies to run.
+
+# Budgets and the run's strategies; these and the imported constants are overridable per run by
+# backtest.py / sweep.py
+STRATEGIES = 'bollinger,spread,news'
+OPTION_LIMIT = 500
+OPTION_GROSS = 5000
+NEWS_LIMIT = 5000
+HISTORY_LEN = 1024
+# CPU seconds each strategy may use per case second, on average: a hook the strategy cannot afford is
+# skipped, one already running is never cut short (see runtime.py)
+CPU_BUDGET = 0.1
+
+# The shared runtime, built on attach
+RUNTIME = None
+
+# Buys an option whose price drops through its lower band while its IV is well below its mean IV,
+# sells one breaking its upper band with a rich IV, a little away from the last price. The bands
+# (rolling.py) take in the prices recorded since the last pass
+class BollingerStrategy(Strategy):
+    def __init__(self, **budget):
+        super().__init__('bollinger', **budget)
+        self.bands = {}
+        self.seen = {}
+
+    def on_register(self, market):
+        self.bands = {ticker: RollingBands(WINDOW) for ticker in market.chain['tickers']}
+        self.seen = {ticker: market.prices[ticker].count for ticker in market.chain['tickers']}
+
+    # Rolls a ticker's bands over the prices recorded since they were last rolled
+    def roll(self, market, ticker):
+        history = market.prices[ticker]
+        bands = self.bands[ticker]
+        # the bands only depend on the last WINDOW + 1 prices
+        for price in history.view(min(history.count - self.seen[ticker], WINDOW + 1)):
+            bands.update(price)
+        self.seen[ticker] = history.count
+        return bands
+
+    def on_trader_update(self, market):
+        if not market.chain['tickers']:
+            return
+        ivs = market.ivs()
+        for i, ticker in enumerate(market.chain['tickers']):
+            bands = self.roll(market, ticker)
+            prices = market.prices[ticker].view(2)
+            history = market.iv_history[ticker]
+            if market.prices[ticker].size <= WINDOW or not len(history):
+                continue
+            lower, upper, prev_lower, prev_upper = bands.lower, bands.upper, bands.prev_lower, bands.prev_upper
+            price = market.price[ticker]
+            time_val = price - market.intrinsic(ticker)
+            if time_val <= 0:
+                continue
+            time_val = max(0.1 * time_val, 0.5)
+            if ivs[i] < IV_LOW * history.mean and prices[-1] < lower and prices[-2] > prev_lower * BAND_LOW_TOL:
+                self.buy(ticker, ORDER_QUANT, round(price - time_val, 2))
+            elif ivs[i] > IV_HIGH * history.mean and prices[-1] > upper and prices[-2] < prev_upper * BAND_HIGH_TOL:
+                self.sell(ticker, ORDER_QUANT, round(price + time_val, 2))
+
+# Quotes both sides of an option when its spread is MM_SPREAD_MULT times its mean width, each at the
+# average price of the size resting ahead of MM_DEPTH times the quote (shen_wang_options' make_market)
+class SpreadStrategy(Strategy):
+    def __init__(self, **budget):
+        super().__init__('spread', **budget)
+        self.spreads = {}
+
+    def on_register(self, market):
+        self.spreads = {ticker: RingBuffer(HISTORY_LEN) for ticker in market.chain['tickers']}
+
+    def on_market_update(self, market, ticker):
+        spreads = self.spreads.get(ticker)
+        book = market.books[ticker]
+        if spreads is not None and book.prices['bid'] and book.prices['ask']:
+            spreads.append(book.spread, market.clock.elapsed)
+
+    def on_trader_update(self, market):
+        for ticker, spreads in self.spreads.items():
+            if not len(spreads) or spreads.last <= spreads.mean * MM_SPREAD_MULT:
+                continue
+            book = market.books[ticker]
+            if not (book.prices['bid'] and book.prices['ask']):
+                continue
+            bid = book.depth('bid', MM_DEPTH * ORDER_QUANT)[1]
+            ask = book.depth('ask', MM_DEPTH * ORDER_QUANT)[1]
+            if bid > market.intrinsic(ticker):
+                self.buy(ticker, ORDER_QUANT, round(bid - 0.3, 2))
+                self.sell(ticker, ORDER_QUANT, round(ask, 2))
+
+# Trades the dark pool against the lit market on news of a source buying or selling, by the
+# source's learned impact (news_model.py), and works the position back to flat near the end
+class NewsStrategy(Strategy):
+    def __init__(self, **budget):
+        super().__init__('news', **budget)
+        self.model = None
+        self.history = []
+        self.reestimated = 0
+
+    def on_register(self, market):
+        if 'TRDRS.LIT' in market.price and 'TRDRS.DARK' in market.price:
+            self.model = NewsModel(market.meta.get('news_sources', {}).keys(), C, lag=NEWS_LAG)
+            self.history = []
+            self.reestimated = market.clock.elapsed
+
+    def on_market_update(self, market, ticker):
+        if self.model is not None and ticker == 'TRDRS.LIT':
+            self.model.evaluate(market.clock.elapsed, market.price[ticker])
+
+    def on_trader_update(self, market):
+        if self.model is None:
+            return
+        self.cancel(predicate=lambda o: o['buy'] and o['price'] is not None and o['price'] > market.price[o['ticker']])
+        if market.clock.case_length - market.clock.elapsed < LIQUIDATION_TIME:
+            self.unwind(market, 'TRDRS.DARK')
+            self.unwind(market, 'TRDRS.LIT')
+        # re-measures every news item so far at the LIT price standing at its due time
+        if market.clock.elapsed - self.reestimated >= NEWS_REESTIMATE_PERIOD:
+            self.reestimated = market.clock.elapsed
+            lit = market.prices['TRDRS.LIT']
+            self.model.reestimate(self.history, lit.time_view(), lit.view())
+
+    # One maximum size order towards flat on top of what is already working
+    def unwind(self, market, ticker):
+        size = unwind_size(self.position(ticker), self.working(ticker, True), self.working(ticker, False),
+                           self.runtime.orders.max_size.get(ticker, 1000))
+        if size is not None:
+            (self.buy if size[0] else self.sell)(ticker, size[1], market.price[ticker])
+
+    def on_news(self, market, news):
+        if self.model is None:
+            return
+        source, amount, time, headline = news['source'], int(news['body']), int(news['time']), news['headline']
+        if market.clock.case_length - time < LIQUIDATION_TIME:
+            return
+        buy = news_side(headline)
+        lit = market.price['TRDRS.LIT']
+        for ticker, side, quant, price in news_orders(self.model, source, amount, buy, market.price['TRDRS.DARK'], lit,
+                                                      NEWS_QUANT):
+            (self.buy if side else self.sell)(ticker, quant, price)
+        self.model.push(source, amount, buy, time, lit)
+        self.history.append([source, amount, 'buy' if buy else 'sell', time, lit])
+
+def make_strategies(names):
+    makers = {
+        'bollinger': lambda: BollingerStrategy(limit=OPTION_LIMIT, max_gross=OPTION_GROSS),
+        'spread': lambda: SpreadStrategy(limit=OPTION_LIMIT, max_gross=OPTION_GROSS),
+        'news': lambda: NewsStrategy(limit=NEWS_LIMIT),
+    }
+    return [makers[name.strip()]() for name in names.split(',') if name.strip()]
+
+# Hooks a fresh runtime with the STRATEGIES up to a TradersBot (or the backtester's stand-in)
+def attach(t):
+    global RUNTIME
+    RUNTIME = Runtime(make_strategies(STRATEGIES), cpu=CPU_BUDGET)
+    RUNTIME.attach(t)
+
+# Prints each strategy's CPU use, throttling and positions
+def report():
+    if RUNTIME is None:
+        return
+    for name, stats in RUNTIME.report().items():
+        print("%-10s cpu %.3fs over %d calls (%.0f us mean), %d skipped, %d errors, rejected %s, positions %s" % (
+            name, stats['cpu_s'], stats['calls'], stats['mean_us'], stats['skipped'], stats['errors'],
+            stats['rejected'], stats['positions']))
+    print("%d shares crossed internally, %d intents merged into shared orders" % (RUNTIME.crossed, RUNTIME.netted))
+
+if __name__ == '__main__':
+    from tradersbot import TradersBot
+    STRATEGIES = os.environ.get('BOT_STRATEGIES', STRATEGIES)
+    t = TradersBot(host=sys.argv[1], id=sys.argv[2], password=sys.argv[3])
+    attach(t)
+    atexit.register(report)
+    enabled, path = latency.profile_setting(os.environ.get('BOT_PROFILE'))
+    if enabled:
+        latency.enable(t, path)
+    # BOT_CONFLATE=1 runs the strategies on a worker thread on the latest market snapshot
+    if os.environ.get('BOT_CONFLATE', '0') != '0':
+        conflation.Conflator(t)
+    # BOT_RECORD=<dir> records every message and order of the session (see recorder.py)
+    if os.environ.get('BOT_RECORD'):
+        recorder.Recorder(recorder.session_path(os.environ['BOT_RECORD'])).wrap(t)
+    t.run()
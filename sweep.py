@@ -0,0 +1,150 @@
+import sys
+import os
+import csv
+import glob
+import json
+import time
+import random
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import backtest
+
+# Parameter sweep over a bot's strategy constants, backtested on every core.
+# Each (parameter set, case file) pair is one backtest.run_session job run in a
+# process pool. Rows are appended to a CSV as jobs finish, so an interrupted
+# sweep resumes where it stopped when run again with the same --out file.
+#
+# Grid search (every combination):
+#   python sweep.py shen_wang_algost.py --cases "AlgoS&T/sample_*.json" \
+#       --param C=0.00002,0.00004,0.00008 --param LIQUIDATION_TIME=60,90,120
+# Random search (values drawn from lists or lo:hi ranges):
+#   python sweep.py shen_wang_options.py --cases "cases/*.json" --random 200 \
+#       --param WINDOW=5,10,20 --param IV_LOW=0.6:0.95 --param IV_HIGH=1.05:1.5
+
+STATS = ['pnl', 'max_drawdown', 'fills', 'volume', 'orders', 'cancels', 'rejected', 'errors', 'fees', 'fines', 'seconds']
+
+# Parses one value: int if it looks like one, else float, else the raw string
+def parse_value(text):
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+# Parses NAME=a,b,c (choices) or NAME=lo:hi (range, random search only)
+def parse_param(spec):
+    name, _, values = spec.partition('=')
+    if not name or not values:
+        raise ValueError("Bad parameter %r, expected NAME=a,b,c or NAME=lo:hi" % spec)
+    if ':' in values:
+        lo, hi = values.split(':')
+        return name, (parse_value(lo), parse_value(hi))
+    return name, [parse_value(v) for v in values.split(',')]
+
+# Every combination of the parameter choices
+def grid(params):
+    names = sorted(params)
+    for name in names:
+        if isinstance(params[name], tuple):
+            raise ValueError("Range %s=lo:hi needs --random; give a list of values for a grid" % name)
+    for values in itertools.product(*(params[name] for name in names)):
+        yield dict(zip(names, values))
+
+# n random parameter sets; ranges of ints draw ints, other ranges draw floats
+def random_search(params, n, seed):
+    rng = random.Random(seed)
+    for _ in range(n):
+        point = {}
+        for name in sorted(params):
+            choices = params[name]
+            if isinstance(choices, tuple):
+                lo, hi = choices
+                point[name] = rng.randint(lo, hi) if isinstance(lo, int) and isinstance(hi, int) else rng.uniform(lo, hi)
+            else:
+                point[name] = rng.choice(choices)
+        yield point
+
+# Identifies a job in the results file
+def job_key(params, case_path):
+    return json.dumps([params, case_path], sort_keys=True)
+
+# Runs one backtest in a worker process and flattens its result into a row
+def run_job(bot_path, case_path, params):
+    start = time.time()
+    result = backtest.run_session(bot_path, case_path, params)
+    row = {name: result.get(name) for name in STATS}
+    row['seconds'] = time.time() - start
+    row['case'] = case_path
+    row['params'] = json.dumps(params, sort_keys=True)
+    row.update(params)
+    return row
+
+# Keys of the jobs already in the results file
+def load_done(out_path):
+    if not os.path.exists(out_path):
+        return set()
+    with open(out_path, newline='') as f:
+        return {job_key(json.loads(row['params']), row['case']) for row in csv.DictReader(f)}
+
+# Mean of each stat per parameter set, best mean PnL first
+def summarize(out_path, top=10):
+    rows = {}
+    with open(out_path, newline='') as f:
+        for row in csv.DictReader(f):
+            rows.setdefault(row['params'], []).append(row)
+    summary = []
+    for params, runs in rows.items():
+        mean = lambda name: sum(float(r[name]) for r in runs) / len(runs)
+        summary.append((mean('pnl'), mean('max_drawdown'), mean('fills'), len(runs), params))
+    summary.sort(reverse=True)
+    print("%12s %12s %8s %5s  params" % ('mean pnl', 'drawdown', 'fills', 'cases'))
+    for pnl, drawdown, fills, n, params in summary[:top]:
+        print("%12.2f %12.2f %8.1f %5d  %s" % (pnl, drawdown, fills, n, params))
+    return summary
+
+def sweep(bot_path, case_paths, points, out_path, workers=None):
+    points = list(points)
+    names = sorted({name for point in points for name in point})
+    done = load_done(out_path)
+    jobs = [(point, case) for point in points for case in case_paths if job_key(point, case) not in done]
+    print("%d jobs (%d already done), %d workers" % (len(jobs), len(points) * len(case_paths) - len(jobs), workers or os.cpu_count()))
+    if not jobs:
+        return
+
+    new_file = not os.path.exists(out_path)
+    with open(out_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['case', 'params'] + names + STATS)
+        if new_file:
+            writer.writeheader()
+        # import the bot's dependencies once here, so forked workers start with them loaded
+        backtest.load_bot(bot_path)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_job, bot_path, case, point) for point, case in jobs]
+            for i, future in enumerate(as_completed(futures)):
+                writer.writerow(future.result())
+                f.flush()
+                if (i + 1) % 50 == 0 or i + 1 == len(futures):
+                    print("%d/%d done" % (i + 1, len(futures)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest a bot over a grid or random sample of its strategy constants")
+    parser.add_argument('bot')
+    parser.add_argument('--cases', action='append', required=True, help="case file or glob (repeatable)")
+    parser.add_argument('--param', action='append', default=[], help="NAME=a,b,c or NAME=lo:hi (repeatable)")
+    parser.add_argument('--random', type=int, default=0, help="number of random parameter sets instead of a grid")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    case_paths = sorted({path for pattern in args.cases for path in glob.glob(pattern)})
+    if not case_paths:
+        print("No case files match", args.cases)
+        sys.exit(1)
+    params = dict(parse_param(spec) for spec in args.param)
+    points = random_search(params, args.random, args.seed) if args.random else grid(params)
+    sweep(args.bot, case_paths, points, args.out, args.workers)
+    summarize(args.out)
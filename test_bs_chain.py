@@ -0,0 +1,51 @@
+import math
+import numpy as np
+from bs_chain import chain_greeks
+
+S, r = 100., 0.01
+K = np.array([80., 90., 100., 110., 120.])
+T, SIG = 0.25, 0.3
+
+# Black-Scholes call in plain floats
+def bs_call(S, K, T, r, sig):
+    d1 = (math.log(S / K) + (r + sig * sig / 2) * T) / (sig * math.sqrt(T))
+    d2 = d1 - sig * math.sqrt(T)
+    return 0.5 * math.erfc(-d1 / math.sqrt(2)) * S - 0.5 * math.erfc(-d2 / math.sqrt(2)) * K * math.exp(-r * T)
+
+def test_prices_match_closed_form_and_parity():
+    calls, _, _, _ = chain_greeks(True, S, K, T, r, SIG)
+    puts, _, _, _ = chain_greeks(False, S, K, T, r, SIG)
+    assert np.allclose(calls, [bs_call(S, k, T, r, SIG) for k in K], rtol=0, atol=1e-10)
+    assert np.allclose(calls - puts, S - K * math.exp(-r * T), rtol=0, atol=1e-10)
+
+# Delta, gamma and vega against central differences of the price
+def test_greeks_match_finite_differences():
+    h = 1e-4
+    for call in (True, False):
+        price, delta, gamma, vega = chain_greeks(call, S, K, T, r, SIG)
+        up, _, _, _ = chain_greeks(call, S + h, K, T, r, SIG)
+        down, _, _, _ = chain_greeks(call, S - h, K, T, r, SIG)
+        vol_up, _, _, _ = chain_greeks(call, S, K, T, r, SIG + h)
+        vol_down, _, _, _ = chain_greeks(call, S, K, T, r, SIG - h)
+        assert np.allclose(delta, (up - down) / (2 * h), atol=1e-6)
+        assert np.allclose(gamma, (up - 2 * price + down) / h ** 2, atol=1e-4)
+        assert np.allclose(vega, (vol_up - vol_down) / (2 * h), atol=1e-5)
+
+# A mixed chain prices each option by its own type, strike and vol
+def test_mixed_chain_matches_single_calls():
+    call = np.array([True, False, True, False, True])
+    sig = np.linspace(0.2, 0.4, len(K))
+    chain = chain_greeks(call, S, K, T, r, sig)
+    for i in range(len(K)):
+        single = chain_greeks(call[i], S, K[i], T, r, sig[i])
+        assert np.allclose([g[i] for g in chain], [float(g) for g in single])
+
+def test_expired_and_zero_vol_are_intrinsic():
+    for T_left, sig in ((0., SIG), (-1., SIG), (T, 0.)):
+        disc = math.exp(-r * max(T_left, 0.))
+        calls, delta, gamma, vega = chain_greeks(True, S, K, T_left, r, sig)
+        puts, _, _, _ = chain_greeks(False, S, K, T_left, r, sig)
+        assert np.allclose(calls, np.maximum(S - K * disc, 0.))
+        assert np.allclose(puts, np.maximum(K * disc - S, 0.))
+        assert np.array_equal(delta, (S > K * disc) * 1.)
+        assert not gamma.any() and not vega.any()
@@ -0,0 +1,81 @@
+import time
+import threading
+from conflation import Conflator
+from backtest import SimBot, SimOrder
+
+# Polls until cond() holds, for the worker thread to catch up
+def wait_for(cond, timeout=5.):
+    end = time.time() + timeout
+    while not cond():
+        assert time.time() < end, 'worker did not catch up'
+        time.sleep(0.001)
+
+def market_update(ticker, price):
+    return {'message_type': 'MARKET UPDATE', 'market_state': {'ticker': ticker, 'last_price': price}}
+
+# A bot whose callbacks log what they see; register blocks until released, so messages pile up behind it
+def logging_bot(release):
+    seen = []
+    t = SimBot()
+    def register(msg, order):
+        release.wait(5)
+        seen.append(('register', None))
+    t.onAckRegister = register
+    t.onMarketUpdate = lambda msg, order: seen.append((msg['market_state']['ticker'], msg['market_state']['last_price']))
+    t.onTraderUpdate = lambda msg, order: seen.append(('trader', msg['n']))
+    t.onTrade = lambda msg, order: seen.append(('trade', msg['n']))
+    t.onNews = lambda msg, order: seen.append(('news', msg['n']))
+    return t, seen
+
+# Queued events are all replayed, snapshots only at their newest, everything in arrival order
+def test_replays_in_arrival_order():
+    release = threading.Event()
+    t, seen = logging_bot(release)
+    c = Conflator(t)
+    try:
+        t.onAckRegister({}, SimOrder())
+        wait_for(lambda: not c.events)
+        for callback, msg in ((t.onMarketUpdate, market_update('A', 1)), (t.onMarketUpdate, market_update('B', 1)),
+                              (t.onTraderUpdate, {'n': 1}), (t.onTrade, {'n': 1}),
+                              (t.onMarketUpdate, market_update('A', 2)), (t.onTraderUpdate, {'n': 2}),
+                              (t.onNews, {'n': 1}), (t.onTrade, {'n': 2})):
+            callback(msg, SimOrder())
+        release.set()
+        wait_for(lambda: len(seen) == 7)
+        assert seen == [('register', None), ('B', 1), ('trade', 1), ('A', 2), ('trader', 2), ('news', 1),
+                        ('trade', 2)]
+    finally:
+        c.stop()
+
+# Orders a callback makes on the worker go out with the next callback or periodic flush on the IO side
+def test_orders_leave_on_next_flush():
+    t = SimBot()
+    t.onMarketUpdate = lambda msg, order: order.addBuy(msg['market_state']['ticker'], 10, 1.5, token='t')
+    t.onNews = lambda msg, order: order.addCancel('A', 'o1')
+    c = Conflator(t)
+    try:
+        t.onMarketUpdate(market_update('A', 1), SimOrder())
+        t.onNews({}, SimOrder())
+        wait_for(lambda: len(c.outbox) == 2)
+        order = SimOrder()
+        c.flush(order)
+        assert order.orders == [{'ticker': 'A', 'buy': True, 'quantity': 10, 'price': 1.5, 'token': 't'}]
+        assert order.cancels == [{'ticker': 'A', 'order_id': 'o1'}]
+        assert not c.outbox
+    finally:
+        c.stop()
+
+# A callback that raises is reported and the worker carries on
+def test_worker_survives_errors(capsys):
+    seen = []
+    t = SimBot()
+    t.onTrade = lambda msg, order: 1 / 0
+    t.onNews = lambda msg, order: seen.append(msg)
+    c = Conflator(t)
+    try:
+        t.onTrade({}, SimOrder())
+        t.onNews({'n': 1}, SimOrder())
+        wait_for(lambda: seen)
+    finally:
+        c.stop()
+    assert 'ZeroDivisionError' in capsys.readouterr().err
@@ -0,0 +1,47 @@
+import math
+import pickle
+import numpy as np
+from history import RingBuffer
+
+# The view always holds the latest values oldest first, as one contiguous slice, across wrap-arounds
+def test_view_follows_appends():
+    buf = RingBuffer(5)
+    appended = []
+    for i in range(23):
+        buf.append(i * 1.5, t=i)
+        appended.append(i * 1.5)
+        assert list(buf.view()) == appended[-5:]
+        assert list(buf.time_view()) == list(range(i + 1))[-5:]
+        assert list(buf.view(3)) == appended[-3:]
+        assert buf.last == appended[-1] and len(buf) == min(i + 1, 5)
+        assert buf.view().base is buf.data
+    assert list(buf) == appended[-5:] and buf[-1] == appended[-1]
+    assert buf.window_mean(2) == np.mean(appended[-2:])
+
+# count, mean, min and max cover everything appended, not just what is still held
+def test_aggregates_cover_all_appends():
+    buf = RingBuffer(3)
+    values = [4., -2., 9., 1., 0.5, 3.]
+    for x in values:
+        buf.append(x)
+    assert buf.count == len(values)
+    assert buf.mean == np.mean(values) and buf.min == -2. and buf.max == 9.
+
+def test_empty():
+    buf = RingBuffer(4)
+    assert math.isnan(buf.mean) and math.isnan(buf.last) and math.isnan(buf.window_mean(2))
+    assert len(buf) == 0 and buf.view().size == 0
+
+# A pickle keeps only the live values, and the restored buffer carries on wrapping the same way
+def test_pickle_round_trip():
+    buf = RingBuffer(4)
+    for i in range(6):
+        buf.append(float(i), t=10. + i)
+    copy = pickle.loads(pickle.dumps(buf))
+    assert list(copy.view()) == list(buf.view()) and list(copy.time_view()) == list(buf.time_view())
+    assert (copy.count, copy.mean, copy.min, copy.max) == (buf.count, buf.mean, buf.min, buf.max)
+    for i in range(6, 11):
+        buf.append(float(i), t=10. + i)
+        copy.append(float(i), t=10. + i)
+        assert list(copy.view()) == list(buf.view()) and copy.last == buf.last
+    assert len(pickle.dumps(RingBuffer(10000))) < 2000
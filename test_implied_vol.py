@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import implied_vol
+from bs_chain import chain_greeks
+from implied_vol import implied_vol_chain, NO_PRICE, EXPIRED, BELOW_INTRINSIC, ABOVE_MAX
+
+S, T, r = 100., 0.25, 0.01
+K = np.linspace(70., 130., 13)
+CALL = np.arange(len(K)) % 2 == 0
+SIG = np.linspace(0.15, 0.6, len(K))
+
+# Prices quoted at known vols solve back to those vols (to the price tolerance over vega), from cold
+# starts and from the previous vols, on the batched path and on the scalar path used for a few strikes
+@pytest.mark.parametrize('n', [len(K), implied_vol.SCALAR_MAX])
+@pytest.mark.parametrize('warm', [False, True])
+def test_round_trip(n, warm):
+    price, _, _, vega = chain_greeks(CALL[:n], S, K[:n], T, r, SIG[:n])
+    guess = SIG[:n] * 1.2 if warm else None
+    sig, reasons = implied_vol_chain(price, CALL[:n], S, K[:n], T, r, guess=guess)
+    assert reasons == [None] * n
+    solved, _, _, _ = chain_greeks(CALL[:n], S, K[:n], T, r, sig)
+    assert np.allclose(solved, price, rtol=0, atol=implied_vol.TOL)
+    assert (np.abs(sig - SIG[:n]) * vega <= 2 * implied_vol.TOL).all()
+
+# The scalar and batched paths agree strike by strike
+def test_scalar_matches_batch():
+    price, _, _, _ = chain_greeks(CALL, S, K, T, r, SIG)
+    batch, _ = implied_vol_chain(price, CALL, S, K, T, r)
+    for i in range(len(K)):
+        sig, reason = implied_vol.implied_vol(float(price[i]), bool(CALL[i]), S, float(K[i]), T, r)
+        assert reason is None
+        assert sig == pytest.approx(batch[i], abs=1e-5)
+
+# Unsolvable quotes come back as nan with the reason, without stopping the rest of the chain
+@pytest.mark.parametrize('n', [8, 4])
+def test_failure_reasons(n):
+    call = np.ones(n, dtype=bool)
+    strikes = np.full(n, 100.)
+    price, _, _, _ = chain_greeks(call, S, strikes, T, r, 0.3)
+    price[:4] = [np.nan, 0., 0.5 * max(S - 100. * np.exp(-r * T), 0.), S + 1]
+    sig, reasons = implied_vol_chain(price, call, S, strikes, T, r)
+    assert reasons == [NO_PRICE, NO_PRICE, BELOW_INTRINSIC, ABOVE_MAX] + [None] * (n - 4)
+    assert np.isnan(sig[:4]).all()
+    assert np.allclose(sig[4:], 0.3, atol=1e-4)
+
+@pytest.mark.parametrize('n', [8, 4])
+def test_expired(n):
+    sig, reasons = implied_vol_chain(np.full(n, 5.), np.ones(n, dtype=bool), S, np.full(n, 100.), 0., r)
+    assert reasons == [EXPIRED] * n and np.isnan(sig).all()
@@ -0,0 +1,54 @@
+import math
+import random
+import pytest
+import latency
+from latency import Histogram, Profiler
+from backtest import SimBot, SimOrder
+
+# Percentiles come back at most one bucket above the exact ones, and never past the max
+def test_histogram_percentiles():
+    rng = random.Random(5)
+    values = sorted(rng.lognormvariate(3, 1.5) for _ in range(5000))
+    h = Histogram()
+    for v in values:
+        h.record(v)
+    for p in latency.PERCENTILES:
+        exact = values[math.ceil(p / 100 * len(values)) - 1]
+        assert exact <= h.percentile(p) <= exact * 10 ** (1 / latency.BUCKETS_PER_DECADE) * 1.0001
+    assert h.percentile(100) == h.max == values[-1]
+    assert math.isnan(Histogram().percentile(50))
+
+# The server acks batches once and in order: each ack times the oldest batch still waiting, and the
+# messages that came in between are its backlog
+def test_round_trips_pair_acks_in_order():
+    p = Profiler()
+    p.acked(0.5, 1)
+    p.sent('MARKET UPDATE', 1., 3)
+    p.sent('TRADE', 2., 5)
+    p.acked(1.5, 6)
+    p.acked(2.25, 7)
+    rt = p.summary()['histograms']
+    assert rt['round_trip MARKET UPDATE']['max_us'] == pytest.approx(0.5e6)
+    assert rt['round_trip TRADE']['max_us'] == pytest.approx(0.25e6)
+    assert rt['backlog (messages)']['count'] == 2 and rt['backlog (messages)']['max_us'] == 2
+    assert not p.unacked
+    for i in range(latency.MAX_UNACKED + 10):
+        p.sent('NEWS', float(i))
+    assert len(p.unacked) == latency.MAX_UNACKED and p.unacked[0][2] == 10.
+
+# Wrapped callbacks time themselves; the batch TradersBot sends after a callback is timed to its ack
+def test_wrapped_callbacks():
+    t = SimBot()
+    t.onMarketUpdate = lambda msg, order: order.addBuy('X', 1, 10.)
+    t.onNews = lambda msg, order: None
+    t.onAckModifyOrders = lambda msg, order: None
+    p = Profiler()
+    p.wrap(t)
+    t.onNews({'message_type': 'NEWS'}, SimOrder())
+    assert not p.unacked
+    t.onMarketUpdate({'message_type': 'MARKET UPDATE', 'market_state': {}}, SimOrder())
+    assert [kind for kind, _, _ in p.unacked] == ['MARKET UPDATE']
+    t.onAckModifyOrders({'message_type': 'ACK MODIFY ORDERS'}, SimOrder())
+    names = set(p.summary()['histograms'])
+    assert {'callback onNews', 'callback onMarketUpdate', 'tick_to_send', 'round_trip MARKET UPDATE'} <= names
+    assert not p.unacked
@@ -0,0 +1,77 @@
+import pytest
+from matching import MatchingEngine, BOOK_LEVELS
+
+# Flat LIT path with a market maker, and a dark pool with one custom buyer live at ticks 2 and 3
+def case():
+    fees = {'fee_amount': 0.01, 'rebate_amount': 0.005, 'self_trading_fine_amount': 0.1,
+            'maximum_decimal_digits': 2, 'tradeable': True}
+    path = {'price': [100.] * 10, 'spread': [0.2] * 10, 'volume': [10] * 10, 'strictness': [0.5] * 10}
+    return {'securities': {
+                'LIT': dict(fees, dark=False, price_reaction=1000, pricepath=path),
+                'DARK': dict(fees, dark=True, price_reaction=0,
+                             pricepath={'price': [100.] * 10, 'spread': [0] * 10, 'volume': [0] * 10,
+                                        'strictness': [0] * 10})},
+            'custom_orders': [{'ticker': 'DARK', 'buy': True, 'price': 104., 'time': 2, 'duration': 2,
+                               'quantity': 1000}]}
+
+def order(order_id, ticker, buy, quant, price):
+    return {'order_id': order_id, 'ticker': ticker, 'buy': buy, 'quantity': quant, 'price': price}
+
+def fills_of(fills):
+    return [(f['order_id'], f['quantity'], f['price']) for f in fills]
+
+def test_market_maker_quotes():
+    engine = MatchingEngine(case())
+    engine.tick(0)
+    bids, asks = engine.book('LIT')
+    assert bids == {'%.2f' % (99.9 - i / 100): 10 for i in range(BOOK_LEVELS)}
+    assert asks == {'%.2f' % (100.1 + i / 100): 10 for i in range(BOOK_LEVELS)}
+    assert engine.book('DARK') == ({}, {})
+
+# A limit order takes the book up to its limit, pays the fee, moves the market maker by
+# quantity / price_reaction and rests the rest; the re-quote on the next tick crosses it as a maker
+def test_limit_order_crosses_then_rests():
+    engine = MatchingEngine(case())
+    engine.tick(0)
+    fills = engine.submit(order('o1', 'LIT', True, 25, 100.11))
+    assert fills_of(fills) == [('o1', 10, 100.1), ('o1', 10, 100.11)]
+    assert [f['fee'] for f in fills] == pytest.approx([0.1, 0.1])
+    assert engine.offset['LIT'] == pytest.approx(0.02)
+    assert engine.book('LIT')[0]['100.11'] == 5
+    assert engine.cancel('o2') is False
+    engine.tick(1)
+    assert engine.offset['LIT'] == pytest.approx(0.01)
+    resting = engine.match_resting()
+    assert fills_of(resting) == [('o1', 5, 100.11)]
+    assert resting[0]['fee'] == pytest.approx(-0.025)
+    assert 'o1' not in engine.orders and not engine.match_resting()
+
+# Orders at one price fill oldest first at the resting price; trading with ourselves is fined on the taker
+def test_price_time_priority_and_self_trades():
+    engine = MatchingEngine(case())
+    engine.tick(0)
+    engine.submit(order('s1', 'DARK', False, 100, 99.))
+    engine.submit(order('s2', 'DARK', False, 100, 99.))
+    engine.submit(order('s3', 'DARK', False, 100, 98.))
+    fills = engine.submit(order('b1', 'DARK', True, 150, 99.5))
+    assert fills_of(fills) == [('b1', 100, 98.), ('s3', 100, 98.), ('b1', 50, 99.), ('s1', 50, 99.)]
+    assert [f['fine'] for f in fills] == pytest.approx([10., 0., 5., 0.])
+    assert engine.cancel('s2') and not engine.cancel('s2')
+    assert engine.cancel('s1') and engine.books['DARK'].best('ask') is None
+
+# A custom order trades as a taker against our resting orders when it goes live, and our orders take it
+# at its price within both limits while it lasts
+def test_custom_orders():
+    engine = MatchingEngine(case())
+    engine.tick(1)
+    engine.submit(order('s1', 'DARK', False, 300, 103.))
+    engine.tick(2)
+    assert fills_of(engine.match_resting()) == [('s1', 300, 103.)]
+    assert fills_of(engine.submit(order('s2', 'DARK', False, 200, 105.))) == []
+    assert fills_of(engine.submit(order('s3', 'DARK', False, 200, 101.))) == [('s3', 200, 104.)]
+    engine.tick(3)
+    # s2 stays above the custom order's limit
+    assert engine.match_resting() == []
+    engine.tick(4)
+    assert fills_of(engine.submit(order('s4', 'DARK', False, 100, 101.))) == []
+    assert engine.customs == []
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from news_model import NewsModel
+
+C = 1 / 25000.
+SOURCES = ['a', 'b', 'c']
+
+# Normal-Inverse-Gamma posterior after observing ys, from the prior (mu, kappa, alpha, beta)
+def closed_form(prior, ys):
+    mu0, kappa0, alpha0, beta0 = prior
+    ys = np.asarray(ys, dtype=float)
+    n = len(ys)
+    if not n:
+        return prior
+    ybar = ys.mean()
+    kappa = kappa0 + n
+    return ((kappa0 * mu0 + n * ybar) / kappa, kappa, alpha0 + n / 2,
+            beta0 + 0.5 * ((ys - ybar) ** 2).sum() + kappa0 * n * (ybar - mu0) ** 2 / (2 * kappa))
+
+def posterior(model, source):
+    i = model.index[source]
+    return model.mu[i], model.kappa[i], model.alpha[i], model.beta[i]
+
+# One batched update, and the same impacts folded in one at a time, both match the closed form
+def test_posterior_matches_closed_form():
+    rng = np.random.default_rng(0)
+    ys = {'a': rng.normal(0.9, 0.3, 7), 'b': rng.normal(-0.2, 1., 3), 'c': []}
+    batch, single = NewsModel(SOURCES, C), NewsModel(SOURCES, C)
+    sources = np.array([SOURCES.index(s) for s in SOURCES for _ in ys[s]], dtype=int)
+    batch.observe(sources, np.concatenate([ys[s] for s in SOURCES]))
+    for i, y in zip(sources, np.concatenate([ys[s] for s in SOURCES])):
+        single.observe(np.array([i]), np.array([y]))
+    for source in SOURCES:
+        expected = closed_form(batch.prior, ys[source])
+        assert posterior(batch, source) == pytest.approx(expected)
+        assert posterior(single, source) == pytest.approx(expected)
+    assert list(batch.observations) == [7, 3, 0]
+    assert batch.impact('c') == batch.prior[0]
+    assert batch.noise_var()[2] == pytest.approx(1.)
+
+# Items are measured once their lag has passed, as the LIT move over C times the signed amount
+def test_evaluate_waits_for_lag():
+    model = NewsModel(SOURCES, C, lag=9)
+    model.push('a', 5000, True, 10, 100.)
+    model.push('b', 2500, False, 12, 100.)
+    model.push('unknown', 1000, True, 10, 100.)
+    model.push('a', 0, True, 10, 100.)
+    assert len(model.pending) == 2
+    assert model.evaluate(18, 100.1) == 0
+    assert model.evaluate(20, 100.1) == 1
+    assert posterior(model, 'a') == pytest.approx(closed_form(model.prior, [0.1 / (C * 5000)]))
+    assert model.evaluate(30, 99.9) == 1 and not model.pending
+    assert posterior(model, 'b') == pytest.approx(closed_form(model.prior, [-0.1 / (C * -2500)]))
+
+# A batch rebuild measures each item at the price standing at its due time, leaves items not yet due
+# queued, and keeps the posteriors when the price series no longer reaches back to the oldest item
+def test_reestimate():
+    model = NewsModel(SOURCES, C, lag=9)
+    history = [['a', 5000, 'buy', 10, 100.], ['b', 2500, 'sell', 12, 100.], ['a', 5000, 'sell', 40, 101.]]
+    for source, amount, action, t, price in history:
+        model.push(source, amount, action == 'buy', t, price)
+    times = np.arange(0., 45.)
+    prices = 100. + 0.01 * times
+    model.evaluate(44, prices[-1])
+    assert len(model.pending) == 1
+    assert model.reestimate(history, times, prices)
+    assert posterior(model, 'a') == pytest.approx(closed_form(model.prior, [(prices[19] - 100.) / (C * 5000)]))
+    assert posterior(model, 'b') == pytest.approx(closed_form(model.prior, [(prices[21] - 100.) / (C * -2500)]))
+    assert len(model.pending) == 1
+    model.evaluate(49, 101.)
+    assert list(model.observations) == [2, 1, 0]
+
+    before = model.mu.copy(), model.observations.copy()
+    assert not model.reestimate(history, times[20:], prices[20:])
+    assert np.array_equal(model.mu, before[0]) and np.array_equal(model.observations, before[1])
+    assert not model.reestimate(history, times[:0], prices[:0])
@@ -0,0 +1,38 @@
+import math
+import pytest
+from order_book import OrderBook
+
+# Book from {price: quantity} sides, sent as the server sends them
+def book(bids, asks):
+    b = OrderBook('X')
+    b.update({str(p): q for p, q in bids.items()}, {str(p): q for p, q in asks.items()})
+    return b
+
+def test_touch():
+    b = book({9.5: 10, 9.8: 5, 9.0: 1}, {10.2: 3, 10.0: 7})
+    assert (b.best_bid, b.best_ask) == (9.8, 10.0)
+    assert b.spread == pytest.approx(0.2) and b.mid == pytest.approx(9.9)
+    assert list(b.walk('bid')) == [(9.8, 5), (9.5, 10), (9.0, 1)]
+    assert list(b.walk('ask')) == [(10.0, 7), (10.2, 3)]
+    empty = book({}, {})
+    assert math.isnan(empty.best_bid) and math.isnan(empty.spread)
+
+# Updates are full snapshots: levels that disappear or go to zero are removed, changed ones replaced
+def test_update_diffs_snapshots():
+    b = book({9.5: 10, 9.8: 5}, {10.0: 7})
+    b.update({'9.5': 4, '9.7': 2, '9.8': 0}, {})
+    assert list(b.walk('bid')) == [(9.7, 2), (9.5, 4)]
+    assert b.prices['ask'] == [] and math.isnan(b.best_ask)
+    b.update({'9.5': 4}, {'10.1': 1})
+    assert b.levels == {'bid': {9.5: 4}, 'ask': {10.1: 1}}
+
+# depth walks out from the touch: (quantity available, average price, worst price)
+def test_depth():
+    b = book({9.8: 5, 9.5: 10}, {10.0: 7, 10.2: 3})
+    assert b.depth('ask', 5) == (5, 10.0, 10.0)
+    filled, avg, worst = b.depth('ask', 9)
+    assert (filled, worst) == (9, 10.2) and avg == pytest.approx((7 * 10.0 + 2 * 10.2) / 9)
+    filled, avg, worst = b.depth('bid', 100)
+    assert (filled, worst) == (15, 9.5) and avg == pytest.approx((5 * 9.8 + 10 * 9.5) / 15)
+    filled, avg, worst = b.depth('bid', 0)
+    assert filled == 0 and math.isnan(avg) and math.isnan(worst)
@@ -0,0 +1,137 @@
+from collections import Counter
+import pytest
+import order_manager
+from order_manager import OrderManager
+from backtest import SimOrder
+
+CASE_META = {
+    'max_open_orders': 4,
+    'securities': {'A': {'minimum_order_size': 10, 'maximum_order_size': 100, 'underlyings': {'U': 1}},
+                   'B': {'maximum_order_size': 100, 'underlyings': {'U': -2}}},
+    'underlyings': {'U': {'limit': 150}},
+}
+
+def manager():
+    m = OrderManager()
+    m.configure(CASE_META)
+    return m
+
+# The running working totals must equal a recount from the orders themselves
+def assert_counted(m):
+    working = Counter({k: v for k, v in m.working_quant.items() if v})
+    m.recount()
+    assert working == Counter({k: v for k, v in m.working_quant.items() if v})
+
+# Sends this callback's batch; returns what went on the wire
+def flush(m, elapsed=0.):
+    m.seen({'elapsed_time': elapsed})
+    order = SimOrder()
+    m.flush(order)
+    return order
+
+# ACK MODIFY ORDERS, TRADER UPDATE and an acked copy of a sent order, as the server sends them
+def ack(*orders, cancels=None, elapsed=0.):
+    return {'elapsed_time': elapsed, 'orders': list(orders), 'cancels': cancels or {}}
+
+def acked(o, order_id, **fields):
+    return dict(o, order_id=order_id, **fields)
+
+def trader_update(positions, open_orders, elapsed=0.):
+    return {'elapsed_time': elapsed, 'trader_state': {'positions': positions, 'open_orders': open_orders}}
+
+def test_case_limits():
+    m = manager()
+    assert not m.buy('A', 5, 1.) and not m.buy('A', 101, 1.)
+    assert m.buy('A', 100, 1.)
+    # a sell of B adds +2 per share to U on top of the A buy working
+    assert not m.sell('B', 30, 1.)
+    assert m.sell('B', 25, 1.) and m.working('B', False) == 25
+    assert m.sell('A', 100, 1.) and m.sell('A', 10, 1.)
+    assert not m.buy('B', 10, 1.)
+    assert m.rejected == Counter({'below minimum order size': 1, 'above maximum order size': 1,
+                                  'breaches U limit': 1, 'too many open orders': 1})
+    assert_counted(m)
+
+# add_all queues every leg or none
+def test_add_all_is_all_or_nothing():
+    m = manager()
+    assert not m.add_all([('A', True, 50, 1.), ('B', False, 80, 1.)])
+    assert m.batch == [] and not +m.working_quant
+    assert m.add_all([('A', True, 50, 1.), ('B', False, 50, 1.)]) and len(m.batch) == 2
+    assert_counted(m)
+
+# Acks answer the order they carry the token of, even when another pending order looks the same
+def test_ack_matches_token():
+    m = manager()
+    m.add('A', True, 20, 1., token='x')
+    m.add('A', True, 20, 1., token='y')
+    sent = flush(m).orders
+    m.on_ack(ack(acked(sent[1], 'o2')))
+    assert [p['token'] for p in m.pending] == ['x']
+    assert order_manager.acked_as({'ticker': 'A', 'buy': True, 'quantity': 20, 'price': 1., 'token': None},
+                                  {'ticker': 'A', 'buy': True, 'quantity': 20, 'price': 1.})
+    assert not order_manager.acked_as(sent[0], sent[1])
+    assert_counted(m)
+
+# Without tokens an ack matches by fields, and a rejected order stops working
+def test_ack_by_fields_and_errors():
+    m = manager()
+    m.buy('A', 20, 1.)
+    m.sell('A', 30, 2.)
+    sent = flush(m).orders
+    m.on_ack(ack(dict(sent[1], order_id='o1'), dict(sent[0], error='rejected')))
+    assert m.pending == [] and list(m.open) == ['o1']
+    assert m.working('A', True) == 0 and m.working('A', False) == 30
+    assert_counted(m)
+
+def test_fills_and_cancels():
+    m = manager()
+    m.buy('A', 50, 1.)
+    sent = flush(m).orders
+    m.on_ack(ack(acked(sent[0], 'o1')))
+    fills = m.on_trade({'trades': [{'buy_order_id': 'o1', 'sell_order_id': 'z', 'quantity': 20, 'price': 1.}]})
+    assert fills == [('A', 20, 1.)] and m.position('A') == 20 and m.working('A', True) == 30
+    m.cancel_where(lambda o: o['buy'])
+    assert m.working('A', True) == 0 and m.open_count() == 0
+    cancels = flush(m).cancels
+    assert cancels == [{'ticker': 'A', 'order_id': 'o1'}] and m.working('A', True) == 30
+    m.on_ack(ack(cancels={'o1': None}))
+    assert m.open == {} and m.working('A', True) == 0
+    assert_counted(m)
+
+# An order the TRADER UPDATE already lists is acked afterwards: the listed one is kept. Listed as sent
+# it stops pending at once; part filled it no longer matches by fields, so it also counts as pending
+# (overstating what is working) until the ack
+def test_late_ack_after_trader_update():
+    m = manager()
+    m.buy('A', 50, 1.)
+    sent = flush(m).orders
+    m.on_trader_update(trader_update({}, {'o1': acked(sent[0], 'o1')}))
+    assert m.pending == [] and m.working('A', True) == 50
+    m.on_ack(ack(acked(sent[0], 'o1')))
+    assert list(m.open) == ['o1'] and m.working('A', True) == 50
+    assert_counted(m)
+
+    m = manager()
+    m.buy('A', 50, 1.)
+    sent = flush(m).orders
+    m.on_trader_update(trader_update({'A': 20}, {'o1': acked(sent[0], 'o1', quantity=30)}))
+    assert len(m.pending) == 1 and m.working('A', True) == 80
+    m.on_ack(ack(acked(sent[0], 'o1')))
+    assert m.open['o1']['quantity'] == 30 and m.working('A', True) == 30
+    assert_counted(m)
+
+# An order sent after the server built the update is not in it: it stays pending until its ack,
+# or is dropped once it has gone ACK_TIMEOUT without one
+def test_trader_update_before_ack():
+    m = manager()
+    m.buy('A', 50, 1.)
+    m.sell('A', 10, 3.)
+    sent = flush(m, elapsed=10.).orders
+    m.on_trader_update(trader_update({}, {}, elapsed=10.5))
+    assert len(m.pending) == 2 and m.working('A', True) == 50
+    m.on_ack(ack(acked(sent[0], 'o1'), elapsed=11.))
+    assert list(m.open) == ['o1'] and len(m.pending) == 1
+    m.on_trader_update(trader_update({}, {'o1': acked(sent[0], 'o1')}, elapsed=10. + order_manager.ACK_TIMEOUT + 1))
+    assert m.pending == [] and m.working('A', False) == 0 and m.working('A', True) == 50
+    assert_counted(m)
@@ -0,0 +1,68 @@
+import math
+import pickle
+import random
+import numpy as np
+import pytest
+from rolling import RollingBands
+
+def approx(x):
+    return pytest.approx(x, rel=1e-9, abs=1e-9)
+
+# Window mean and sample std (pandas' rolling().std()) recomputed from scratch
+def reference(values, window):
+    last = np.array(values[-window:])
+    return last.mean(), (last.std(ddof=1) if len(last) > 1 else math.nan)
+
+def test_matches_recomputed_window():
+    rng = random.Random(3)
+    bands = RollingBands(20, width=2)
+    values = []
+    for _ in range(2000):
+        x = 100 + rng.gauss(0, 5)
+        values.append(x)
+        bands.update(x)
+        mean, std = reference(values, 20)
+        assert bands.mean == approx(mean)
+        if math.isnan(std):
+            assert math.isnan(bands.std)
+        else:
+            assert bands.std == approx(std)
+            assert bands.upper == approx(mean + 2 * std)
+            assert bands.lower == approx(mean - 2 * std)
+
+# Previous bands are those before the latest update
+def test_keeps_previous_bands():
+    bands = RollingBands(3)
+    for x in (1., 2., 4.):
+        bands.update(x)
+    before = (bands.mean, bands.std, bands.upper, bands.lower)
+    bands.update(8.)
+    assert (bands.prev_mean, bands.prev_std, bands.prev_upper, bands.prev_lower) == before
+    assert len(bands) == 3
+
+# A window that has gone flat has exactly its price as mean and zero std, after prices far from it
+def test_flat_window_is_exact():
+    bands = RollingBands(5)
+    for x in (1e6, 3.3, 1e-3, 7.1, 12345.678):
+        bands.update(x)
+    for _ in range(5):
+        bands.update(0.1)
+    assert bands.mean == 0.1 and bands.std == 0. and bands.upper == bands.lower == 0.1
+    bands.update(0.2)
+    mean, std = reference([0.1] * 4 + [0.2], 5)
+    assert bands.mean == approx(mean) and bands.std == approx(std)
+
+# Pickles round-trip, and ones taken before the shift was kept restore and carry on updating
+def test_pickle_and_old_state():
+    bands = RollingBands(4)
+    for x in (5., 6., 7.):
+        bands.update(x)
+    copy = pickle.loads(pickle.dumps(bands))
+    assert copy.update(9.).mean == bands.update(9.).mean
+    old = RollingBands(4)
+    state = {k: v for k, v in bands.__dict__.items() if k not in ('shift', 'shifted_mean', 'run')}
+    state['m2'] = bands.m2
+    old.__setstate__(state)
+    old.update(3.)
+    mean, std = reference([6., 7., 9., 3.], 4)
+    assert old.mean == approx(mean) and old.std == approx(std)
@@ -0,0 +1,129 @@
+import time
+from collections import Counter
+import runtime
+from runtime import Runtime, Strategy, allocate, split
+from backtest import SimOrder
+
+META = {'case_length': 450, 'securities': {
+    'X': {'tradeable': True, 'starting_price': 10., 'minimum_order_size': 1, 'maximum_order_size': 40},
+    'Y': {'tradeable': True, 'starting_price': 20., 'minimum_order_size': 1, 'maximum_order_size': 1000}}}
+
+# Records the fills the runtime reports to it
+class Recorder(Strategy):
+    def __init__(self, name, **budget):
+        super().__init__(name, **budget)
+        self.fills = []
+        self.news = 0
+
+    def on_trade(self, market, fills):
+        self.fills += fills
+
+    def on_news(self, market, news):
+        self.news += 1
+
+# A news hook that always takes some CPU time
+class Slow(Recorder):
+    def on_news(self, market, news):
+        start = time.thread_time()
+        while time.thread_time() == start:
+            pass
+        self.news += 1
+
+def start(*strategies, cpu=0.1):
+    rt = Runtime(strategies, cpu=cpu)
+    rt.on_register({'elapsed_time': 0, 'case_meta': META, 'market_states': {}}, SimOrder())
+    return rt
+
+def flush(rt):
+    order = SimOrder()
+    rt.flush(order)
+    return order
+
+# The running working totals must equal a recount from the intents and orders themselves
+def assert_counted(rt):
+    quant, total = +rt.working_quant, +rt.working_total
+    rt.recount()
+    assert (quant, total) == (+rt.working_quant, +rt.working_total)
+
+def ack(rt, order, ids, elapsed=0):
+    rt.on_ack({'elapsed_time': elapsed, 'orders': [dict(o, order_id=i) for o, i in zip(order.orders, ids)],
+               'cancels': {}}, SimOrder())
+
+# Crossing buys and sells between strategies fill internally at the midpoint; the rest is merged into one
+# order per side and price, split at the case's maximum order size
+def test_crosses_then_merges():
+    a, b, c = Recorder('a'), Recorder('b'), Recorder('c')
+    rt = start(a, b, c)
+    assert a.buy('X', 50, 10.2) and b.sell('X', 30, 10.) and c.buy('X', 30, 10.2)
+    order = flush(rt)
+    assert a.fills == [('X', 30, 10.1)] and b.fills == [('X', -30, 10.1)] and c.fills == []
+    assert (a.position('X'), b.position('X')) == (30, -30) and rt.crossed == 30
+    assert [(o['buy'], o['quantity'], o['price']) for o in order.orders] == [(True, 40, 10.2), (True, 10, 10.2)]
+    assert [s['shares'] for s in rt.sent] == [{a: 20, c: 20}, {c: 10}]
+    assert (a.working('X', True), c.working('X', True), rt.working(b)) == (20, 30, 0)
+    assert_counted(rt)
+
+# Fills of a shared order are booked pro rata; withdrawing one strategy cancels the whole order and,
+# once the cancel is confirmed, sends the other strategies' shares again
+def test_fills_and_shared_cancels():
+    a, c = Recorder('a'), Recorder('c')
+    rt = start(a, c)
+    a.buy('Y', 60, 19.)
+    c.buy('Y', 20, 19.)
+    order = flush(rt)
+    ack(rt, order, ['o1'])
+    rt.on_trade({'elapsed_time': 1, 'trades': [{'ticker': 'Y', 'buy_order_id': 'o1', 'sell_order_id': 'z',
+                                                'quantity': 40, 'price': 19.}]}, SimOrder())
+    assert (a.position('Y'), c.position('Y')) == (30, 10) and c.fills == [('Y', 10, 19.)]
+    assert (a.working('Y', True), c.working('Y', True)) == (30, 10)
+    assert_counted(rt)
+    a.cancel('Y')
+    assert a.working('Y', True) == 0 and c.working('Y', True) == 10 and a.orders() == []
+    assert flush(rt).cancels == [{'ticker': 'Y', 'order_id': 'o1'}]
+    order = SimOrder()
+    rt.on_ack({'elapsed_time': 2, 'orders': [], 'cancels': {'o1': None}}, order)
+    assert [(o['quantity'], o['price']) for o in order.orders] == [(10, 19.)]
+    assert rt.sent[0]['shares'] == {c: 10} and c.working('Y', True) == 10
+    assert_counted(rt)
+
+# Orders neither acked nor listed stop counting once ACK_TIMEOUT has passed
+def test_unacked_orders_expire():
+    a = Recorder('a')
+    rt = start(a)
+    a.sell('Y', 100, 21.)
+    flush(rt)
+    update = {'trader_state': {'positions': {}, 'open_orders': {}}}
+    rt.on_trader_update(dict(update, elapsed_time=runtime.ACK_TIMEOUT), SimOrder())
+    assert a.working('Y', False) == 100
+    rt.on_trader_update(dict(update, elapsed_time=runtime.ACK_TIMEOUT + 1), SimOrder())
+    assert a.working('Y', False) == 0 and rt.sent == []
+    assert_counted(rt)
+
+def test_strategy_budgets():
+    a = Recorder('a', limit=100, max_gross=200)
+    rt = start(a)
+    assert a.buy('X', 80, 10.) and not a.buy('X', 30, 10.)
+    assert a.sell('X', 100, 11.) and not a.sell('X', 101, 11.)
+    assert not a.sell('Y', 30, 20.) and not a.buy('Z', 1, 1.) and not a.buy('X', 0)
+    assert a.rejected == Counter({'position limit': 2, 'gross limit': 1, 'unknown ticker': 1,
+                                  'non-positive quantity': 1})
+    assert_counted(rt)
+
+# A hook is skipped while the strategy's credit is below what it usually costs, even when that is more than
+# a full burst, and runs again once the credit has refilled
+def test_cpu_cap_skips_hooks():
+    slow, cheap = Slow('slow'), Recorder('cheap')
+    rt = start(slow, cheap, cpu=0.001)
+    slow.costs['on_news'] = 1.
+    for _ in range(3):
+        rt.on_news({'elapsed_time': 1, 'news': {}}, SimOrder())
+    assert (slow.news, slow.skipped) == (1, 2) and (cheap.news, cheap.skipped) == (3, 0)
+    rt.on_news({'elapsed_time': 1 + runtime.BURST_SECONDS, 'news': {}}, SimOrder())
+    assert slow.news == 2
+
+# Fills are shared pro rata with the largest remainders rounded up, and taken off the shares
+def test_allocate_and_split():
+    shares = {'a': 5, 'b': 3, 'c': 2}
+    assert allocate(shares, 5) == {'a': 3, 'b': 1, 'c': 1} and shares == {'a': 2, 'b': 2, 'c': 1}
+    assert allocate(shares, 9) == {'a': 2, 'b': 2, 'c': 1} and shares == {}
+    assert split({'a': 25, 'b': 20}, 20) == [{'a': 20}, {'a': 5, 'b': 15}, {'b': 5}]
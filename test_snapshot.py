@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from snapshot import SnapshotWriter, SnapshotReader
+
+TICKERS = ['T80C', 'T80P', 'T90C']
+
+@pytest.fixture
+def writer(request):
+    w = SnapshotWriter('snaptest_%d_%s' % (os.getpid(), request.node.name[:20]), TICKERS,
+                       strikes=[80., 80., 90.], calls=[1, 0, 1])
+    yield w
+    w.close()
+
+def test_round_trip(writer):
+    reader = SnapshotReader(writer.name)
+    try:
+        assert reader.read() is None
+        writer.publish({'price': [1., 2., 3.], 'iv': np.array([0.2, 0.3, 0.4])}, spot=85., pnl=10.)
+        seq, summary, rows = reader.read()
+        assert seq == 2 and summary['spot'] == 85. and summary['pnl'] == 10. and np.isnan(summary['delta'])
+        assert list(rows['ticker']) == [t.encode() for t in TICKERS] and list(rows['strike']) == [80., 80., 90.]
+        assert list(rows['price']) == [1., 2., 3.] and np.isnan(rows['vega']).all()
+        assert reader.read() is None
+        writer.publish({'price': [4., 5., 6.]})
+        seq, summary, rows = reader.read()
+        assert seq == 4 and summary['spot'] == 85. and list(rows['iv']) == [0.2, 0.3, 0.4]
+    finally:
+        reader.close()
+
+# Stands in for the summary view: the writer starts an update while the reader is copying it out
+class Interrupted:
+    def __init__(self, writer, summary):
+        self.writer, self.summary = writer, summary
+        self.copies = 0
+
+    def copy(self):
+        self.copies += 1
+        if self.copies == 1:
+            self.writer.publish({'price': [7., 7., 7.]})
+        return self.summary.copy()
+
+# A read never keeps a copy taken while the sequence was odd or changed under it
+def test_reader_skips_torn_updates(writer):
+    reader = SnapshotReader(writer.name)
+    try:
+        writer.publish({'price': [1., 1., 1.]})
+        writer.header['seq'] += 1
+        assert reader.read(attempts=5) is None
+        writer.header['seq'] += 1
+        reader.summary = Interrupted(writer, reader.summary)
+        seq, _, rows = reader.read()
+        assert seq == 6 and reader.summary.copies == 2 and list(rows['price']) == [7., 7., 7.]
+    finally:
+        reader.close()
+
+# Under a writer publishing as fast as it can, every update read has all its fields from one publish.
+# A tiny switch interval lets the threads interleave inside publish() and read()
+def test_concurrent_reads_are_consistent(writer):
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    reader = SnapshotReader(writer.name)
+    stop = threading.Event()
+    def publish():
+        k = 0
+        while not stop.is_set():
+            k += 1
+            writer.publish({field: np.full(len(TICKERS), float(k)) for field in ('price', 'iv', 'delta', 'vega')},
+                           spot=float(k), pnl=float(k))
+    thread = threading.Thread(target=publish)
+    thread.start()
+    reads = 0
+    try:
+        while reads < 50:
+            got = reader.read()
+            if got is None:
+                continue
+            _, summary, rows = got
+            k = summary['spot']
+            assert summary['pnl'] == k
+            for field in ('price', 'iv', 'delta', 'vega'):
+                assert (rows[field] == k).all()
+            reads += 1
+    finally:
+        stop.set()
+        thread.join()
+        reader.close()
+        sys.setswitchinterval(interval)
+
+def test_rejects_other_segments_and_replaces_stale_ones(writer):
+    other = shared_memory.SharedMemory(create=True, size=64)
+    try:
+        with pytest.raises(ValueError):
+            SnapshotReader(other.name)
+    finally:
+        other.close()
+        other.unlink()
+    stale = shared_memory.SharedMemory(writer.name)
+    again = SnapshotWriter(writer.name, TICKERS[:1])
+    try:
+        reader = SnapshotReader(writer.name)
+        assert len(reader.rows) == 1
+        reader.close()
+    finally:
+        stale.close()
+        again.close()
@@ -0,0 +1,26 @@
+import sys
+import json
+import subprocess
+import pytest
+import bench
+
+# Modules a bot only needs once a feature is switched on, or only when run as a script
+OPTIONAL = ('tradersbot', 'tornado', 'conflation', 'recorder', 'checkpoint', 'scenario_risk', 'bs_grid',
+            'snapshot', 'scipy.stats')
+# run in a fresh interpreter: imports a bot and lists what got loaded
+IMPORT_SCRIPT = '''
+import sys, json
+sys.path.insert(0, sys.argv[1])
+__import__(sys.argv[2])
+print(json.dumps(sorted(sys.modules)))
+'''
+
+# Import, register and first tick of each bot in fresh interpreters, against bench.py's targets
+def test_startup_within_targets():
+    assert bench.startup_misses(bench.startup(41)) == []
+
+@pytest.mark.parametrize('module', ['shen_wang_options', 'shen_wang_algost'])
+def test_optional_modules_not_imported(module):
+    out = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT, bench.HERE, module], cwd=bench.HERE)
+    loaded = set(json.loads(out.decode().strip().splitlines()[-1]))
+    assert loaded.isdisjoint(OPTIONAL)